@@ -0,0 +1,97 @@
+"""
+Regression benchmark for segmentation.extract_brain_mask.
+
+Runs the current OpenCV implementation against the original SciPy one
+(kept below as the reference) on every scan of brain_tumor_dataset and
+reports the mask agreement (Dice) and the runtime of both.
+
+    python benchmarks/brain_extraction.py [--min-dice 0.98] [--limit N]
+
+Exits with status 1 if any scan falls below --min-dice.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from scipy.ndimage import binary_fill_holes, binary_erosion, label
+from skimage import img_as_float
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+import segmentation  # noqa: E402
+
+
+def reference_brain_mask(image):
+    """The original dense-kernel SciPy pipeline."""
+    mean_val = image[image > 0].mean()
+    binary_head_mask = image > mean_val * 0.5
+    filled_mask = binary_fill_holes(binary_head_mask)
+    struct_el = np.ones((15, 15))
+    brain_mask = binary_erosion(filled_mask, structure=struct_el, iterations=2)
+    labels, _ = label(brain_mask)
+    if labels.max() == 0: return brain_mask
+    largest_comp_label = np.argmax(np.bincount(labels.flat)[1:]) + 1
+    final_brain_mask = labels == largest_comp_label
+    shrink_struct = np.ones((10, 10))
+    return binary_erosion(final_brain_mask, structure=shrink_struct)
+
+
+def dice(a, b):
+    total = np.count_nonzero(a) + np.count_nonzero(b)
+    return 1.0 if total == 0 else 2.0 * np.count_nonzero(a & b) / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=os.path.join(ROOT, "brain_tumor_dataset"))
+    parser.add_argument("--min-dice", type=float, default=0.98)
+    parser.add_argument("--limit", type=int, default=0, help="Only the first N scans (0 = all)")
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.dataset, "*", "*")))
+    if args.limit:
+        files = files[:args.limit]
+
+    rows = []
+    for path in files:
+        bgr = cv2.imread(path)
+        if bgr is None:
+            continue
+        image = img_as_float(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+
+        t0 = time.perf_counter()
+        expected = reference_brain_mask(image)
+        t1 = time.perf_counter()
+        actual = segmentation.extract_brain_mask(image)
+        t2 = time.perf_counter()
+        rows.append((dice(expected, actual), max(image.shape), os.path.relpath(path, args.dataset), t1 - t0, t2 - t1))
+
+    if not rows:
+        print(f"❌ No scans found in {args.dataset}")
+        return 1
+
+    scores = np.array([r[0] for r in rows])
+    t_ref = sum(r[3] for r in rows)
+    t_new = sum(r[4] for r in rows)
+    print(f"Scans:       {len(rows)}")
+    print(f"Identical:   {int(np.sum(scores == 1.0))}")
+    print(f"Dice:        mean {scores.mean():.4f}, min {scores.min():.4f}")
+    print(f"Reference:   {t_ref:.2f} s ({1e3 * t_ref / len(rows):.1f} ms/scan)")
+    print(f"Current:     {t_new:.2f} s ({1e3 * t_new / len(rows):.1f} ms/scan)")
+    print(f"Speedup:     {t_ref / max(t_new, 1e-9):.1f}x")
+
+    failed = [r for r in rows if r[0] < args.min_dice]
+    for score, size, name, _, _ in sorted(failed):
+        print(f"❌ {name} ({size} px): Dice {score:.4f}")
+    if failed:
+        return 1
+    print(f"✅ All masks within Dice >= {args.min_dice}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
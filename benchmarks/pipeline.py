@@ -0,0 +1,396 @@
+"""
+Stage-by-stage benchmark of the OncoSim compute pipeline.
+
+Times every compute stage on a sample of brain_tumor_dataset scans and on
+synthetic phantoms of several sizes, and writes one JSON record per
+(stage, input) with the run times, throughput and peak RSS:
+
+    extract_brain_mask, anisotropic_diffusion,
+    generate_tumor_proposal_with_hybrid_score, refine_with_multiphase_pde,
+    measure_tumor_advanced, simulate_tumor_growth_fast, generate_heatmap,
+    generate_pdf_report
+
+Inputs for each stage are produced once by the stages before it (the same
+steps detect_tumor runs), so every stage is timed on realistic data. On
+platforms with fork, every (stage, input) runs in its own child process, so
+its peak RSS is not hidden by an earlier, larger stage. rss_delta_mb is the
+growth over the RSS the child started with.
+
+    python benchmarks/pipeline.py [--scans 12] [--sizes 256 512 1024] [--repeat 3]
+    python benchmarks/pipeline.py --save-baseline            # store benchmarks/baseline.json
+    python benchmarks/pipeline.py --compare                  # run, then gate against the baseline
+    python benchmarks/pipeline.py --compare --current out.json   # gate an existing result file
+
+In compare mode a (stage, input) regresses when its median time grows by
+more than --tolerance, or its RSS growth by more than --rss-tolerance (and
+at least RSS_NOISE_MB). Exits with status 1 on any regression.
+Note: simulate_tumor_growth_fast includes the short sleeps it yields to the
+GUI with (10 ms every 20 steps).
+"""
+import argparse
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from scipy.ndimage import binary_fill_holes
+from skimage import img_as_float
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+import segmentation  # noqa: E402
+import tumor_measurement  # noqa: E402
+import tumor_growth_model  # noqa: E402
+import heatmap_engine  # noqa: E402
+import report_generator  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+STAGES = [
+    "extract_brain_mask",
+    "anisotropic_diffusion",
+    "generate_tumor_proposal_with_hybrid_score",
+    "refine_with_multiphase_pde",
+    "measure_tumor_advanced",
+    "simulate_tumor_growth_fast",
+    "generate_heatmap",
+    "generate_pdf_report",
+]
+GROWTH_PARAMS = {'D': 0.8, 'rho': 0.5, 'beta': 0.1, 'time_scale': 'hours'}
+GROWTH_HOURS = 10
+RSS_NOISE_MB = 5.0
+
+
+# =============================================================================
+#  INPUTS
+# =============================================================================
+
+def make_phantom(size, seed=0):
+    """
+    Synthetic axial T1-like slice (BGR uint8): skull ring, textured brain,
+    two dark ventricles and a bright ring-enhancing tumor.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size].astype(np.float32) / size - 0.5
+    r_head = np.hypot(xx / 0.42, yy / 0.46)
+
+    image = np.zeros((size, size), dtype=np.float32)
+    image[r_head < 1.0] = 0.85                                   # Skull / scalp
+    texture = cv2.GaussianBlur(rng.normal(0, 1, (size, size)).astype(np.float32), (0, 0), size / 128)
+    brain = r_head < 0.9
+    image[brain] = 0.45 + 0.05 * texture[brain] / (texture.std() + 1e-9)
+    for cx in (-0.06, 0.06):                                     # Ventricles
+        image[np.hypot((xx - cx) / 0.04, (yy + 0.02) / 0.12) < 1.0] = 0.12
+    r_tumor = np.hypot((xx - 0.16) / 0.09, (yy + 0.12) / 0.07)
+    image[r_tumor < 1.0] = 0.7
+    image[(r_tumor >= 0.75) & (r_tumor < 1.0)] = 0.95           # Enhancing rim
+    image += rng.normal(0, 0.01, image.shape).astype(np.float32)
+
+    gray = (np.clip(image, 0, 1) * 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def load_inputs(dataset, n_scans, sizes):
+    """[(name, BGR image)]: n_scans spread evenly over the dataset, then one phantom per size."""
+    inputs = []
+    files = sorted(glob.glob(os.path.join(dataset, "*", "*")))
+    if n_scans and files:
+        picks = np.unique(np.linspace(0, len(files) - 1, min(n_scans, len(files))).astype(int))
+        for i in picks:
+            bgr = cv2.imread(files[i])
+            if bgr is not None:
+                inputs.append((os.path.relpath(files[i], dataset), bgr))
+    for size in sizes:
+        inputs.append((f"phantom_{size}", make_phantom(size)))
+    return inputs
+
+
+def prepare_case(bgr):
+    """Runs the pipeline once (as detect_tumor does) for every stage's inputs; keys stop where it does."""
+    img_float = img_as_float(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+    case = {'bgr': bgr, 'img_float': img_float}
+    brain_mask = segmentation.extract_brain_mask(img_float)
+    if not np.any(brain_mask):
+        return case
+    brain_roi = segmentation.mask_bbox(brain_mask, pad=segmentation.DIFFUSION_NITER + 1)
+    brain_crop = brain_mask[brain_roi]
+    brain_only = img_float[brain_roi] * brain_crop
+    processed = segmentation.smooth_brain(brain_only, brain_crop)
+    classes = segmentation.compute_intensity_classes(processed, brain_crop)
+    case.update(brain_mask=brain_mask, brain_crop=brain_crop, brain_only=brain_only,
+                processed=processed, classes=classes)
+
+    proposal, _, _ = segmentation.generate_tumor_proposal_with_hybrid_score(processed, brain_crop, classes)
+    if proposal is None:
+        return case
+
+    processed_full = np.zeros(img_float.shape, dtype=processed.dtype)
+    processed_full[brain_roi] = processed
+    proposal_full = np.zeros(img_float.shape, dtype=bool)
+    proposal_full[brain_roi] = proposal
+    refine_roi = segmentation.mask_bbox(proposal_full, pad=segmentation.REFINE_PAD_PX)
+    box_shape = (refine_roi[0].stop - refine_roi[0].start, refine_roi[1].stop - refine_roi[1].start)
+    refine_args = (processed_full, np.where(proposal_full, -2.0, 2.0), np.where(brain_mask, -2.0, 2.0))
+    refine_kwargs = {'roi': refine_roi, 'levels': segmentation.refine_levels(box_shape)}
+    phi = segmentation.refine_with_multiphase_pde(*refine_args, **refine_kwargs)
+
+    tumor_mask = np.zeros(img_float.shape, dtype=np.uint8)
+    tumor_mask[refine_roi] = binary_fill_holes(phi[refine_roi] < 0) * 255
+    case.update(refine_args=refine_args, refine_kwargs=refine_kwargs, tumor_mask=tumor_mask,
+                brain_mask_u8=brain_mask.astype(np.uint8) * 255)
+    return case
+
+
+def stage_callable(stage, case, workdir):
+    """Zero-argument callable running one stage on a prepared case (None if the case lacks its inputs)."""
+    if stage == "extract_brain_mask":
+        return lambda: segmentation.extract_brain_mask(case['img_float'])
+    if 'processed' not in case:
+        return None
+    if stage == "anisotropic_diffusion":
+        return lambda: segmentation.smooth_brain(case['brain_only'], case['brain_crop'])
+    if stage == "generate_tumor_proposal_with_hybrid_score":
+        return lambda: segmentation.generate_tumor_proposal_with_hybrid_score(
+            case['processed'], case['brain_crop'], case['classes'])
+    if 'tumor_mask' not in case:
+        return None
+    if stage == "refine_with_multiphase_pde":
+        return lambda: segmentation.refine_with_multiphase_pde(*case['refine_args'], **case['refine_kwargs'])
+    if stage == "measure_tumor_advanced":
+        return lambda: tumor_measurement.measure_tumor_advanced(case['tumor_mask'])
+    if stage == "simulate_tumor_growth_fast":
+        return lambda: tumor_growth_model.simulate_tumor_growth_fast(
+            case['tumor_mask'], case['brain_mask_u8'], GROWTH_PARAMS, GROWTH_HOURS)
+    if stage == "generate_heatmap":
+        return lambda: heatmap_engine.generate_heatmap(case['bgr'], 60.0, 80.0, mask=case['tumor_mask'])
+    if stage == "generate_pdf_report":
+        return lambda: report_generator.generate_pdf_report(os.path.join(workdir, "report.pdf"),
+                                                            report_data(case, workdir))
+    raise ValueError(f"Unknown stage '{stage}'")
+
+
+def report_data(case, workdir):
+    """A report with the images, diagnosis and growth sections filled in."""
+    paths = {}
+    heat = heatmap_engine.generate_heatmap(case['bgr'], 60.0, 80.0, mask=case['tumor_mask'])
+    for key, image in (('raw_image', case['bgr']), ('seg_image', case['bgr']), ('heat_image', heat),
+                       ('growth_sim_image', heat)):
+        paths[key] = os.path.join(workdir, f"{key}.png")
+        cv2.imwrite(paths[key], image)
+    stats = tumor_measurement.measure_tumor_advanced(case['tumor_mask'])
+    return dict(paths, **{
+        'patient_name': "Benchmark Phantom",
+        'tumor_type': "Glioma", 'grade': "-", 'size': stats['equivalent_diameter_mm'],
+        'location': str(stats['center']), 'area': f"{stats['area_mm2']} mm²",
+        'dims': f"{stats['width_mm']} x {stats['height_mm']} mm", 'shape': "-", 'depth': "-",
+        'pathology': "Synthetic benchmark case.", 'recommendation': "-",
+        'growth_params': dict(GROWTH_PARAMS, duration=GROWTH_HOURS, growth_delta="-"),
+    })
+
+
+# =============================================================================
+#  MEASUREMENT
+# =============================================================================
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10  # bytes on macOS, KB elsewhere
+
+
+def measure(fn, repeat, warmup):
+    """Run times (s) of repeat calls after warmup calls, plus peak RSS and its growth (MB)."""
+    rss_start = _max_rss_mb()
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    rss_peak = _max_rss_mb()
+    return {
+        'times_s': times,
+        'peak_rss_mb': rss_peak,
+        'rss_delta_mb': rss_peak - rss_start if rss_peak is not None else None
+    }
+
+
+def _measure_child(fn, repeat, warmup, conn):
+    try:
+        conn.send(measure(fn, repeat, warmup))
+    except Exception as e:
+        conn.send({'error': f"{type(e).__name__}: {e}"})
+    conn.close()
+
+
+def measure_isolated(fn, repeat, warmup):
+    """measure() in a forked child (own peak RSS) where fork exists, otherwise in-process."""
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return measure(fn, repeat, warmup)
+    ctx = multiprocessing.get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_measure_child, args=(fn, repeat, warmup, sender))
+    proc.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': f"child exited with code {proc.exitcode}"}
+    proc.join()
+    return result
+
+
+def run_benchmarks(args):
+    stages = args.stages or STAGES
+    inputs = load_inputs(args.dataset, args.scans, args.sizes)
+    workdir = tempfile.mkdtemp(prefix="oncosim_bench_")
+    records = []
+    try:
+        for name, bgr in inputs:
+            case = prepare_case(bgr)
+            pixels = int(bgr.shape[0] * bgr.shape[1])
+            for stage in stages:
+                fn = stage_callable(stage, case, workdir)
+                if fn is None:
+                    continue  # No brain / no tumor: downstream stages have no input
+                result = measure_isolated(fn, args.repeat, args.warmup)
+                record = {'stage': stage, 'input': name, 'shape': list(bgr.shape[:2]), 'pixels': pixels}
+                record.update(result)
+                if 'times_s' in result:
+                    median = statistics.median(result['times_s'])
+                    record.update(median_s=median, min_s=min(result['times_s']),
+                                  throughput_per_s=1.0 / median if median > 0 else None,
+                                  megapixels_per_s=pixels / 1e6 / median if median > 0 else None)
+                    print(f"{stage:<44} {name:<28} {1e3 * median:9.2f} ms"
+                          + (f"  {record['rss_delta_mb']:7.1f} MB" if record['rss_delta_mb'] is not None else ""))
+                else:
+                    print(f"❌ {stage} on {name}: {result['error']}")
+                records.append(record)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'sizes': args.sizes,
+            'scans': args.scans
+        },
+        'results': records,
+        'summary': summarize(records)
+    }
+
+
+def summarize(records):
+    """Per stage: inputs timed, total median time, mean throughput and largest RSS growth."""
+    summary = {}
+    for stage in STAGES:
+        rows = [r for r in records if r['stage'] == stage and 'median_s' in r]
+        if not rows:
+            continue
+        deltas = [r['rss_delta_mb'] for r in rows if r['rss_delta_mb'] is not None]
+        summary[stage] = {
+            'inputs': len(rows),
+            'total_median_s': round(sum(r['median_s'] for r in rows), 6),
+            'mean_megapixels_per_s': round(float(np.mean([r['megapixels_per_s'] for r in rows])), 3),
+            'max_rss_delta_mb': round(max(deltas), 1) if deltas else None
+        }
+    return summary
+
+
+# =============================================================================
+#  BASELINE COMPARISON
+# =============================================================================
+
+def compare(baseline, current, tolerance, rss_tolerance):
+    """Prints a regression report; returns the list of regressions."""
+    base = {(r['stage'], r['input']): r for r in baseline['results'] if 'median_s' in r}
+    regressions = []
+    for r in current['results']:
+        key = (r['stage'], r['input'])
+        if 'median_s' not in r:
+            regressions.append((key, f"failed: {r.get('error')}"))
+            continue
+        if key not in base:
+            print(f"🆕 {key[0]} on {key[1]}: not in baseline")
+            continue
+        old = base[key]
+        ratio = r['median_s'] / old['median_s'] if old['median_s'] > 0 else 1.0
+        if ratio > 1.0 + tolerance:
+            regressions.append((key, f"time {1e3 * old['median_s']:.2f} -> {1e3 * r['median_s']:.2f} ms "
+                                     f"({ratio:.2f}x)"))
+        if r.get('rss_delta_mb') is not None and old.get('rss_delta_mb') is not None:
+            growth = r['rss_delta_mb'] - old['rss_delta_mb']
+            if growth > RSS_NOISE_MB and r['rss_delta_mb'] > old['rss_delta_mb'] * (1.0 + rss_tolerance):
+                regressions.append((key, f"RSS {old['rss_delta_mb']:.1f} -> {r['rss_delta_mb']:.1f} MB"))
+
+    missing = set(base) - {(r['stage'], r['input']) for r in current['results']}
+    for stage, name in sorted(missing):
+        print(f"⚠️ {stage} on {name}: in baseline but not measured")
+
+    for (stage, name), reason in regressions:
+        print(f"❌ {stage} on {name}: {reason}")
+    if not regressions:
+        print(f"✅ No regressions against the baseline (time tolerance {tolerance:.0%}, RSS {rss_tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=os.path.join(ROOT, "brain_tumor_dataset"))
+    parser.add_argument("--scans", type=int, default=12, help="Dataset scans to sample (0 = phantoms only)")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[256, 512, 1024], help="Phantom sizes (px)")
+    parser.add_argument("--stages", nargs="*", choices=STAGES, help="Only these stages (default: all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "latest.json"))
+    parser.add_argument("--save-baseline", action="store_true", help=f"Also store the run as {BASELINE_PATH}")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, metavar="BASELINE",
+                        help="Gate the run against a baseline JSON (default: benchmarks/baseline.json)")
+    parser.add_argument("--current", help="With --compare: check this result file instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed median time growth")
+    parser.add_argument("--rss-tolerance", type=float, default=0.25, help="Allowed RSS growth")
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(args)
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=1)
+        print(f"💾 Results: {args.output}")
+        if args.save_baseline:
+            shutil.copyfile(args.output, BASELINE_PATH)
+            print(f"💾 Baseline: {BASELINE_PATH}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return 1 if compare(baseline, current, args.tolerance, args.rss_tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
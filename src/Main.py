@@ -1,14 +1,15 @@
 import sys
-import cv2
-import numpy as np
-from PyQt5.QtWidgets import QApplication, QSplashScreen
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QPixmap, QColor
-from gui_web_layout import WebStyleApp
-from tumor_classifier import tumor_predict
 
 
 if __name__ == "__main__":
+    # Imported under the guard: process pools spawn their workers, and a spawned
+    # worker re-imports this module; it must not load Qt, the GUI or TensorFlow.
+    from PyQt5.QtWidgets import QApplication, QSplashScreen
+    from PyQt5.QtCore import Qt, QTimer
+    from PyQt5.QtGui import QPixmap, QColor
+    from gui_web_layout import WebStyleApp
+    from tumor_classifier import tumor_predict
+
     app = QApplication(sys.argv)
 
     # 1. Load the Logo Image
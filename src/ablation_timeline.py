@@ -0,0 +1,154 @@
+import zlib
+import bisect
+from collections import deque
+import numpy as np
+
+# =============================================================================
+#  ABLATION TIMELINE (Record, Scrub, Export)
+# =============================================================================
+# Temperature fields are stored quantized to 0.01 C as uint16 (0-655 C) and
+# grouped in chunks: one keyframe followed by (keyframe_interval - 1)
+# frame-to-frame diffs. The diffs use wrapping uint16 arithmetic, so they
+# reconstruct exactly; they are almost all zeros away from the laser, so zlib
+# shrinks them to a few KB. Old chunks fall off the front once max_frames is
+# exceeded. Every frame after the first field frame holds a blob: a frame
+# recorded without a field repeats the previous one (an all-zero diff), so
+# blob k of a chunk is always frame first_index + k.
+
+QUANTUM_C = 0.01
+
+
+class _Chunk:
+    def __init__(self, first_index):
+        self.first_index = first_index
+        self.blobs = []  # blobs[0] = keyframe, then diffs
+
+
+class AblationTimeline:
+    def __init__(self, record_interval_s=0.5, keyframe_interval=20, max_frames=2400):
+        self.record_interval_s = record_interval_s
+        self.keyframe_interval = keyframe_interval
+        self.max_frames = max_frames
+
+        self.times = []
+        self.core_temps = []
+        self.margin_temps = []
+        self.first_index = 0      # Global index of the oldest frame still held
+        self.field_shape = None
+        self._chunks = deque()
+        self._last_quantized = None
+        self._next_record_time = 0.0
+        self._decoded = None      # (global index, uint16 field) for fast sequential replay
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return self.times[-1] if self.times else 0.0
+
+    # --- RECORDING ---
+    def record(self, sim_time, core_temp, margin_temp, field=None, force=False):
+        """
+        Stores a frame if record_interval_s has passed since the last one (or force).
+        Without a field, the frame repeats the last recorded field (if any).
+        """
+        if not force and sim_time + 1e-9 < self._next_record_time:
+            return False
+        self._next_record_time = sim_time + self.record_interval_s
+
+        index = self.first_index + len(self.times)
+        self.times.append(float(sim_time))
+        self.core_temps.append(float(core_temp))
+        self.margin_temps.append(float(margin_temp))
+
+        quantized = self._last_quantized  # No field: the frame is unchanged
+        if field is not None:
+            quantized = np.clip(np.round(field / QUANTUM_C), 0, 65535).astype(np.uint16)
+            if self.field_shape is None:
+                self.field_shape = quantized.shape
+        if quantized is not None:
+            if not self._chunks or len(self._chunks[-1].blobs) >= self.keyframe_interval:
+                chunk = _Chunk(index)
+                chunk.blobs.append(zlib.compress(quantized.tobytes(), 1))
+                self._chunks.append(chunk)
+            else:
+                diff = quantized - self._last_quantized
+                self._chunks[-1].blobs.append(zlib.compress(diff.tobytes(), 1))
+            self._last_quantized = quantized
+
+        self._trim()
+        return True
+
+    def _trim(self):
+        """Ring-buffer behaviour: drop whole chunks from the front."""
+        while self.max_frames and len(self.times) > self.max_frames:
+            if self._chunks and self._chunks[0].first_index == self.first_index:
+                dropped = len(self._chunks.popleft().blobs)
+            elif self._chunks:
+                # Frames recorded before the first field frame have no blobs
+                dropped = min(self._chunks[0].first_index - self.first_index, len(self.times) - self.max_frames)
+            else:
+                dropped = len(self.times) - self.max_frames
+            dropped = min(dropped, len(self.times))
+            del self.times[:dropped], self.core_temps[:dropped], self.margin_temps[:dropped]
+            self.first_index += dropped
+            self._decoded = None
+
+    # --- SCRUBBING ---
+    def index_at(self, t):
+        """Local index of the last frame recorded at or before time t."""
+        if not self.times:
+            return None
+        return max(bisect.bisect_right(self.times, t) - 1, 0)
+
+    def _decode(self, blob):
+        return np.frombuffer(zlib.decompress(blob), dtype=np.uint16).reshape(self.field_shape)
+
+    def field_at_index(self, local_index):
+        """Reconstructs the temperature field (C, float32) of a frame (None before the first field)."""
+        target = self.first_index + local_index
+        if not self._chunks or target < self._chunks[0].first_index:
+            return None
+        chunk = self._chunks[bisect.bisect_right([c.first_index for c in self._chunks], target) - 1]
+        offset = target - chunk.first_index
+
+        # Continue from the last decoded frame when replaying forward inside a chunk
+        if self._decoded is not None and chunk.first_index <= self._decoded[0] <= target:
+            start, field = self._decoded[0] - chunk.first_index, self._decoded[1].copy()
+        else:
+            start, field = 0, self._decode(chunk.blobs[0]).copy()
+        for blob in chunk.blobs[start + 1:offset + 1]:
+            field += self._decode(blob)
+
+        self._decoded = (target, field)
+        return field.astype(np.float32) * QUANTUM_C
+
+    def frame_at(self, t):
+        """Frame nearest before time t: dict with time, temperatures and field (or None)."""
+        i = self.index_at(t)
+        if i is None:
+            return None
+        return {
+            'sim_time': self.times[i],
+            'core_temp': self.core_temps[i],
+            'margin_temp': self.margin_temps[i],
+            'temperature_field': self.field_at_index(i)
+        }
+
+    # --- EXPORT ---
+    def export(self, filepath):
+        """Writes the compressed timeline to an .npz file (no pickling needed to read it)."""
+        data = {
+            'times': np.asarray(self.times, dtype=np.float64),
+            'core_temps': np.asarray(self.core_temps, dtype=np.float32),
+            'margin_temps': np.asarray(self.margin_temps, dtype=np.float32),
+            'quantum_c': np.float32(QUANTUM_C),
+            'keyframe_interval': np.int32(self.keyframe_interval),
+            'field_shape': np.asarray(self.field_shape or (0, 0), dtype=np.int32)
+        }
+        for chunk in self._chunks:
+            for k, blob in enumerate(chunk.blobs):
+                data[f"frame_{chunk.first_index + k - self.first_index:06d}"] = np.frombuffer(blob, dtype=np.uint8)
+        np.savez(filepath, **data)
+        return filepath
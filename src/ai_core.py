@@ -1,36 +1,260 @@
 import numpy as np
-from collections import deque
+import cv2
+import laser_physics
+
+# ==========================================
+# PART 0: TELEMETRY ENGINE (RUNNING STATISTICS)
+# ==========================================
+DEFAULT_STEP_S = 0.1  # Physics step, used when callers pass no timestamps
+
+
+class TelemetryEngine:
+    """
+    O(1)-per-sample running statistics for one or many telemetry points
+    (a probe, a set of sensors, or every pixel of a boundary ring).
+    - ewma: exponentially weighted moving average per point.
+    - slope: heating rate (C/s) per point from an exponentially weighted
+      least-squares line fit. The time origin follows the newest sample, so
+      the sums stay well conditioned however long the run is.
+    """
+    def __init__(self, n_points=1, alpha=0.2, halflife_s=1.0):
+        self.n_points = n_points
+        self.alpha = alpha
+        self.halflife_s = halflife_s
+        self.reset()
+
+    def reset(self):
+        n = self.n_points
+        self.count = 0
+        self.last_t = None
+        self.latest = np.zeros(n)
+        self.ewma = np.zeros(n)
+        # Weighted sums of 1, tau, tau^2, y, tau*y (tau = age relative to the newest sample)
+        self._s0 = self._st = self._stt = 0.0
+        self._sy = np.zeros(n)
+        self._sty = np.zeros(n)
+
+    def update(self, values, t=None):
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        if t is None:
+            t = self.count * DEFAULT_STEP_S
+
+        if self.count == 0:
+            self.ewma[:] = values
+        else:
+            self.ewma += self.alpha * (values - self.ewma)
+
+            # Decay the old samples, then move the time origin to the new one
+            shift = t - self.last_t
+            decay = 0.5 ** (shift / self.halflife_s)
+            s0, st = self._s0 * decay, self._st * decay
+            self._stt = self._stt * decay - 2 * shift * st + shift**2 * s0
+            self._sty *= decay
+            self._sy *= decay
+            self._sty -= shift * self._sy
+            self._st = st - shift * s0
+            self._s0 = s0
+
+        self._s0 += 1.0
+        self._sy += values
+        self.latest[:] = values
+        self.last_t = t
+        self.count += 1
+        return self
+
+    @property
+    def slope(self):
+        den = self._s0 * self._stt - self._st**2
+        if self.count < 2 or den <= 1e-12:
+            return np.zeros(self.n_points)
+        return (self._s0 * self._sty - self._st * self._sy) / den
+
+    def predict(self, seconds_ahead):
+        """Linear projection of the smoothed value."""
+        return self.ewma + self.slope * seconds_ahead
+
+
+def boundary_ring(tumor_mask, brain_mask=None, width_mm=2.0, pixel_spacing_mm=0.5, margin_mm=2.0):
+    """
+    Flat pixel indices of the healthy ring around the tumor: the first width_mm
+    of laser_physics.healthy_tissue_mask, i.e. just beyond the margin_mm ablation
+    margin (the same tissue the healthy-dose metrics cover).
+    """
+    tumor = (np.asarray(tumor_mask) > 0).astype(np.uint8)
+    brain = brain_mask if brain_mask is not None else np.ones(tumor.shape, dtype=bool)
+    healthy = laser_physics.healthy_tissue_mask(tumor, brain, margin_mm, pixel_spacing_mm)
+    reach_px = max(int(round((margin_mm + width_mm) / pixel_spacing_mm)), 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * reach_px + 1, 2 * reach_px + 1))
+    return np.flatnonzero(healthy & (cv2.dilate(tumor, kernel) > 0))
+
+
+# ==========================================
+# PART 0b: CLOSED-LOOP POWER CONTROL (MPC)
+# ==========================================
+class _FirstOrderRLS:
+    """
+    Online fit of x[k+1] = a*x[k] + b*u[k] + d*off[k] by recursive least
+    squares with forgetting (x = T - 37 C, u = delivered power, off = 1 while
+    a pulse is off, so the cooling of pulse gaps is learned separately).
+    """
+    def __init__(self, a=0.999, b=0.05, forgetting=0.995):
+        # Start from the prior with a tight covariance: a near-integrator driven
+        # at constant (saturated) power is poorly identifiable from scratch
+        self.theta = np.array([a, b, 0.0])
+        self.P = np.diag([1e-4, b**2 + 1e-6, 1.0])
+        self.forgetting = forgetting
+
+    def update(self, x_prev, u_prev, off_prev, x_now):
+        phi = np.array([x_prev, u_prev, off_prev])
+        Pphi = self.P @ phi
+        gain = Pphi / (self.forgetting + phi @ Pphi)
+        self.theta += gain * (x_now - phi @ self.theta)
+        self.P = (self.P - np.outer(gain, Pphi)) / self.forgetting
+        # Keep the covariance bounded while the input is not exciting (steady state)
+        if np.trace(self.P) > 1e4:
+            self.P *= 1e4 / np.trace(self.P)
+        # Physically: stable, and more power never cools
+        self.theta[0] = min(max(self.theta[0], 0.0), 0.9999)
+        self.theta[1] = max(self.theta[1], 0.0)
+
+
+class MPCPowerController:
+    """
+    Model-predictive power control for the ablation run.
+    Core and margin temperatures each follow a first-order model identified
+    online (RLS). The power setting is held over the horizon and the pulse
+    schedule is known, so every prediction is affine in the power:
+        x_k = alpha_k + beta_k * P
+    The quadratic tracking cost then has a closed-form minimizer, and the
+    safety limits over the whole horizon become an upper bound on P.
+    """
+    def __init__(self, max_power=30.0, horizon_s=5.0, dt=DEFAULT_STEP_S, core_margin=2.0,
+                 margin_limit=42.0, move_penalty=0.05, baseline=37.0, gain_prior=0.05, margin_ratio=0.4):
+        self.max_power = max_power
+        self.gain_prior = gain_prior        # Core C per W per step (e.g. AblationSimulation.tip_gain())
+        self.margin_ratio = margin_ratio    # Prior margin rise as a fraction of the core rise
+        self.horizon = int(round(horizon_s / dt))
+        self.core_margin = core_margin      # Core may overshoot the target by at most this (C)
+        self.margin_limit = margin_limit    # Healthy margin ceiling (C), the AI warning level
+        self.move_penalty = move_penalty
+        self.baseline = baseline
+        self.reset()
+
+    def reset(self):
+        self.core_model = _FirstOrderRLS(b=self.gain_prior)
+        self.margin_model = _FirstOrderRLS(b=self.gain_prior * self.margin_ratio)
+        self.last = None  # (core x, margin x, power setting)
+        self.power = 0.0
+
+    def _affine(self, model, x0, schedule):
+        """Horizon predictions as alpha + beta * P for a given on/off schedule."""
+        a, b, d = model.theta
+        alpha = np.empty(self.horizon)
+        beta = np.empty(self.horizon)
+        al, be = x0, 0.0
+        for k in range(self.horizon):
+            on = schedule[k]
+            al = a * al + d * (1.0 - on)
+            be = a * be + b * on
+            alpha[k], beta[k] = al, be
+        return alpha, beta
+
+    def update(self, core_temp, margin_temp, target_temp, laser_was_on=True, schedule=None):
+        """
+        Learns from the last step, then returns the power setting for the next one.
+        laser_was_on: whether the last step actually delivered power (pulse gating).
+        schedule: laser on/off for the coming horizon steps (default: always on).
+        """
+        x_core = core_temp - self.baseline
+        x_margin = margin_temp - self.baseline
+        if self.last is not None:
+            prev_core, prev_margin, prev_power = self.last
+            u, off = (prev_power, 0.0) if laser_was_on else (0.0, 1.0)
+            self.core_model.update(prev_core, u, off, x_core)
+            self.margin_model.update(prev_margin, u, off, x_margin)
+
+        if schedule is None:
+            schedule = np.ones(self.horizon)
+        alpha_c, beta_c = self._affine(self.core_model, x_core, schedule)
+        alpha_m, beta_m = self._affine(self.margin_model, x_margin, schedule)
+
+        # 1. Unconstrained optimum of sum (x_k - r)^2 + lambda * N * (P - P_prev)^2
+        ref = target_temp - self.baseline
+        lam = self.move_penalty * self.horizon
+        power = (beta_c @ (ref - alpha_c) + lam * self.power) / (beta_c @ beta_c + lam)
+
+        # 2. Largest power that keeps every predicted step inside the limits
+        upper = self.max_power
+        for alpha, beta, limit in ((alpha_c, beta_c, ref + self.core_margin),
+                                   (alpha_m, beta_m, self.margin_limit - self.baseline)):
+            heating = beta > 1e-9
+            if np.any(heating):
+                upper = min(upper, float(np.min((limit - alpha[heating]) / beta[heating])))
+
+        self.power = float(min(max(power, 0.0), max(upper, 0.0)))
+        self.last = (x_core, x_margin, self.power)
+        return self.power
+
+
+# With a field the AI stops on a lethal healthy dose, not on 45 C, so the margin
+# ceiling is the temperature that only kills healthy tissue after this long.
+HEALTHY_EXPOSURE_S = 3600.0
+
+
+def mpc_for_simulation(simulation, **kwargs):
+    """MPCPowerController with its gain prior (and, with a field, margin ceiling) from the run."""
+    if simulation.dose is not None:
+        kwargs.setdefault('margin_limit', laser_physics.arrhenius_lethal_temp(HEALTHY_EXPOSURE_S))
+    return MPCPowerController(gain_prior=simulation.tip_gain(), **kwargs)
+
 
 # ==========================================
 # PART 1: LIVE MONITORING ENGINE (THE CLASS)
 # ==========================================
 class SurgicalAI:
     def __init__(self):
-        # Rolling buffer to store last 10 temperature readings
-        self.temp_history = deque(maxlen=10)
+        # Running statistics of the probe (centroid) temperature
+        self.core = TelemetryEngine()
+        # Boundary-ring telemetry (set_margin_ring); None = use the lumped margin value
+        self.ring_index = None
+        self.ring = None
         self.last_impedance = 400  # Baseline impedance
-        
-    # UPDATED FUNCTION SIGNATURE TO ACCEPT 'healthy_tissue_temp'
-    def analyze_telemetry(self, current_temp, target_temp, impedance, healthy_tissue_temp=37.0):
+
+    def set_margin_ring(self, tumor_mask, brain_mask=None, width_mm=2.0, pixel_spacing_mm=0.5, margin_mm=2.0):
+        """Monitors every pixel of the healthy ring around the tumor when frames are passed in."""
+        if tumor_mask is None:
+            self.ring_index = self.ring = None
+            return
+        self.ring_index = boundary_ring(tumor_mask, brain_mask, width_mm, pixel_spacing_mm, margin_mm)
+        self.ring = TelemetryEngine(len(self.ring_index)) if len(self.ring_index) else None
+
+    def analyze_telemetry(self, current_temp, target_temp, impedance, healthy_tissue_temp=37.0, dose=None,
+                          field=None, t=None):
         """
         Advanced Heuristic Engine for Thermal Ablation.
         Includes Margin Safety Analysis.
+        dose: optional thermal-dose metrics (ThermalDoseAccumulator.metrics()).
+        field / t: optional temperature frame and its time (s). With a margin ring
+        set, the margin rules use the hottest ring pixel instead of healthy_tissue_temp.
+        With a dose, healthy tissue is stopped on a lethal dose; its temperature
+        then only raises warnings.
         """
         # 1. Smooth the data
-        self.temp_history.append(current_temp)
-        if len(self.temp_history) > 0:
-            smooth_temp = sum(self.temp_history) / len(self.temp_history)
-        else:
-            smooth_temp = current_temp
-        
-        # 2. Calculate Rate of Change (dT/dt)
-        if len(self.temp_history) > 1:
-            heating_rate = self.temp_history[-1] - self.temp_history[-2] 
-        else:
-            heating_rate = 0.0
+        self.core.update(current_temp, t)
+        smooth_temp = float(self.core.ewma[0])
+
+        # 2. Calculate Rate of Change (dT/dt, C/s)
+        heating_rate = float(self.core.slope[0])
 
         # 3. Predict Future Temp (Projection 5 seconds ahead)
-        predicted_temp_5s = smooth_temp + (heating_rate * 50) 
+        predicted_temp_5s = smooth_temp + heating_rate * 5.0
+
+        # Margin from the whole boundary ring (smoothed, plus its 5 s projection)
+        ring_predicted = None
+        if self.ring is not None and field is not None:
+            self.ring.update(field.ravel()[self.ring_index], t)
+            healthy_tissue_temp = max(healthy_tissue_temp, float(self.ring.ewma.max()))
+            ring_predicted = float(self.ring.predict(5.0).max())
 
         # --- SAFETY THRESHOLDS ---
         MAX_SAFE_TEMP = target_temp + 8.0
@@ -39,20 +263,34 @@ class SurgicalAI:
         # ================================
         # LAYER 0: MARGIN SAFETY (NEW)
         # ================================
-        # 45°C is where healthy cells start dying (Protein Denaturation)
-        if healthy_tissue_temp > 45.0:
+        # 45°C is where healthy cells start dying (Protein Denaturation). With a dose map
+        # the damage itself is known, and a short 45°C fringe beyond the margin is not lethal.
+        if healthy_tissue_temp > 45.0 and dose is None:
             return "STOP", "#FF0000", "⚠️ CRITICAL: HEAT LEAK DETECTED!\nRisk of permanent necrosis in surrounding healthy tissue."
-        
-        if healthy_tissue_temp > 42.0:
-             return "WARNING", "#ff9800", "⚠️ ALERT: Margin approaching unsafe levels.\nCollateral damage risk increasing."
 
-        # LAYER 1: CRITICAL SAFETY
+        # Cumulative dose: healthy tissue already received a lethal dose
+        coverage = None
+        if dose is not None:
+            if dose.get('healthy_ablated_mm2'):
+                return "STOP", "#FF0000", f"⚠️ CRITICAL: Lethal thermal dose in healthy tissue ({dose['healthy_ablated_mm2']} mm²)!"
+            coverage = dose.get('tumor_coverage')
+
+        # LAYER 1: CRITICAL SAFETY (every STOP is checked before the margin warnings)
         if current_temp >= MAX_SAFE_TEMP:
             return "STOP", "#FF0000", f"CRITICAL: Temp Limit Exceeded ({current_temp:.1f}°C)!"
         
         if impedance > (self.last_impedance + CRITICAL_IMPEDANCE_JUMP):
             return "STOP", "#FF0000", "EMERGENCY: Impedance Spike! Tissue Charring Detected."
 
+        if healthy_tissue_temp > 45.0:
+             return "WARNING", "#ff9800", "⚠️ ALERT: Healthy tissue above 45°C.\nThermal dose is monitored; necrosis stops the run."
+
+        if healthy_tissue_temp > 42.0:
+             return "WARNING", "#ff9800", "⚠️ ALERT: Margin approaching unsafe levels.\nCollateral damage risk increasing."
+
+        if ring_predicted is not None and ring_predicted > 45.0:
+             return "WARNING", "#ff9800", "⚠️ ALERT: Margin ring heating fast.\nProjected above 45°C within 5 s."
+
         # LAYER 2: PREDICTIVE SAFETY
         if predicted_temp_5s > MAX_SAFE_TEMP:
             return "PAUSE", "#FFA500", "WARNING: Thermal Runaway Predicted. Pausing to stabilize."
@@ -61,26 +299,52 @@ class SurgicalAI:
         remaining = target_temp - smooth_temp
         
         if remaining <= 0:
-            if heating_rate > 0.1:
+            if heating_rate > 1.0:
                 return "PAUSE", "#FFA500", "Target reached. Cooling down."
             else:
+                if coverage is not None:
+                    return "PAUSE", "#28a745", f"Target Achieved. Maintaining thermal dose ({coverage:.0%} of tumor ablated)."
                 return "PAUSE", "#28a745", "Target Achieved. Maintaining thermal dose."
 
         elif remaining < 3.0:
-            if heating_rate > 0.5:
+            if heating_rate > 5.0:
                  return "ADJUST", "#FFFF00", "Near Target: Reduce Power."
             else:
                  return "CONTINUE", "#00FF00", "Final Approach. Precision heating active."
 
         # LAYER 4: NORMAL OPERATION
         else:
-            if heating_rate < 0.05 and len(self.temp_history) > 5:
+            if heating_rate < 0.5 and self.core.count > 5:
                 return "BOOST", "#00d4ff", "Heating inefficient. Suggest increasing power."
             else:
-                return "CONTINUE", "#00FF00", f"Stable. Heating at {heating_rate*10:.2f}°C/sec."
+                return "CONTINUE", "#00FF00", f"Stable. Heating at {heating_rate:.2f}°C/sec."
 
     def reset(self):
-        self.temp_history.clear()
+        self.core.reset()
+        if self.ring is not None:
+            self.ring.reset()
+
+
+def ablation_step(simulation, ai_engine, controller=None, impedance=400):
+    """
+    One step of a run as the GUI physics worker does it: the controller (if any)
+    sets the power, the physics advances, and the AI judges the new state.
+    Returns analyze_telemetry's (action, color, message).
+    """
+    if controller is not None:
+        # Margin = hottest pixel of the healthy ring when the AI monitors one
+        margin = simulation.margin_temp
+        if ai_engine.ring is not None and ai_engine.ring.count:
+            margin = max(margin, float(ai_engine.ring.latest.max()))
+        laser_was_on = simulation.laser_on(simulation.sim_time - simulation.dt)
+        simulation.power = controller.update(
+            simulation.core_temp, margin, simulation.target_temp, laser_was_on,
+            simulation.laser_schedule(controller.horizon))
+
+    simulation.step()
+    return ai_engine.analyze_telemetry(
+        simulation.core_temp, simulation.target_temp, impedance, simulation.margin_temp,
+        dose=simulation.dose_metrics, field=simulation.temperature_field, t=simulation.sim_time)
 
 
 # ==========================================
@@ -0,0 +1,135 @@
+import numpy as np
+import cv2
+
+# =============================================================================
+#  CASE METADATA (Scan Geometry From Load To Report)
+# =============================================================================
+# Everything downstream of the loader works in pixels of the displayed slice.
+# CaseMetadata records how large those pixels really are, so measurement,
+# growth, physics and the report can convert to mm with the scan's own
+# geometry instead of assuming DEFAULT_SPACING_MM.
+#
+# - pixel_spacing_mm: (row, column) spacing of the displayed slice in mm.
+# - slice_thickness_mm: through-plane thickness (None when unknown).
+# - orientation: patient-axis codes of the displayed (row, column) directions,
+#   e.g. ('P', 'L') for an axial DICOM slice, None when unknown.
+# - source: "DICOM", "NIfTI" or "Standard"; spacing_known is False when the
+#   file carried no geometry and the default was used.
+#
+# The explicit solvers need square pixels, so anisotropic slices are
+# resampled at load time to the finer of the two spacings (make_isotropic).
+
+DEFAULT_SPACING_MM = 0.5       # Assumed for plain images (JPG/PNG) without geometry
+ISOTROPY_TOLERANCE = 0.01      # Relative row/column spacing difference treated as square
+
+
+class CaseMetadata:
+    """Scan geometry of one loaded case (see module notes)."""
+    def __init__(self, pixel_spacing_mm=None, slice_thickness_mm=None, orientation=None,
+                 source="Standard"):
+        self.spacing_known = pixel_spacing_mm is not None
+        if pixel_spacing_mm is None:
+            pixel_spacing_mm = (DEFAULT_SPACING_MM, DEFAULT_SPACING_MM)
+        self.pixel_spacing_mm = (float(pixel_spacing_mm[0]), float(pixel_spacing_mm[1]))
+        self.slice_thickness_mm = float(slice_thickness_mm) if slice_thickness_mm else None
+        self.orientation = tuple(orientation) if orientation is not None else None
+        self.source = source
+
+    @property
+    def spacing_mm(self):
+        """Isotropic in-plane spacing (mm) used by the solvers."""
+        return min(self.pixel_spacing_mm)
+
+    @property
+    def spacing_m(self):
+        return self.spacing_mm * 1e-3
+
+    @property
+    def is_isotropic(self):
+        row, col = self.pixel_spacing_mm
+        return abs(row - col) <= ISOTROPY_TOLERANCE * max(row, col)
+
+    def describe(self):
+        """Short human-readable summary (GUI label and report)."""
+        row, col = self.pixel_spacing_mm
+        text = f"{row:.2f} x {col:.2f} mm"
+        if not self.spacing_known:
+            text += " (assumed)"
+        if self.slice_thickness_mm:
+            text += f", slice {self.slice_thickness_mm:.1f} mm"
+        if self.orientation:
+            text += f", {''.join(self.orientation)}"
+        return text
+
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'pixel_spacing_mm': self.pixel_spacing_mm,
+            'slice_thickness_mm': self.slice_thickness_mm,
+            'orientation': ''.join(self.orientation) if self.orientation else None,
+            'spacing_known': self.spacing_known
+        }
+
+
+# --- Orientation helpers ---
+# DICOM patient axes are LPS: +x = Left, +y = Posterior, +z = Superior.
+_LPS_CODES = (('R', 'L'), ('A', 'P'), ('I', 'S'))
+
+
+def axis_code(direction, codes=_LPS_CODES):
+    """Patient-axis code ('L', 'P', ...) a direction cosine vector mostly points to."""
+    direction = np.asarray(direction, dtype=float)
+    axis = int(np.argmax(np.abs(direction)))
+    return codes[axis][1] if direction[axis] > 0 else codes[axis][0]
+
+
+def from_dicom(ds):
+    """Geometry of a pydicom dataset (PixelSpacing, SliceThickness, ImageOrientationPatient)."""
+    spacing = getattr(ds, 'PixelSpacing', None) or getattr(ds, 'ImagerPixelSpacing', None)
+    spacing = (float(spacing[0]), float(spacing[1])) if spacing is not None else None
+    thickness = getattr(ds, 'SliceThickness', None)
+
+    orientation = None
+    cosines = getattr(ds, 'ImageOrientationPatient', None)
+    if cosines is not None and len(cosines) == 6:
+        # First triplet: direction along a row (column index grows); second: down a column
+        row_dir, col_dir = np.asarray(cosines[:3], dtype=float), np.asarray(cosines[3:], dtype=float)
+        orientation = (axis_code(col_dir), axis_code(row_dir))
+    return CaseMetadata(spacing, thickness, orientation, source="DICOM")
+
+
+def from_nifti(nii, slice_axis=2):
+    """
+    Geometry of the slice gui_web_layout shows from a NIfTI volume:
+    np.rot90 of volume[:, :, mid], so displayed rows run along voxel axis 1
+    (reversed) and columns along voxel axis 0.
+    """
+    import nibabel as nib
+
+    zooms = nii.header.get_zooms()
+    if len(zooms) < 2:
+        return CaseMetadata(source="NIfTI")
+    spacing = (float(zooms[1]), float(zooms[0]))
+    thickness = float(zooms[slice_axis]) if len(zooms) > slice_axis else None
+
+    codes = nib.aff2axcodes(nii.affine)  # RAS+ codes of voxel axes 0, 1, 2
+    flip = {'R': 'L', 'L': 'R', 'A': 'P', 'P': 'A', 'S': 'I', 'I': 'S'}
+    orientation = (flip[codes[1]], codes[0]) if None not in codes[:2] else None
+    return CaseMetadata(spacing, thickness, orientation, source="NIfTI")
+
+
+def make_isotropic(image, metadata):
+    """
+    Resamples an anisotropic slice to square pixels at the finer spacing.
+    Returns (image, metadata); square-pixel images are returned unchanged.
+    """
+    if metadata.is_isotropic:
+        return image, metadata
+    row, col = metadata.pixel_spacing_mm
+    target = min(row, col)
+    h, w = image.shape[:2]
+    size = (max(int(round(w * col / target)), 1), max(int(round(h * row / target)), 1))
+    resampled = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+    iso = CaseMetadata((target, target), metadata.slice_thickness_mm, metadata.orientation, metadata.source)
+    iso.spacing_known = metadata.spacing_known
+    return resampled, iso
@@ -1,5 +1,6 @@
 from PyQt5.QtCore import QThread, pyqtSignal
 import io, base64, requests, re, json
+import instrumentation
 
 # ==========================================================
 # WORKER 1: For the initial, detailed analysis
@@ -14,6 +15,7 @@ class CombinedAIWorker(QThread):
         self.api_url = "https://openrouter.ai/api/v1/chat/completions"
         self.model = "anthropic/claude-3-haiku"
 
+    @instrumentation.instrumented("cloud_ai.analysis")
     def run(self):
         try:
             buffer = io.BytesIO()
@@ -96,6 +98,7 @@ class FollowUpChatWorker(QThread):
         self.api_url = "https://openrouter.ai/api/v1/chat/completions"
         self.model = "anthropic/claude-3-haiku"
 
+    @instrumentation.instrumented("cloud_ai.chat")
     def run(self):
         try:
             system_prompt = {
@@ -8,6 +8,8 @@ import requests
 import numpy as np
 import json
 import random
+import time
+import threading
 import pydicom
 import nibabel as nib
 
@@ -15,7 +17,7 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QLabel, QPushButton, QFileDialog, 
                              QGroupBox, QFormLayout, QLineEdit, QProgressBar, 
                              QFrame, QMessageBox, QScrollArea, QSizePolicy, QGridLayout, QCheckBox, QRadioButton,
-                             QSplashScreen, QDoubleSpinBox, QSlider)
+                             QSplashScreen, QDoubleSpinBox, QSlider, QSpinBox)
 from PyQt5.QtGui import QPixmap, QImage, QFont, QPalette, QColor
 from PyQt5.QtCore import QTimer, Qt
 import google.generativeai as genai
@@ -37,6 +39,11 @@ import tumor_measurement
 import laser_physics
 import cloud_ai_engine
 import tumor_growth_model
+import tissue_maps
+import ablation_timeline
+import treatment_optimizer
+import case_metadata
+import instrumentation
 
 # ==========================================
 # MODERN WEB-STYLE CSS
@@ -109,14 +116,17 @@ class ClassificationWorker(QThread):
 class SegmentationWorker(QThread):
     result_ready = pyqtSignal(dict) # Will emit the dictionary from segmentation.py
 
-    def __init__(self, image_array):
+    def __init__(self, image_array, multi_lesion=False, pixel_spacing_mm=None):
         super().__init__()
         self.image = image_array
+        self.multi_lesion = multi_lesion
+        self.pixel_spacing_mm = pixel_spacing_mm
         
     def run(self):
         """This runs in the background to prevent lag"""
         # Call the heavy segmentation function
-        result = segmentation.detect_tumor(self.image)
+        result = segmentation.detect_tumor(self.image, multi_lesion=self.multi_lesion,
+                                           pixel_spacing_mm=self.pixel_spacing_mm)
         # Send the result back to the main thread when finished
         self.result_ready.emit(result)
 
@@ -186,20 +196,194 @@ class CombinedAIWorker(QThread):
 
 class TumorGrowthWorker(QThread):
     frames_ready = pyqtSignal(list, list)
-    def __init__(self, mask, brain_mask, params, end_time): 
+    def __init__(self, mask, brain_mask, params, end_time, tissue=None, pixel_scale_mm=0.5): 
         super().__init__()
         self.mask = mask
         self.brain_mask = brain_mask
         self.params = params
         self.end_time = end_time
+        self.tissue = tissue
+        self.pixel_scale_mm = pixel_scale_mm
     def run(self):
         try:
-            frames, metrics = tumor_growth_model.simulate_tumor_growth_fast(self.mask, self.brain_mask, self.params, self.end_time)
+            frames, metrics = tumor_growth_model.simulate_tumor_growth_fast(self.mask, self.brain_mask, self.params, self.end_time,
+                                                                            tissue=self.tissue, pixel_scale_mm=self.pixel_scale_mm)
             self.frames_ready.emit(frames, metrics)
         except Exception as e:
             print(f"❌ Tumor Growth Simulation Failed: {e}")
             self.frames_ready.emit([], [])
 
+class GrowthEnsembleWorker(QThread):
+    progress = pyqtSignal(dict)   # Partial forecast bands after each finished member
+    finished_ensemble = pyqtSignal(dict)
+    def __init__(self, mask, brain_mask, distributions, end_time, time_scale, n_members=100, tissue=None,
+                 pixel_scale_mm=0.5):
+        super().__init__()
+        self.mask = mask
+        self.brain_mask = brain_mask
+        self.distributions = distributions
+        self.end_time = end_time
+        self.time_scale = time_scale
+        self.n_members = n_members
+        self.tissue = tissue
+        self.pixel_scale_mm = pixel_scale_mm
+    def run(self):
+        latest = {}
+        try:
+            for latest in tumor_growth_model.run_growth_ensemble(
+                    self.mask, self.brain_mask, self.distributions, self.end_time,
+                    n_members=self.n_members, time_scale=self.time_scale, tissue=self.tissue,
+                    pixel_scale_mm=self.pixel_scale_mm):
+                self.progress.emit(latest)
+        except Exception as e:
+            print(f"❌ Growth Ensemble Failed: {e}")
+            latest = {}
+        self.finished_ensemble.emit(latest)
+
+class TreatmentOptimizerWorker(QThread):
+    finished_plan = pyqtSignal(object)  # Plan dict, or None on failure
+    def __init__(self, tumor_mask, brain_mask, tumor_stats, tissue=None, pixel_spacing_mm=0.5,
+                 start_temp=37.0, target_temp=60.0, wavelength_nm=None):
+        super().__init__()
+        self.tumor_mask = tumor_mask
+        self.brain_mask = brain_mask
+        self.tumor_stats = tumor_stats
+        self.tissue = tissue
+        self.pixel_spacing_mm = pixel_spacing_mm
+        self.start_temp = start_temp
+        self.target_temp = target_temp
+        self.wavelength_nm = wavelength_nm
+    def run(self):
+        try:
+            plan = treatment_optimizer.optimize_treatment(
+                self.tumor_mask, self.brain_mask, self.tumor_stats, tissue=self.tissue,
+                pixel_spacing_mm=self.pixel_spacing_mm, start_temp=self.start_temp,
+                target_temp=self.target_temp, wavelength_nm=self.wavelength_nm)
+        except Exception as e:
+            print(f"❌ Treatment Optimization Failed: {e}")
+            plan = None
+        self.finished_plan.emit(plan)
+
+class SurrogateBuildWorker(QThread):
+    """Builds (and caches on the TissueMaps) the bio-heat surrogate for one fiber layout."""
+    built = pyqtSignal(bool)  # True when the surrogate is in the cache
+    def __init__(self, tissue, fiber_tips, field_shape, wavelength_nm=None, pixel_spacing_m=5e-4):
+        super().__init__()
+        self.tissue = tissue
+        self.fiber_tips = fiber_tips
+        self.field_shape = field_shape
+        self.wavelength_nm = wavelength_nm
+        self.pixel_spacing_m = pixel_spacing_m
+    def run(self):
+        try:
+            laser_physics.get_bioheat_surrogate(self.tissue, self.fiber_tips, self.field_shape,
+                                                wavelength_nm=self.wavelength_nm,
+                                                pixel_spacing_m=self.pixel_spacing_m)
+        except Exception as e:
+            print(f"❌ Surrogate Build Failed: {e}")
+            self.built.emit(False)
+            return
+        self.built.emit(True)
+
+class AblationPhysicsWorker(QThread):
+    """
+    Runs the ablation physics at a fixed simulated dt on its own thread.
+    The GUI polls latest_state() at the display rate; intermediate states are
+    dropped. The AI safety engine is evaluated every physics step, so a STOP
+    is never missed because a frame was skipped. If a timeline is given, the
+    run is recorded into it for replay (read it only after the thread ends).
+    With a controller (ai_core.MPCPowerController), power is set by the
+    controller every step and the GUI power field is ignored. Each step is
+    ai_core.ablation_step, so headless runs behave the same.
+    """
+    run_finished = pyqtSignal(str, str)  # ("STOP" | "DESTROYED", message)
+
+    def __init__(self, simulation, ai_engine, speed=1.0, publish_hz=60.0, timeline=None, controller=None):
+        super().__init__()
+        self.sim = simulation
+        self.ai_engine = ai_engine
+        self.timeline = timeline
+        self.controller = controller
+        self.speed = speed  # Simulated seconds per wall second (0 = as fast as possible)
+        self.publish_interval = 1.0 / publish_hz
+        self._lock = threading.Lock()
+        self._latest = None
+        self._controls = None
+        self._running = True
+
+    def set_controls(self, power, target_temp, speed):
+        with self._lock:
+            self._controls = (power, target_temp, speed)
+
+    def stop(self):
+        self._running = False
+
+    def latest_state(self):
+        """Newest published state, handed out once (None if nothing new)."""
+        with self._lock:
+            state, self._latest = self._latest, None
+        return state
+
+    def _publish(self, act, col, msg):
+        field = self.sim.temperature_field
+        state = {
+            'sim_time': self.sim.sim_time,
+            'core_temp': self.sim.core_temp,
+            'margin_temp': self.sim.margin_temp,
+            'target_temp': self.sim.target_temp,
+            'temperature_field': field.copy() if field is not None else None,
+            'ablated': self.sim.ablated_map(),
+            'dose': self.sim.dose_metrics,
+            'power': self.sim.power,
+            'ai': (act, col, msg)
+        }
+        with self._lock:
+            self._latest = state
+
+    def _record(self, force=False):
+        if self.timeline is not None:
+            self.timeline.record(self.sim.sim_time, self.sim.core_temp, self.sim.margin_temp,
+                                 self.sim.temperature_field, force=force)
+
+    def run(self):
+        wall_start = time.perf_counter()
+        last_publish = 0.0
+        self._record()
+        while self._running:
+            with self._lock:
+                controls, self._controls = self._controls, None
+            if controls is not None:
+                power, self.sim.target_temp, speed = controls
+                if self.controller is None:
+                    self.sim.power = power
+                if speed != self.speed:
+                    # Re-anchor pacing so a speed change does not cause a jump
+                    self.speed = speed
+                    wall_start = time.perf_counter() - (self.sim.sim_time / speed if speed > 0 else 0.0)
+
+            imp = 400 + np.random.randint(-10, 10)
+            act, col, msg = ai_core.ablation_step(self.sim, self.ai_engine, self.controller, imp)
+
+            done = act == "STOP" or self.sim.is_destroyed
+            self._record(force=done)
+            now = time.perf_counter()
+            if done or now - last_publish >= self.publish_interval:
+                self._publish(act, col, msg)
+                last_publish = now
+
+            if act == "STOP":
+                self.run_finished.emit("STOP", msg)
+                break
+            if self.sim.is_destroyed:
+                self.run_finished.emit("DESTROYED", "AI predicts tumor tissue has been successfully ablated.")
+                break
+
+            # Pace simulated time against the wall clock
+            if self.speed > 0:
+                wait = wall_start + self.sim.sim_time / self.speed - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+
 class WebStyleApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -212,17 +396,32 @@ class WebStyleApp(QMainWindow):
         self.raw_image = None
         self.brain_mask = None
         self.temperature_map = None
+        self.tissue_maps = None
         self.current_temp = 37.0
         self.is_running = False
         self.tumor_size = 0.0
         self.tumor_centroid = (0, 0)
+        self.tumor_axis = (1.0, 0.0)    # Principal axis (unit x, y) for fiber placement
+        self.tumor_axis_length = 0.0    # Tumor extent along that axis (px)
+        self.fiber_spread = 1.0         # Fraction of the axis the fibers cover (set by the optimizer)
+        self.tumor_stats = None
+        self.lesions = []               # Per-lesion measurements (multi-lesion mode)
+        self.target_mask = None         # Lesion the ablation targets (the largest one)
+        self.case_metadata = case_metadata.CaseMetadata()  # Scan geometry of the loaded case
         self.tumor_type = "Unknown"
         self.ai_engine = ai_core.SurgicalAI()
+        self.heatmap_renderer = heatmap_engine.HeatmapRenderer()
+        self._display_cache = {}  # Per-label display buffers (see display_image)
         self.chat_history = []
         
-        self.timer = QTimer()
+        self.physics_worker = None
+        self.timer = QTimer()  # Display refresh only; physics runs on AblationPhysicsWorker
         self.timer.timeout.connect(self.update_simulation)
 
+        self.ablation_timeline = None  # Recording of the last run (replay / export)
+        self.replay_timer = QTimer()
+        self.replay_timer.timeout.connect(self.advance_replay)
+
         self.init_ui()
 
     def init_ui(self):
@@ -332,9 +531,14 @@ class WebStyleApp(QMainWindow):
         self.btn_run_seg.setFixedWidth(200)
         self.btn_run_seg.clicked.connect(self.run_segmentation_process)
         self.btn_run_seg.setEnabled(False)
+
+        self.chk_multi_lesion = QCheckBox("Multi-lesion")
+        self.chk_multi_lesion.setStyleSheet("color: #00e5ff; font-weight: bold;")
+        self.chk_multi_lesion.setToolTip("Keep every lesion of the suspicious class (e.g. metastases), not only the largest")
         
         head_layout.addWidget(lbl_title)
         head_layout.addStretch()
+        head_layout.addWidget(self.chk_multi_lesion)
         head_layout.addWidget(self.btn_run_seg)
 
         # --- ROW 2: SPLIT IMAGES ---
@@ -437,6 +641,15 @@ class WebStyleApp(QMainWindow):
         summary_layout.addWidget(QLabel("Bounding Box", styleSheet=lbl_style), 2, 3)
         self.lbl_dims = QLabel("-"); self.lbl_dims.setStyleSheet(val_style)
         summary_layout.addWidget(self.lbl_dims, 3, 3)
+
+        summary_layout.addWidget(QLabel("Lesions", styleSheet=lbl_style), 2, 4)
+        self.lbl_lesion_count = QLabel("-"); self.lbl_lesion_count.setStyleSheet(val_style)
+        summary_layout.addWidget(self.lbl_lesion_count, 3, 4)
+
+        self.lbl_lesion_list = QLabel("")
+        self.lbl_lesion_list.setStyleSheet("color: #aaa; font-size: 13px;")
+        self.lbl_lesion_list.setWordWrap(True)
+        self.lbl_lesion_list.setVisible(False)
         
         # Separator
         line = QFrame()
@@ -468,6 +681,7 @@ class WebStyleApp(QMainWindow):
 
         layout.addWidget(title)
         layout.addLayout(summary_layout)
+        layout.addWidget(self.lbl_lesion_list)
         layout.addWidget(line)
         layout.addLayout(grid)
         self.main_layout.addWidget(self.diagnosis_card)
@@ -559,8 +773,38 @@ class WebStyleApp(QMainWindow):
         mode_layout.addWidget(self.chk_continuous)
         mode_layout.addWidget(self.chk_pulsed)
         
+        # 3. Fiber placement (spread along the tumor's principal axis)
+        fiber_grp = QGroupBox("Fiber Placement")
+        fiber_grp.setStyleSheet("QGroupBox { border: 1px solid #444; border-radius: 4px; margin-top: 10px; color: #aaa; font-size: 11px; } QGroupBox::title { top: -8px; left: 10px; }")
+        fiber_layout = QHBoxLayout(fiber_grp)
+
+        self.spin_fibers = QSpinBox()
+        self.spin_fibers.setRange(1, 5)
+        self.spin_fibers.setValue(1)
+        self.spin_fibers.setSuffix(" fiber(s)")
+        self.spin_fibers.setToolTip("Number of laser fibers along the tumor's long axis (power is per fiber)")
+
+        self.chk_sequential = QCheckBox("Sequential")
+        self.chk_sequential.setStyleSheet("color: #ffcc00; font-weight: bold;")
+        self.chk_sequential.setToolTip("Fire one fiber at a time (30 s each) instead of all together")
+
+        fiber_layout.addWidget(self.spin_fibers)
+        fiber_layout.addWidget(self.chk_sequential)
+
+        # What-if preview of the current plan (reduced-order model, ms per update)
+        self.lbl_plan_preview = QLabel("Preview: segment a tumor first")
+        self.lbl_plan_preview.setStyleSheet("color: #888; font-size: 11px;")
+        self.lbl_plan_preview.setWordWrap(True)
+        self.surrogate_worker = None
+        self.surrogate_failures = set()  # Layout keys whose build failed (not retried for this case)
+        for signal in (self.in_power.textChanged, self.in_total_dur.textChanged,
+                       self.spin_fibers.valueChanged, self.chk_sequential.toggled, self.chk_continuous.toggled):
+            signal.connect(self.update_plan_preview)
+
         left_container.addLayout(self.form_layout)
         left_container.addWidget(mode_grp)
+        left_container.addWidget(fiber_grp)
+        left_container.addWidget(self.lbl_plan_preview)
 
         # =========================================
         # COL 2: RADIATION MATERIAL
@@ -592,6 +836,7 @@ class WebStyleApp(QMainWindow):
         rad_layout.addWidget(self.rad_co2); rad_layout.addWidget(self.rad_custom)
         rad_layout.addSpacing(100); rad_layout.addLayout(wave_input_layout); rad_layout.addStretch()
         self.rad_ndyag.setChecked(True); self.in_wavelength.setEnabled(False)
+        self.in_wavelength.textChanged.connect(self.update_plan_preview)
         middle_container.addWidget(rad_grp)
         
         # =========================================
@@ -605,8 +850,12 @@ class WebStyleApp(QMainWindow):
         self.btn_ai_params.clicked.connect(self.ai_suggest_params)
         self.btn_strategy = QPushButton("📋 Get Surgical Strategy")
         self.btn_strategy.clicked.connect(self.action_suggest_strategy)
+        self.btn_optimize = QPushButton("🎯 Optimize Fiber Plan")
+        self.btn_optimize.clicked.connect(self.action_optimize_plan)
         btn_layout.addWidget(self.btn_auto_cal)
         btn_layout.addSpacing(15)
+        btn_layout.addWidget(self.btn_optimize)
+        btn_layout.addSpacing(15)
         btn_layout.addWidget(self.btn_ai_params)
         btn_layout.addSpacing(15)
         btn_layout.addWidget(self.btn_strategy)
@@ -736,12 +985,55 @@ class WebStyleApp(QMainWindow):
             border: 1px solid #444;
         """)
         
+        # 5. Simulation speed (simulated seconds per real second)
+        self.spin_sim_speed = QDoubleSpinBox()
+        self.spin_sim_speed.setRange(0.5, 50.0)
+        self.spin_sim_speed.setValue(1.0)
+        self.spin_sim_speed.setSingleStep(0.5)
+        self.spin_sim_speed.setSuffix("×")
+        self.spin_sim_speed.setToolTip("Simulation speed (faster than real time above 1×)")
+        self.spin_sim_speed.setAlignment(Qt.AlignCenter)
+        self.spin_sim_speed.setFixedHeight(70)
+        self.spin_sim_speed.setStyleSheet("QDoubleSpinBox { background-color: #1e1e1e; color: #aaa; font-size: 20px; font-weight: bold; border: 2px solid #444; border-radius: 6px; }")
+
         top_row.addWidget(self.btn_start, 4)
         top_row.addWidget(self.btn_reset, 1)
+        top_row.addWidget(self.spin_sim_speed, 1)
         top_row.addWidget(self.lbl_temp, 1)
         top_row.addWidget(self.lbl_ai_status, 1)
         
-        # --- ROW 2: LOG TEXT ---
+        # --- ROW 2: CLOSED LOOP + REPLAY (scrub through the recorded run) ---
+        replay_row = QHBoxLayout()
+
+        self.chk_closed_loop = QCheckBox("Closed-loop (MPC)")
+        self.chk_closed_loop.setStyleSheet("color: #00e5ff; font-weight: bold;")
+        self.chk_closed_loop.setToolTip("Let the predictive controller set the power to track the target safely")
+        replay_row.addWidget(self.chk_closed_loop)
+        replay_row.addSpacing(15)
+
+        self.btn_replay = QPushButton("▶ Replay")
+        self.btn_replay.setFixedHeight(36)
+        self.btn_replay.clicked.connect(self.toggle_replay)
+
+        self.slider_replay = QSlider(Qt.Horizontal)
+        self.slider_replay.setRange(0, 0)
+        self.slider_replay.valueChanged.connect(self.show_replay_frame)
+
+        self.lbl_replay_time = QLabel("t = 0.0 s")
+        self.lbl_replay_time.setStyleSheet("color: #00e5ff; font-weight: bold; font-size: 13px;")
+        self.lbl_replay_time.setFixedWidth(90)
+
+        self.btn_export_timeline = QPushButton("Export Timeline")
+        self.btn_export_timeline.setFixedHeight(36)
+        self.btn_export_timeline.clicked.connect(self.export_ablation_timeline)
+
+        replay_row.addWidget(self.btn_replay)
+        replay_row.addWidget(self.slider_replay, 1)
+        replay_row.addWidget(self.lbl_replay_time)
+        replay_row.addWidget(self.btn_export_timeline)
+        self.set_replay_controls_enabled(False)
+
+        # --- ROW 3: LOG TEXT ---
         self.lbl_ai_log = QLabel("System Ready.")
         self.lbl_ai_log.setStyleSheet("color: #aaa; font-weight: bold; font-size: 15px; margin-top: 10px;")
         self.lbl_ai_log.setAlignment(Qt.AlignCenter)
@@ -749,6 +1041,7 @@ class WebStyleApp(QMainWindow):
 
         layout.addWidget(lbl_title)
         layout.addLayout(top_row)
+        layout.addLayout(replay_row)
         layout.addWidget(self.lbl_ai_log)
         
         self.main_layout.addWidget(card)
@@ -907,9 +1200,14 @@ class WebStyleApp(QMainWindow):
         self.btn_run_growth_sim.setEnabled(True)
         self.btn_run_growth_sim.clicked.connect(self.run_growth_simulation)
 
+        self.btn_run_growth_ensemble = QPushButton("📊 Uncertainty Forecast (100 Runs)")
+        self.btn_run_growth_ensemble.setStyleSheet("background-color: #6a1b9a; color: white;")
+        self.btn_run_growth_ensemble.clicked.connect(self.run_growth_ensemble)
+
         layout.addWidget(title)
         layout.addLayout(controls_layout)
         layout.addWidget(self.btn_run_growth_sim)
+        layout.addWidget(self.btn_run_growth_ensemble)
         self.main_layout.addWidget(card)
     
     def create_section_chatbot(self):
@@ -1122,12 +1420,18 @@ class WebStyleApp(QMainWindow):
         filters = "Medical Files (*.dcm *.nii *.nii.gz *.jpg *.png);;All Files (*)"
         fname, _ = QFileDialog.getOpenFileName(self, 'Load Scan', '', filters)
         if fname:
-            processed_img, info_text = self.load_medical_file(fname)
+            processed_img, info_text, metadata = self.load_medical_file(fname)
             if processed_img is not None:
                 self.raw_image = processed_img
+                self.case_metadata = metadata
+                instrumentation.set_case(os.path.basename(fname))  # Later stage spans belong to this scan
                 self.segmented_image = None
+                self.heatmap_renderer.prepare(None)  # New case: drop the cached footprint
+                self.replay_timer.stop()
+                self.ablation_timeline = None
+                self.set_replay_controls_enabled(False)
                 
-                self.lbl_file_info.setText(f"Loaded: {os.path.basename(fname)}")
+                self.lbl_file_info.setText(f"Loaded: {os.path.basename(fname)} | {metadata.describe()}")
                 
                 # Show in Segmentation Left Box
                 self.display_image(self.raw_image, self.lbl_seg_raw)
@@ -1150,6 +1454,10 @@ class WebStyleApp(QMainWindow):
                 self.lbl_area.setText("-")
                 self.lbl_dims.setText("-")
                 self.lbl_shape.setText("-")
+                self.lbl_lesion_count.setText("-")
+                self.lbl_lesion_list.clear(); self.lbl_lesion_list.setVisible(False)
+                self.lesions = []
+                self.target_mask = None
                 self.lbl_depth.setText("-")
                 self.lbl_location_ai.setText("-")
                 self.rpt_conf.setText("-%")
@@ -1184,7 +1492,8 @@ class WebStyleApp(QMainWindow):
         QApplication.processEvents() # Force the UI to update now
         
         # 2. Create and start the worker
-        self.seg_worker = SegmentationWorker(self.raw_image)
+        self.seg_worker = SegmentationWorker(self.raw_image, multi_lesion=self.chk_multi_lesion.isChecked(),
+                                             pixel_spacing_mm=self.case_metadata.spacing_mm)
         self.seg_worker.result_ready.connect(self.on_segmentation_done) # Link to the "done" function
         self.seg_worker.start()
 
@@ -1193,19 +1502,42 @@ class WebStyleApp(QMainWindow):
         if seg_data.get("found"):
             self.tumor_mask = seg_data["mask"]
 
+            # Per-case tissue coefficient fields (built once, reused by both physics engines)
+            tissue_classes = seg_data.get("tissue_classes")
+            self.tissue_maps = tissue_maps.TissueMaps(tissue_classes, self.brain_mask) if tissue_classes is not None else None
+            self.surrogate_failures.clear()
+
             # 1. Create the two image versions
             green_layer = np.zeros_like(self.raw_image)
             green_layer[:] = [0, 255, 0]
             green_layer = cv2.bitwise_and(green_layer, green_layer, mask=self.tumor_mask)
             self.segmented_overlay = cv2.addWeighted(self.raw_image, 1, green_layer, 0.4, 0)
 
+            # Live heatmap footprint, LUT and buffers are prepared once per case
+            self.heatmap_renderer.prepare(self.segmented_overlay, self.tumor_mask)
+
             # Create a separate version with metrics for the segmentation view only
             image_with_metrics = self.segmented_overlay.copy()
             
 
             # 2. Measurement and Drawing
-            stats = tumor_measurement.measure_tumor_advanced(self.tumor_mask)
+            spacing = self.case_metadata.pixel_spacing_mm
+            self.lesions, lesion_labels = tumor_measurement.measure_lesions(self.tumor_mask, spacing)
+            self.target_mask = self.tumor_mask
+            if len(self.lesions) > 1:
+                # Several lesions: list them all, target (and plan fibers for) the largest
+                for i, lesion in enumerate(self.lesions, 1):
+                    x1, x2, y1, y2 = lesion['bbox']
+                    cv2.rectangle(image_with_metrics, (x1, y1), (x2, y2), (0, 165, 255), 1)
+                    cv2.putText(image_with_metrics, f"#{i}", (x1, max(y1 - 4, 10)),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 165, 255), 1)
+                self.target_mask = ((lesion_labels == self.lesions[0]['label']) * 255).astype(np.uint8)
+                stats = tumor_measurement.measure_tumor_advanced(self.target_mask, spacing)
+            else:
+                stats = tumor_measurement.measure_tumor_advanced(self.tumor_mask, spacing)
+            self.show_lesion_list()
 
+            self.tumor_stats = stats
             if stats:
                 x1, x2, y1, y2 = stats['bbox']
                 cv2.rectangle(image_with_metrics, (x1, y1), (x2, y2), (0, 0, 255), 2)
@@ -1213,6 +1545,9 @@ class WebStyleApp(QMainWindow):
                 cv2.circle(image_with_metrics, center, 5, (0, 255, 255), -1)
 
                 self.tumor_centroid = center 
+                self.tumor_axis = stats['principal_axis']
+                self.tumor_axis_length = stats['axis_length_px']
+                self.update_plan_preview()
 
                 # Update Geometry Labels (keep all label updates)
                 self.tumor_size = stats['equivalent_diameter_mm']
@@ -1227,6 +1562,7 @@ class WebStyleApp(QMainWindow):
                 self.tumor_size = 0.0
                 h, w, _ = self.raw_image.shape
                 self.tumor_centroid = (w//2, h//2)
+                self.tumor_axis_length = 0.0
 
         else:
             # Handle No Tumor Found
@@ -1261,51 +1597,103 @@ class WebStyleApp(QMainWindow):
         self.ai_worker = cloud_ai_engine.CombinedAIWorker(pil_img)
         self.ai_worker.result_ready.connect(self.on_ai_analysis_done)
         self.ai_worker.start()
+    def treatment_masks(self):
+        """
+        (tumor, brain) masks for ablation runs and plans: the targeted lesion, and
+        the brain without the other lesions (neither target nor healthy tissue).
+        """
+        target = self.target_mask if self.target_mask is not None else getattr(self, 'tumor_mask', None)
+        if target is None or self.brain_mask is None:
+            return target, self.brain_mask
+        others = (self.tumor_mask > 0) & (target == 0)
+        if not others.any():
+            return target, self.brain_mask
+        brain = self.brain_mask.copy()
+        brain[others] = 0
+        return target, brain
+
+    def show_lesion_list(self):
+        """Lesion count plus one line per lesion (only shown when there are several)."""
+        self.lbl_lesion_count.setText(str(len(self.lesions)) if self.lesions else "-")
+        if len(self.lesions) < 2:
+            self.lbl_lesion_list.clear()
+            self.lbl_lesion_list.setVisible(False)
+            return
+        lines = [f"#{i}: {l['area_mm2']} mm², Ø {l['equivalent_diameter_mm']} mm at {l['centroid']}, "
+                 f"ecc {l['eccentricity']}" for i, l in enumerate(self.lesions, 1)]
+        self.lbl_lesion_list.setText("<br>".join(lines))
+        self.lbl_lesion_list.setVisible(True)
+
     def load_medical_file(self, filepath):
-        """Standard + Medical Loader"""
+        """Standard + Medical Loader. Returns (image, info, CaseMetadata)."""
         ext = os.path.splitext(filepath)[1].lower()
         try:
             if ext == '.dcm':
                 ds = pydicom.dcmread(filepath)
                 img = ds.pixel_array
                 info = "DICOM"
+                metadata = case_metadata.from_dicom(ds)
             elif ext in ['.nii', '.gz']:
                 nii = nib.load(filepath)
                 d = nii.get_fdata()
                 img = np.rot90(d[:, :, d.shape[2]//2]) if len(d.shape)==3 else d
                 info = "NIfTI"
+                metadata = case_metadata.from_nifti(nii)
             else:
                 img = cv2.imread(filepath)
                 info = "Standard"
-                return img, info
+                return img, info, case_metadata.CaseMetadata()
 
             # Normalize
             img = img.astype(float)
             img = ((img - np.min(img)) / (np.max(img) - np.min(img))) * 255
             img = img.astype(np.uint8)
             if len(img.shape) == 2: img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-            return img, info
+            # The solvers need square pixels
+            img, metadata = case_metadata.make_isotropic(img, metadata)
+            return img, info, metadata
         except:
-            return None, "Error"
+            return None, "Error", None
 
     def display_image(self, cv_img, target_label):
-        """Scales image to fit inside a specific label"""
+        """
+        Scales image to fit inside a specific label.
+        Each label keeps a persistent BGR buffer at its display size wrapped by a
+        QImage (Format_BGR888), so there is no RGB conversion copy and the fitted
+        size is only recomputed when the source shape or label size changes.
+        """
         if cv_img is None: return
 
-        rgb = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb.shape
-        bytes_per_line = ch * w
-        q_img = QImage(rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
-        pix = QPixmap.fromImage(q_img)
-        
-        # Scale to the specific target label
-        scaled_pix = pix.scaled(
-            target_label.size(), 
-            Qt.KeepAspectRatio, 
-            Qt.SmoothTransformation
-        )
-        
-        target_label.setPixmap(scaled_pix)
+        h, w = cv_img.shape[:2]
+        label_size = (target_label.width(), target_label.height())
+        cache = self._display_cache.get(id(target_label))
+
+        if cache is None or cache['src_shape'] != cv_img.shape or cache['label_size'] != label_size:
+            # Fit inside the label, keeping the aspect ratio (falls back to native size before layout)
+            lw, lh = label_size
+            scale = min(lw / w, lh / h) if lw > 0 and lh > 0 else 1.0
+            sw, sh = max(1, int(w * scale)), max(1, int(h * scale))
+
+            if cv_img.ndim == 2:
+                buffer = np.empty((sh, sw), dtype=np.uint8)
+                q_img = QImage(buffer.data, sw, sh, sw, QImage.Format_Grayscale8)
+            else:
+                buffer = np.empty((sh, sw, 3), dtype=np.uint8)
+                q_img = QImage(buffer.data, sw, sh, 3 * sw, QImage.Format_BGR888)
+
+            cache = {
+                'src_shape': cv_img.shape,
+                'label_size': label_size,
+                'size': (sw, sh),
+                'interpolation': cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR,
+                'buffer': buffer,   # Must outlive q_img, which wraps it without copying
+                'qimage': q_img
+            }
+            self._display_cache[id(target_label)] = cache
+
+        # Scale straight into the persistent buffer
+        cv2.resize(cv_img, cache['size'], dst=cache['buffer'], interpolation=cache['interpolation'])
+        target_label.setPixmap(QPixmap.fromImage(cache['qimage']))
 
     def toggle_laser_mode(self):
         sender = self.sender()
@@ -1375,10 +1763,8 @@ class WebStyleApp(QMainWindow):
             delta = 0
         self.in_target.setText(f"{delta:.1f}")
 
-        # --- Optional: If you want to re-calculate using the depth, do this ---
-        # depth_mm = getattr(self, 'estimated_depth', 15.0)
-        # new_params = laser_physics.calculate_laser_params(self.tumor_size, depth_mm, int(self.in_wavelength.text()))
-        # ... then update the boxes with new_params ...
+        # Note: estimated_depth is the distance to the cortical surface, not an input of
+        # laser_physics.calculate_laser_params (which takes the fiber offset from the tumor center).
 
         self.lbl_ai_log.setText("AI: Suggested laser parameters have been loaded.")
     
@@ -1391,8 +1777,8 @@ class WebStyleApp(QMainWindow):
             return
 
         # --- 1. GET INPUTS FOR PHYSICS FORMULA ---
-        # A. Depth (Still assumed for 2D)
-        depth_mm = 5.0 
+        # A. Fiber tip offset from the tumor center (the run places it at the centroid)
+        tip_offset_mm = 0.0
 
         # B. Wavelength (From the UI)
         try:
@@ -1403,7 +1789,7 @@ class WebStyleApp(QMainWindow):
 
         # --- 2. CALL THE NEW FUNCTION ---
         try:
-            params = laser_physics.calculate_laser_params(self.tumor_size, depth_mm, wavelength)
+            params = laser_physics.calculate_laser_params(self.tumor_size, tip_offset_mm, wavelength)
             
             # 3. Update UI
             self.in_power.setText(str(params['power_W']))
@@ -1416,11 +1802,130 @@ class WebStyleApp(QMainWindow):
             if delta < 0: delta = 0
             self.in_target.setText(f"{delta:.1f}")
             
-            self.lbl_ai_log.setText(f"AI: Physics calculated for {wavelength}nm at {depth_mm}mm depth.")
+            self.lbl_ai_log.setText(f"AI: Physics calculated for {wavelength}nm, fiber {tip_offset_mm}mm from the tumor center.")
             
         except Exception as e:
             QMessageBox.critical(self, "Physics Error", f"Calculation failed: {str(e)}")
 
+    def action_optimize_plan(self):
+        """Searches fiber count/placement, power and duration on the segmented case."""
+        if self.tumor_stats is None or self.brain_mask is None:
+            QMessageBox.warning(self, "No Data", "Please segment the tumor first.")
+            return
+
+        self.btn_optimize.setEnabled(False)
+        self.btn_optimize.setText("Optimizing...")
+        self.lbl_ai_log.setText("AI: Searching fiber placements and dose...")
+
+        # Same start, target and source model as the live run, so the plan's STOP check holds there
+        start_temp = self.lbl_temp.value() if self.raw_image is not None else 37.0
+        delta = self.read_ablation_controls()[1] - getattr(self, 'start_temp', 37.0)
+        tumor_mask, brain_mask = self.treatment_masks()
+        self.optimizer_worker = TreatmentOptimizerWorker(
+            tumor_mask, brain_mask, self.tumor_stats, tissue=self.tissue_maps,
+            pixel_spacing_mm=self.case_metadata.spacing_mm, start_temp=start_temp,
+            target_temp=start_temp + delta, wavelength_nm=self.selected_wavelength())
+        self.optimizer_worker.finished_plan.connect(self.on_plan_optimized)
+        self.optimizer_worker.start()
+
+    def on_plan_optimized(self, plan):
+        self.btn_optimize.setEnabled(True)
+        self.btn_optimize.setText("🎯 Optimize Fiber Plan")
+        if plan is None:
+            QMessageBox.critical(self, "Optimizer Error", "Could not find a treatment plan.")
+            return
+
+        self.spin_fibers.setValue(plan['n_fibers'])
+        self.chk_sequential.setChecked(False)
+        self.chk_continuous.setChecked(True)  # Plans are simulated with a continuous beam
+        self.fiber_spread = plan['spread']
+        self.in_power.setText(str(plan['power_W']))
+        self.in_total_dur.setText(str(int(plan['duration_s'])))
+        self.in_energy.setText(str(plan['energy_J']))
+
+        msg = (f"AI: {plan['n_fibers']} fiber(s) at {plan['power_W']} W for {plan['duration_s']:.0f} s -> "
+               f"{plan['coverage']:.0%} tumor coverage, healthy peak {plan['healthy_peak_C']:.1f}°C "
+               f"({plan['elapsed_s']} s)")
+        self.lbl_ai_log.setText(msg)
+        if not plan['feasible']:
+            QMessageBox.warning(self, "Optimizer", "No plan ablates "
+                                f"{laser_physics.ABLATION_COVERAGE:.0%} of the tumor before a safety STOP. "
+                                "Showing the best option found.")
+
+    def planned_fiber_tips(self):
+        return laser_physics.fiber_positions(
+            self.tumor_centroid, self.tumor_axis, self.tumor_axis_length * self.fiber_spread,
+            self.spin_fibers.value())
+
+    def planned_power_schedule(self, n_fibers, max_s=600):
+        """Per-second power per fiber for the planned power/duration/mode."""
+        try:
+            power = float(self.in_power.text())
+            duration = int(float(self.in_total_dur.text()))
+        except (ValueError, TypeError):
+            return None
+        duration = min(max(duration, 0), max_s)
+        if duration == 0 or power <= 0:
+            return None
+
+        schedule = np.full((duration, n_fibers), power)
+        if not self.chk_continuous.isChecked():
+            schedule *= 0.6  # Pulsed: 60% duty cycle averaged over each second
+        if self.chk_sequential.isChecked() and n_fibers > 1:
+            active = (np.arange(duration) // 30) % n_fibers  # Same 30 s dwell as AblationSimulation
+            schedule[np.arange(n_fibers)[None, :] != active[:, None]] = 0
+        return schedule
+
+    def selected_wavelength(self):
+        """Wavelength (nm) from the UI, or None when the field is empty/invalid."""
+        try:
+            wavelength = int(self.in_wavelength.text())
+        except ValueError:
+            return None
+        return wavelength if wavelength > 0 else None
+
+    def update_plan_preview(self, *args):
+        """Tip temperature at the end of the planned exposure, from the cached surrogate."""
+        if self.is_running:
+            return  # The closed-loop controller rewrites in_power every display tick
+        if self.tissue_maps is None or self.raw_image is None or self.tumor_stats is None:
+            return
+        h, w = self.raw_image.shape[:2]
+        tips = self.planned_fiber_tips()
+        wavelength = self.selected_wavelength()
+        key = laser_physics.surrogate_key(tips, (h, w), wavelength)
+
+        if key in self.surrogate_failures:
+            self.lbl_plan_preview.setText("Preview: unavailable (thermal model could not be built)")
+            return
+        if key not in self.tissue_maps.surrogates:
+            if self.surrogate_worker is None or not self.surrogate_worker.isRunning():
+                self.lbl_plan_preview.setText("Preview: building thermal model...")
+                self.surrogate_worker = SurrogateBuildWorker(self.tissue_maps, tips, (h, w), wavelength,
+                                                             self.case_metadata.spacing_m)
+                self.surrogate_worker.built.connect(lambda ok, key=key: self.on_surrogate_built(key, ok))
+                self.surrogate_worker.start()
+            return
+
+        schedule = self.planned_power_schedule(len(tips))
+        if schedule is None:
+            self.lbl_plan_preview.setText("Preview: set power and duration")
+            return
+        result = self.tissue_maps.surrogates[key].predict(schedule, self.lbl_temp.value() or 37.0, fallback=False)
+        end_temp = result['tip_temps'][-1].max()
+        if result['solver'] == 'nonlinear':
+            self.lbl_plan_preview.setText(f"Preview: tip reaches ≥ {laser_physics.COAGULATION_TEMP:.0f}°C "
+                                          "(coagulation regime, run the simulation for exact values)")
+        else:
+            self.lbl_plan_preview.setText(f"Preview: tip {end_temp:.1f}°C after {len(schedule)} s, "
+                                          f"peak {result['peak_temp']:.1f}°C")
+
+    def on_surrogate_built(self, key, ok):
+        """Build finished: failed layouts are remembered instead of rebuilt on every refresh."""
+        if not ok:
+            self.surrogate_failures.add(key)
+        self.update_plan_preview()
+
     def action_suggest_strategy(self):
         if self.tumor_size == 0: return
         _, tips = ai_core.generate_treatment_plan(self.tumor_size, self.tumor_type)
@@ -1447,7 +1952,9 @@ class WebStyleApp(QMainWindow):
                 self.temperature_map = np.full((h, w), self.start_temp, dtype=np.float32)
             else:
                 # Fallback if no image is loaded
-                self.temperature_map = np.full((512, 512), 37.0, dtype=np.float32)
+                h, w = 512, 512
+                self.start_temp = 37.0
+                self.temperature_map = np.full((h, w), 37.0, dtype=np.float32)
             # ---------------------------------------------
 
             # Activate Right Screen
@@ -1458,6 +1965,39 @@ class WebStyleApp(QMainWindow):
 
             self.current_temp = self.start_temp
             self.ai_engine.reset()
+            # Multi-lesion cases treat the targeted lesion; the others are not healthy tissue
+            tumor_mask, brain_mask = self.treatment_masks()
+            self.ai_engine.set_margin_ring(tumor_mask, brain_mask, pixel_spacing_mm=self.case_metadata.spacing_mm)
+            self.last_dose_metrics = None
+
+            # New recording for this run; replay stays locked until it ends
+            self.replay_timer.stop()
+            self.set_replay_controls_enabled(False)
+            self.ablation_timeline = ablation_timeline.AblationTimeline()
+
+            # Physics on its own thread at a fixed simulated dt
+            power, absolute_target = self.read_ablation_controls()
+            mask_area = 1000
+            if tumor_mask is not None:
+                mask_area = laser_physics.lumped_mask_area(cv2.countNonZero(tumor_mask),
+                                                           self.case_metadata.spacing_mm)
+
+            fiber_tips = self.planned_fiber_tips()
+            simulation = laser_physics.AblationSimulation(
+                self.start_temp, absolute_target, power, mask_area,
+                tumor_centroid=self.tumor_centroid, field_shape=(h, w), tissue=self.tissue_maps,
+                pulsed=not self.chk_continuous.isChecked(),
+                fiber_tips=fiber_tips, sequential=self.chk_sequential.isChecked(),
+                tumor_mask=tumor_mask, brain_mask=brain_mask,
+                wavelength_nm=self.selected_wavelength(), pixel_spacing_mm=self.case_metadata.spacing_mm
+            )
+            controller = None
+            if self.chk_closed_loop.isChecked():
+                controller = ai_core.mpc_for_simulation(simulation)
+            self.physics_worker = AblationPhysicsWorker(simulation, self.ai_engine, speed=self.spin_sim_speed.value(),
+                                                        timeline=self.ablation_timeline, controller=controller)
+            self.physics_worker.run_finished.connect(self.on_ablation_finished)
+            self.physics_worker.start()
 
             self.btn_start.setText("STOP PROCEDURE")
 
@@ -1473,13 +2013,19 @@ class WebStyleApp(QMainWindow):
             self.lbl_temp.setReadOnly(True)
             self.lbl_temp.setStyleSheet("QDoubleSpinBox { background-color: #1e1e1e; color: #ffcc00; font-size: 40px; font-weight: bold; border: none; }") # Active style
 
-            self.timer.start(100)
+            self.timer.start(33)  # ~30 FPS display refresh
 
         else:
             # --- FIX: STOPPING MANUALLY ---
             self.is_running = False
             self.timer.stop()
+            if self.physics_worker is not None:
+                self.physics_worker.stop()
+                self.physics_worker.wait()
+                self.physics_worker = None
             self.btn_reset.setEnabled(True)
+            self.load_replay_timeline()
+            self.update_plan_preview()  # Skipped during the run
 
             # Reset button to its initial state
             self.btn_start.setText("INITIALIZE ABLATION")
@@ -1494,9 +2040,8 @@ class WebStyleApp(QMainWindow):
             self.lbl_ai_status.setText("STOPPED")
             # -----------------------------
             
-    def update_simulation(self):
-
-        # 1. Get Parameters
+    def read_ablation_controls(self):
+        """Returns (power, absolute target temperature) from the planning inputs."""
         try: 
             power = float(self.in_power.text())
             delta = float(self.in_target.text())
@@ -1505,71 +2050,151 @@ class WebStyleApp(QMainWindow):
             delta = 23.0
 
         baseline = getattr(self, 'start_temp', 37.0)
-        absolute_target = baseline + delta
-
-        # 2. Call the simple PDE state function
-        mask_area = 1000
-        if hasattr(self, 'tumor_mask') and self.tumor_mask is not None:
-            mask_area = cv2.countNonZero(self.tumor_mask)
-
-        new_temp, margin_temp, is_destroyed = laser_physics.calculate_pde_state(
-            self.current_temp, 
-            absolute_target, 
-            power, 
-            mask_area
-        )
+        return power, baseline + delta
 
-        # Pulsed Mode logic
-        if not self.chk_continuous.isChecked():
-            import time
-            cycle = int(time.time() * 10) % 10 
-            if cycle >= 6:
-                new_temp -= 0.3 
+    def update_simulation(self):
+        """
+        Display tick (~30 Hz). Pushes the current controls to the physics thread
+        and renders only the newest physics state; older ones are dropped.
+        """
+        if self.physics_worker is None:
+            return
+
+        power, absolute_target = self.read_ablation_controls()
+        self.physics_worker.set_controls(power, absolute_target, self.spin_sim_speed.value())
 
-        self.current_temp = new_temp
+        state = self.physics_worker.latest_state()
+        if state is not None:
+            self.show_ablation_state(state)
 
-        # 3. Update UI Display
+    def show_ablation_state(self, state):
+        """Renders one physics state: temperature readout, heatmap and AI status."""
+        baseline = getattr(self, 'start_temp', 37.0)
+        self.current_temp = state['core_temp']
+        if state['temperature_field'] is not None:
+            self.temperature_map = state['temperature_field']
+
+        # 1. Update UI Display
         self.lbl_temp.setValue(self.current_temp)
 
-        # 4. Visualize Heatmap
-        base_img = getattr(self, 'segmented_overlay', self.raw_image)
-        mask = getattr(self, 'tumor_mask', None)
+        # 2. Visualize Heatmap
+        if self.heatmap_renderer.base_image is None:
+            base_img = getattr(self, 'segmented_overlay', self.raw_image)
+            self.heatmap_renderer.prepare(base_img, getattr(self, 'tumor_mask', None))
 
-        heatmap_img = heatmap_engine.generate_heatmap(
-            base_img, 
-            self.current_temp, 
-            absolute_target, 
-            baseline, 
-            mask
-        )
+        if state['temperature_field'] is not None:
+            # Field mode: real per-pixel temperatures with isotherms
+            heatmap_img = self.heatmap_renderer.render_field(state['temperature_field'], state['ablated'])
+        else:
+            heatmap_img = self.heatmap_renderer.render(
+                self.current_temp, 
+                state['target_temp'], 
+                baseline
+            )
+        if state['dose'] is not None:
+            self.last_dose_metrics = state['dose']
+        if self.physics_worker is not None and self.physics_worker.controller is not None:
+            self.in_power.setText(f"{state['power']:.2f}")  # Controller output fed back to the plan
 
         if heatmap_img is not None:
             self.display_image(heatmap_img, self.lbl_live_image)
-            self.last_heatmap_image = heatmap_img
-
-        # 5. AI Safety Checks
-        imp = 400 + np.random.randint(-10, 10)
-
-        # --- FIX IS HERE: Call with the correct number of arguments ---
-        act, col, msg = self.ai_engine.analyze_telemetry(
-            self.current_temp, 
-            absolute_target, 
-            imp, 
-            margin_temp
-        )
-        # -----------------------------------------------------------
+            self.last_heatmap_image = heatmap_img.copy()  # Renderer reuses its frame (replay scrubs draw into it)
 
+        # 3. AI Safety Status (evaluated on the physics thread every step)
+        act, col, msg = state['ai']
         self.lbl_ai_status.setText(act)
         self.lbl_ai_status.setStyleSheet(f"background-color: {col}; color: black; font-weight: bold; font-size: 20px; padding: 10px; border-radius: 6px;")
         self.lbl_ai_log.setText(msg)
 
-        if act == "STOP": 
+    def on_ablation_finished(self, reason, msg):
+        """Physics thread ended the run (AI STOP or tumor destroyed)."""
+        if self.physics_worker is not None:
+            state = self.physics_worker.latest_state()
+            if state is not None:
+                self.show_ablation_state(state)
+        if self.is_running:
             self.toggle_ablation()
+
+        if reason == "STOP":
             QMessageBox.critical(self, "AI SAFETY", msg)
-        elif is_destroyed:
-            self.toggle_ablation()
-            QMessageBox.information(self, "Success", "AI predicts tumor tissue has been successfully ablated.")
+        else:
+            QMessageBox.information(self, "Success", msg)
     
+    # =========================================================================
+    #  ABLATION REPLAY
+    # =========================================================================
+    def set_replay_controls_enabled(self, enabled):
+        self.btn_replay.setEnabled(enabled)
+        self.slider_replay.setEnabled(enabled)
+        self.btn_export_timeline.setEnabled(enabled)
+
+    def load_replay_timeline(self):
+        """Hooks the finished run's timeline up to the scrub slider."""
+        timeline = self.ablation_timeline
+        if timeline is None or len(timeline) == 0:
+            return
+        self.slider_replay.blockSignals(True)
+        self.slider_replay.setRange(0, len(timeline) - 1)
+        self.slider_replay.setValue(len(timeline) - 1)
+        self.slider_replay.blockSignals(False)
+        self.lbl_replay_time.setText(f"t = {timeline.duration:.1f} s")
+        self.set_replay_controls_enabled(True)
+
+    def show_replay_frame(self, index):
+        """Jumps to a recorded frame (slider position = frame index)."""
+        timeline = self.ablation_timeline
+        if timeline is None or self.is_running or not (0 <= index < len(timeline)):
+            return
+
+        field = timeline.field_at_index(index)
+        core_temp = timeline.core_temps[index]
+        if self.heatmap_renderer.base_image is None:
+            base_img = getattr(self, 'segmented_overlay', self.raw_image)
+            self.heatmap_renderer.prepare(base_img, getattr(self, 'tumor_mask', None))
+
+        if field is not None:
+            heatmap_img = self.heatmap_renderer.render_field(field)
+        else:
+            heatmap_img = self.heatmap_renderer.render(
+                core_temp, self.read_ablation_controls()[1], getattr(self, 'start_temp', 37.0))
+        if heatmap_img is not None:
+            self.display_image(heatmap_img, self.lbl_live_image)
+
+        self.lbl_replay_time.setText(f"t = {timeline.times[index]:.1f} s")
+        self.lbl_ai_log.setText(f"Replay: Core {core_temp:.1f}°C | Margin {timeline.margin_temps[index]:.1f}°C")
+
+    def toggle_replay(self):
+        if self.replay_timer.isActive():
+            self.replay_timer.stop()
+            self.btn_replay.setText("▶ Replay")
+            return
+        if self.slider_replay.value() >= self.slider_replay.maximum():
+            self.slider_replay.setValue(0)
+        self.btn_replay.setText("⏸ Pause")
+        self.replay_timer.start(33)
+
+    def advance_replay(self):
+        """Replay tick: any run plays back in ~10 s, whatever its length."""
+        step = max(1, (self.slider_replay.maximum() + 1) // 300)
+        index = min(self.slider_replay.value() + step, self.slider_replay.maximum())
+        self.slider_replay.setValue(index)
+        if index >= self.slider_replay.maximum():
+            self.replay_timer.stop()
+            self.btn_replay.setText("▶ Replay")
+
+    def export_ablation_timeline(self):
+        if self.ablation_timeline is None or len(self.ablation_timeline) == 0:
+            QMessageBox.warning(self, "No Recording", "Run an ablation first.")
+            return
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Timeline", "ablation_timeline.npz", "NumPy Archive (*.npz)")
+        if not filename:
+            return
+        try:
+            self.ablation_timeline.export(filename)
+            QMessageBox.information(self, "Exported", f"Timeline saved to:\n{filename}")
+        except Exception as e:
+            QMessageBox.critical(self, "Export Error", f"Could not save timeline:\n{e}")
+
     def run_growth_simulation(self):
         if self.tumor_mask is None or self.brain_mask is None:
             QMessageBox.warning(self, "Data Required", "Please run a successful segmentation first.")
@@ -1588,7 +2213,8 @@ class WebStyleApp(QMainWindow):
         }
         end_time = int(self.spin_duration.value())
 
-        self.growth_worker = TumorGrowthWorker(self.tumor_mask, self.brain_mask, params, end_time)
+        self.growth_worker = TumorGrowthWorker(self.tumor_mask, self.brain_mask, params, end_time, tissue=self.tissue_maps,
+                                               pixel_scale_mm=self.case_metadata.spacing_mm)
         self.growth_worker.frames_ready.connect(self.on_growth_frames_ready)
         self.growth_worker.start()
 
@@ -1602,6 +2228,7 @@ class WebStyleApp(QMainWindow):
         self.spin_beta.setEnabled(enabled)
         self.spin_duration.setEnabled(enabled)
         self.btn_run_growth_sim.setEnabled(enabled)
+        self.btn_run_growth_ensemble.setEnabled(enabled)
 
         if not enabled:
             self.btn_run_growth_sim.setText("⏳ Simulating...")
@@ -1652,6 +2279,52 @@ class WebStyleApp(QMainWindow):
                 self.anim_timer.stop()
             self.set_growth_controls_enabled(True)
 
+    def run_growth_ensemble(self):
+        """Runs 100 growth members around the chosen (D, rho, beta) and shows forecast bands."""
+        if getattr(self, 'tumor_mask', None) is None or self.brain_mask is None:
+            QMessageBox.warning(self, "Data Required", "Please run a successful segmentation first.")
+            return
+
+        self.set_growth_controls_enabled(False)
+        self.lbl_growth_sim.setText("Running Uncertainty Ensemble...")
+        QApplication.processEvents()
+
+        # Each rate gets a 20% relative spread around the value chosen in the UI
+        spread = 0.2
+        distributions = {
+            'D': ('normal', self.spin_D.value(), spread * self.spin_D.value()),
+            'rho': ('normal', self.spin_rho.value(), spread * self.spin_rho.value()),
+            'beta': ('normal', self.spin_beta.value(), spread * self.spin_beta.value())
+        }
+        time_scale = 'days' if self.btn_days.isChecked() else 'hours'
+        end_time = int(self.spin_duration.value())
+
+        self.ensemble_worker = GrowthEnsembleWorker(self.tumor_mask, self.brain_mask, distributions, end_time, time_scale,
+                                                    tissue=self.tissue_maps, pixel_scale_mm=self.case_metadata.spacing_mm)
+        self.ensemble_worker.progress.connect(self.on_growth_ensemble_progress)
+        self.ensemble_worker.finished_ensemble.connect(self.on_growth_ensemble_done)
+        self.ensemble_worker.start()
+
+    def on_growth_ensemble_progress(self, result):
+        bands = result['growth_delta_percentiles']
+        time_scale = "Days" if self.btn_days.isChecked() else "Hours"
+        self.lbl_growth_time.setText(
+            f"Time: {result['times'][-1]:.1f} {time_scale} ({result['completed']}/{result['n_members']} runs)")
+        self.lbl_growth_delta.setText(
+            f"Growth: +{bands[50][-1]:.2f} mm (P5–P95: {bands[5][-1]:.2f}–{bands[95][-1]:.2f} mm)")
+
+        # Invasion probability map blended over the scan
+        prob_img = (result['invasion_probability'] * 255).astype(np.uint8)
+        prob_map = cv2.applyColorMap(prob_img, cv2.COLORMAP_JET)
+        blended = cv2.addWeighted(self.raw_image, 0.6, prob_map, 0.4, 0)
+        self.display_image(blended, self.lbl_growth_sim)
+
+    def on_growth_ensemble_done(self, result):
+        if not result:
+            QMessageBox.warning(self, "Ensemble Failed", "The growth ensemble could not be completed.")
+        self.growth_ensemble = result
+        self.set_growth_controls_enabled(True)
+
     def update_time_scale_toggle(self, clicked_button):
         """Handles the logic for the time scale toggle buttons."""
         if clicked_button == self.btn_hours:
@@ -2008,8 +2681,12 @@ class WebStyleApp(QMainWindow):
                 'shape': self.lbl_shape.text(),
                 'depth': self.lbl_depth.text(),
                 'pathology': self.rpt_desc.text(),
-                'recommendation': rec_text
+                'recommendation': rec_text,
+                'scan_geometry': self.case_metadata.describe(),
+                'scan_source': self.case_metadata.source
             })
+            if len(self.lesions) > 1:
+                report_data['lesions'] = self.lesions
 
         if self.chk_physics.isChecked():
             mode = "Continuous Wave" if self.chk_continuous.isChecked() else "Pulsed"
@@ -2035,6 +2712,8 @@ class WebStyleApp(QMainWindow):
                 'material': material,
                 'pulse_width': self.in_pulse_dur.text() if "Pulsed" in mode else None
             })
+            if getattr(self, 'last_dose_metrics', None):
+                report_data['thermal_dose'] = self.last_dose_metrics
 
         # --- NEW: Bundle Growth Sim Data ---
         if self.chk_growth_sim.isChecked() and hasattr(self, 'growth_frames'):
@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
+import instrumentation
 
+@instrumentation.instrumented("heatmap.generate_heatmap")
 def generate_heatmap(base_image, current_temp, target_temp, baseline_temp=37.0, mask=None):
     """
     Generates thermal overlay using a dynamic baseline temperature.
@@ -51,4 +53,208 @@ def generate_heatmap(base_image, current_temp, target_temp, baseline_temp=37.0,
     result = base_image.copy()
     result[mask_indices] = cv2.addWeighted(base_image, 0.6, heatmap_color, 0.4, 0)[mask_indices]
 
-    return result
\ No newline at end of file
+    return result
+
+class HeatmapRenderer:
+    """
+    Stateful version of generate_heatmap for the live ablation view.
+
+    Everything that does not change during an ablation is prepared once per case
+    in prepare(): the blurred mask footprint, the region of interest around it,
+    the color LUT and the output buffer. render() then only builds a 256-entry
+    LUT for the current intensity, does one LUT lookup and blends in place.
+    The returned frame is a reused buffer: copy it if it must outlive the next call.
+
+    render_field() is the per-pixel mode: it maps a full temperature array through
+    a fixed-range LUT and overlays isotherm contours and a colorbar.
+    """
+    # Isotherms drawn in field mode: (temperature C, BGR color)
+    ISOTHERMS = ((43.0, (255, 255, 255)), (50.0, (0, 255, 255)), (60.0, (0, 0, 255)))
+    ABLATION_COLOR = (255, 0, 255)  # Lethal-dose outline (BGR magenta)
+
+    def __init__(self, alpha=0.4, threshold=10, field_range=(37.0, 90.0)):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.field_range = field_range
+        self.base_image = None
+        # JET colors for every layer value, shape (256, 3)
+        self.jet_lut = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET).reshape(256, 3)
+        self._levels = np.arange(256, dtype=np.float32)
+
+    @instrumentation.instrumented("heatmap.prepare")
+    def prepare(self, base_image, mask=None):
+        """Precomputes the footprint and buffers for a new case (or new mask)."""
+        self.base_image = base_image
+        if base_image is None:
+            return
+        h, w = base_image.shape[:2]
+
+        # Footprint = blurred layer at full intensity. The blur is linear, so a
+        # frame at intensity v is simply footprint * v (up to uint8 rounding).
+        footprint = np.zeros((h, w), dtype=np.uint8)
+        if mask is not None:
+            footprint[mask == 255] = 255
+            footprint = cv2.GaussianBlur(footprint, (21, 21), 0)
+        else:
+            cv2.circle(footprint, (w // 2, h // 2), 50, 255, -1)
+
+        x, y, bw, bh = cv2.boundingRect(footprint)
+        self.roi = (slice(y, y + bh), slice(x, x + bw))
+        self.footprint = footprint[self.roi].copy()
+        self.footprint3 = cv2.merge((self.footprint, self.footprint, self.footprint))
+        self.base_roi = base_image[self.roi]
+
+        # Reused buffers
+        self.frame = base_image.copy()
+        self.color = np.empty(self.footprint.shape + (3,), dtype=np.uint8)
+        self.blend = np.empty_like(self.color)
+        self.visible = np.empty(self.footprint.shape, dtype=np.uint8)
+        self.frame_lut = np.empty((256, 1, 3), dtype=np.uint8)
+
+        # Field mode buffers (full frame) and the static colorbar
+        self.field_frame = base_image.copy()
+        self.field_scaled = np.empty((h, w), dtype=np.float32)
+        self.field_index = np.empty((h, w), dtype=np.uint8)
+        self.field_visible = np.empty((h, w), dtype=np.uint8)
+        self.field_roi = None
+        self.field_dirty = None  # (x0, y0, x1, y1) drawn over last frame: hot region + outlines
+        self.isotherm_cache = {}
+        self.colorbar, self.colorbar_roi = self._build_colorbar(h, w)
+
+    @instrumentation.instrumented("heatmap.render")
+    def render(self, current_temp, target_temp, baseline_temp=37.0):
+        """Renders one frame; same look as generate_heatmap."""
+        if self.base_image is None:
+            return None
+
+        rnge = (target_temp + 10.0) - baseline_temp
+        intensity = 1.0 if rnge <= 0 else float(np.clip((current_temp - baseline_temp) / rnge, 0, 1.0))
+        if intensity <= 0.05:
+            return self.base_image
+        if self.footprint.size == 0:
+            return self.frame
+
+        # Layer value for each footprint level at this intensity, then its JET color
+        value = int(255 * intensity)
+        layer_values = (self._levels * (value / 255.0) + 0.5).astype(np.uint8)
+        self.frame_lut[:, 0, :] = self.jet_lut[layer_values]
+
+        # Pixels whose layer value passes the threshold (monotonic in the footprint)
+        above = np.nonzero(layer_values > self.threshold)[0]
+        cutoff = int(above[0]) if above.size else 256
+
+        frame_roi = self.frame[self.roi]
+        frame_roi[...] = self.base_roi
+        if cutoff < 256:
+            cv2.LUT(self.footprint3, self.frame_lut, dst=self.color)
+            cv2.addWeighted(self.base_roi, 1.0 - self.alpha, self.color, self.alpha, 0, dst=self.blend)
+            cv2.compare(self.footprint, cutoff - 1, cv2.CMP_GT, dst=self.visible)
+            cv2.copyTo(self.blend, self.visible, frame_roi)
+
+        return self.frame
+
+    def _field_index(self, temp_c):
+        t_min, t_max = self.field_range
+        return int(np.clip((temp_c - t_min) * 255.0 / (t_max - t_min), 0, 255))
+
+    def _build_colorbar(self, h, w):
+        """Static colorbar with isotherm ticks, drawn once per case (top-right corner)."""
+        bar_h = max(min(int(h * 0.5), 256), 40)
+        bar_w, label_w, pad = 12, 34, 6
+        if bar_w + label_w + 2 * pad > w or bar_h + 2 * pad > h:
+            return None, None
+
+        panel = np.full((bar_h, bar_w + label_w, 3), 20, dtype=np.uint8)
+        ramp = np.linspace(255, 0, bar_h).astype(np.uint8).reshape(-1, 1)
+        panel[:, :bar_w] = cv2.applyColorMap(np.repeat(ramp, bar_w, axis=1), cv2.COLORMAP_JET)
+
+        t_min, t_max = self.field_range
+        ticks = [t_min] + [level for level, _ in self.ISOTHERMS] + [t_max]
+        for temp in ticks:
+            y = int(round((1 - self._field_index(temp) / 255.0) * (bar_h - 1)))
+            cv2.line(panel, (bar_w, y), (bar_w + 3, y), (255, 255, 255), 1)
+            cv2.putText(panel, f"{temp:.0f}", (bar_w + 5, min(max(y + 4, 9), bar_h - 2)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1, cv2.LINE_AA)
+
+        x0 = w - panel.shape[1] - pad
+        return panel, (slice(pad, pad + bar_h), slice(x0, x0 + panel.shape[1]))
+
+    def _isotherm_contours(self, level_index, roi):
+        """
+        Contours of (field >= level) inside the hot ROI.
+        Incremental: if the thresholded region is unchanged since the previous
+        frame, the previous contours are reused instead of traced again.
+        """
+        level_mask = cv2.compare(self.field_index[roi], level_index, cv2.CMP_GE)
+        cached = self.isotherm_cache.get(level_index)
+        if cached is not None and cached[0] == roi and cv2.norm(cached[1], level_mask, cv2.NORM_INF) == 0:
+            return cached[2]
+
+        offset = (roi[1].start, roi[0].start)
+        contours, _ = cv2.findContours(level_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+        self.isotherm_cache[level_index] = (roi, level_mask, contours)
+        return contours
+
+    def _mark_dirty(self, rect, pad):
+        """Grows field_dirty by an (x, y, w, h) rect plus pad pixels, clipped to the frame."""
+        h, w = self.field_frame.shape[:2]
+        x, y, bw, bh = rect
+        box = (max(x - pad, 0), max(y - pad, 0), min(x + bw + pad, w), min(y + bh + pad, h))
+        if self.field_dirty is not None:
+            d = self.field_dirty
+            box = (min(box[0], d[0]), min(box[1], d[1]), max(box[2], d[2]), max(box[3], d[3]))
+        self.field_dirty = box
+
+    @instrumentation.instrumented("heatmap.render_field")
+    def render_field(self, temperature_field, ablated=None):
+        """
+        Renders a 2D temperature array (C) with a fixed-range JET LUT,
+        43/50/60 C isotherms and a colorbar. OpenCV only, buffers reused.
+        ablated: optional lethal-dose map (bool/uint8), outlined in magenta.
+        """
+        if self.base_image is None or temperature_field is None:
+            return self.base_image
+
+        # 1. Fixed-range LUT index: (T - t_min) * 255 / (t_max - t_min), saturated to uint8
+        t_min, t_max = self.field_range
+        np.subtract(temperature_field, t_min, out=self.field_scaled)
+        np.maximum(self.field_scaled, 0, out=self.field_scaled)
+        cv2.convertScaleAbs(self.field_scaled, dst=self.field_index, alpha=255.0 / (t_max - t_min))
+
+        # 2. Restore what the previous frame drew, then work only inside the new hot region
+        if self.field_dirty is not None:
+            x0, y0, x1, y1 = self.field_dirty
+            self.field_frame[y0:y1, x0:x1] = self.base_image[y0:y1, x0:x1]
+            self.field_dirty = None
+        cv2.compare(self.field_index, self.threshold, cv2.CMP_GT, dst=self.field_visible)
+        x, y, bw, bh = cv2.boundingRect(self.field_visible)
+        self.field_roi = (slice(y, y + bh), slice(x, x + bw)) if bw and bh else None
+        if self.field_roi is not None:
+            self._mark_dirty((x, y, bw, bh), pad=1)  # Anti-aliased isotherms bleed one pixel out
+
+        if self.field_roi is not None:
+            roi = self.field_roi
+            color = cv2.applyColorMap(self.field_index[roi], cv2.COLORMAP_JET)
+            blend = cv2.addWeighted(self.base_image[roi], 1.0 - self.alpha, color, self.alpha, 0)
+            cv2.copyTo(blend, self.field_visible[roi], self.field_frame[roi])
+
+            # 3. Isotherm contours
+            for level, line_color in self.ISOTHERMS:
+                level_index = self._field_index(level)
+                if level_index > self.threshold:
+                    contours = self._isotherm_contours(level_index, roi)
+                    if contours:
+                        cv2.drawContours(self.field_frame, contours, -1, line_color, 1, cv2.LINE_AA)
+
+        # 4. Ablation zone (cumulative dose); it outlives the hot region, so use the full frame
+        if ablated is not None:
+            contours, _ = cv2.findContours(ablated.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            if contours:
+                cv2.drawContours(self.field_frame, contours, -1, self.ABLATION_COLOR, 2, cv2.LINE_AA)
+                self._mark_dirty(cv2.boundingRect(np.vstack(contours)), pad=3)  # 2 px line + AA
+
+        # 5. Colorbar
+        if self.colorbar is not None:
+            self.field_frame[self.colorbar_roi] = self.colorbar
+
+        return self.field_frame
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import atexit
+import inspect
+import functools
+import threading
+import tracemalloc
+from contextlib import nullcontext
+
+# =============================================================================
+#  STAGE INSTRUMENTATION (Spans, Structured Logs, Prometheus Export)
+# =============================================================================
+# Compute stages are wrapped in spans that record, per (stage, case):
+#   calls, errors, wall time, process CPU time (includes OpenCV/BLAS threads),
+#   the net number of Python memory blocks allocated, and, with memory tracing,
+#   the peak traced allocation (tracemalloc also sees NumPy buffers) above the
+#   span's start. Memory figures are process-wide, so stages running at the
+#   same time on other threads show up in each other's numbers.
+#
+# Switched on by environment variables read at import:
+#   ONCOSIM_INSTRUMENT=1           record spans
+#   ONCOSIM_TRACE_MEMORY=1         also trace allocation peaks (slower)
+#   ONCOSIM_SPAN_LOG=path.jsonl    append one JSON line per finished span
+#   ONCOSIM_METRICS_FILE=path.prom write the Prometheus text file at exit
+#
+# Disabled cost is zero: @instrumented returns the function itself when
+# instrumentation is off at import, and span() hands out a shared no-op
+# context. enable() can switch spans on later (e.g. from a script), but
+# functions decorated before that stay unwrapped.
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() not in ("", "0", "false", "no")
+
+
+ENABLED = _env_flag("ONCOSIM_INSTRUMENT")
+TRACE_MEMORY = _env_flag("ONCOSIM_TRACE_MEMORY")
+SPAN_LOG_PATH = os.environ.get("ONCOSIM_SPAN_LOG") or None
+METRICS_PATH = os.environ.get("ONCOSIM_METRICS_FILE") or None
+NO_CASE = "none"
+
+_NULL_SPAN = nullcontext()
+_lock = threading.Lock()
+_stats = {}          # (stage, case) -> aggregated counters
+_open_spans = []     # Spans currently tracking a memory peak (all threads)
+_case = NO_CASE
+
+
+# --- CONFIGURATION ---
+def enable(trace_memory=False, span_log=None, metrics_file=None):
+    """Turns span recording on (decorators applied after this call are wrapped too)."""
+    global ENABLED, TRACE_MEMORY, SPAN_LOG_PATH, METRICS_PATH
+    ENABLED = True
+    TRACE_MEMORY = trace_memory
+    SPAN_LOG_PATH = span_log or SPAN_LOG_PATH
+    METRICS_PATH = metrics_file or METRICS_PATH
+    if TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """Stops recording (already wrapped functions fall back to the no-op span)."""
+    global ENABLED
+    ENABLED = False
+
+
+def set_case(case_id):
+    """Label for the case the following spans belong to (one case is open at a time)."""
+    global _case
+    _case = str(case_id) if case_id else NO_CASE
+
+
+def current_case():
+    return _case
+
+
+def reset():
+    """Drops all recorded statistics."""
+    with _lock:
+        _stats.clear()
+
+
+# --- SPANS ---
+class _Span:
+    __slots__ = ('stage', 'case', 'wall0', 'cpu0', 'blocks0', 'mem0', 'peak')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.case = _case
+
+    def __enter__(self):
+        if TRACE_MEMORY and tracemalloc.is_tracing():
+            with _lock:
+                # Fold the running peak into the open spans before resetting it for this one
+                current, peak = tracemalloc.get_traced_memory()
+                for span in _open_spans:
+                    span.peak = max(span.peak, peak)
+                tracemalloc.reset_peak()
+                self.mem0 = self.peak = current
+                _open_spans.append(self)
+        else:
+            self.mem0 = None
+        self.blocks0 = sys.getallocatedblocks()
+        self.cpu0 = time.process_time()
+        self.wall0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall0
+        cpu = time.process_time() - self.cpu0
+        blocks = sys.getallocatedblocks() - self.blocks0
+        peak_bytes = None
+        with _lock:
+            if self.mem0 is not None and self in _open_spans:
+                peak = tracemalloc.get_traced_memory()[1]
+                for span in _open_spans:
+                    span.peak = max(span.peak, peak)
+                _open_spans.remove(self)
+                peak_bytes = self.peak - self.mem0
+
+            entry = _stats.get((self.stage, self.case))
+            if entry is None:
+                entry = _stats[(self.stage, self.case)] = {
+                    'calls': 0, 'errors': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'wall_max_s': 0.0,
+                    'alloc_blocks': 0, 'peak_alloc_bytes': None
+                }
+            entry['calls'] += 1
+            entry['errors'] += exc_type is not None
+            entry['wall_s'] += wall
+            entry['cpu_s'] += cpu
+            entry['wall_max_s'] = max(entry['wall_max_s'], wall)
+            entry['alloc_blocks'] += blocks
+            if peak_bytes is not None:
+                entry['peak_alloc_bytes'] = max(entry['peak_alloc_bytes'] or 0, peak_bytes)
+
+        if SPAN_LOG_PATH:
+            _log_span({
+                'ts': round(time.time(), 3), 'stage': self.stage, 'case': self.case,
+                'thread': threading.current_thread().name, 'wall_s': round(wall, 6),
+                'cpu_s': round(cpu, 6), 'alloc_blocks': blocks, 'peak_alloc_bytes': peak_bytes,
+                'error': exc_type.__name__ if exc_type is not None else None
+            })
+        return False
+
+
+def _log_span(record):
+    try:
+        with _lock, open(SPAN_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"⚠️ Span log write failed: {e}")
+
+
+def span(stage):
+    """Context manager timing one stage: `with instrumentation.span("report.pdf"): ...`"""
+    return _Span(stage) if ENABLED else _NULL_SPAN
+
+
+def instrumented(stage=None):
+    """
+    Decorator recording every call of a function as a span.
+    Usable bare (@instrumented) or named (@instrumented("segmentation.detect_tumor"));
+    the default name is module.qualname. Generator functions are timed from the
+    first to the last item. Returns the function unchanged when disabled.
+    """
+    if callable(stage):
+        return instrumented()(stage)
+
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        name = stage or f"{fn.__module__}.{fn.__qualname__}"
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                with span(name):
+                    yield from fn(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- EXPORT ---
+def snapshot():
+    """Recorded statistics as a list of dicts (one per stage and case)."""
+    with _lock:
+        return [dict(stage=stage, case=case, **entry) for (stage, case), entry in sorted(_stats.items())]
+
+
+_PROMETHEUS_METRICS = [
+    # (metric, snapshot key, type, help)
+    ('oncosim_stage_calls_total', 'calls', 'counter', "Completed calls of the stage."),
+    ('oncosim_stage_errors_total', 'errors', 'counter', "Calls of the stage that raised."),
+    ('oncosim_stage_wall_seconds_total', 'wall_s', 'counter', "Wall time spent in the stage."),
+    ('oncosim_stage_cpu_seconds_total', 'cpu_s', 'counter', "Process CPU time spent in the stage."),
+    ('oncosim_stage_wall_seconds_max', 'wall_max_s', 'gauge', "Slowest single call of the stage."),
+    ('oncosim_stage_alloc_blocks_net', 'alloc_blocks', 'gauge',
+     "Net Python memory blocks allocated by the stage."),
+    ('oncosim_stage_peak_alloc_bytes', 'peak_alloc_bytes', 'gauge',
+     "Largest traced allocation peak of one call (ONCOSIM_TRACE_MEMORY)."),
+]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def export_prometheus(path=None):
+    """Prometheus text exposition of the statistics; also written to path if given."""
+    rows = snapshot()
+    lines = []
+    for metric, key, kind, help_text in _PROMETHEUS_METRICS:
+        samples = [(row, row[key]) for row in rows if row[key] is not None]
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for row, value in samples:
+            lines.append(f'{metric}{{stage="{_label(row["stage"])}",case="{_label(row["case"])}"}} {value}')
+    text = "\n".join(lines) + "\n"
+    if path:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)  # Scrapers never see a half-written file
+    return text
+
+
+def _export_at_exit():
+    if METRICS_PATH and _stats:
+        try:
+            export_prometheus(METRICS_PATH)
+        except OSError as e:
+            print(f"⚠️ Metrics export failed: {e}")
+
+
+atexit.register(_export_at_exit)
+if ENABLED and TRACE_MEMORY:
+    tracemalloc.start()
@@ -1,51 +1,72 @@
 import math
 import random
+from functools import lru_cache
+import numpy as np
+import cv2
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+import tissue_maps
+import instrumentation
+
+# Optical properties of brain tissue per wavelength (nm):
+# (absorption mu_a, reduced scattering mu_s') in 1/mm, simplified from
+# biomedical optics literature (gray/white matter averaged).
+BRAIN_OPTICS = {
+    810:   (0.08, 1.5),   # Diode (Deep Penetration)
+    980:   (0.15, 1.3),   # Diode (Balanced)
+    1064:  (0.12, 1.2),   # Nd:YAG (Deep Penetration)
+    1320:  (0.35, 1.0),   # Nd:YAG (More superficial)
+    1470:  (1.20, 0.9),   # Diode (High water absorption, very superficial)
+    10600: (20.0, 0.1)    # CO2 (Extremely high water absorption, surface only)
+}
+
+
+def closest_wavelength(wavelength_nm):
+    """Nearest wavelength with known optical properties."""
+    return min(BRAIN_OPTICS.keys(), key=lambda k: abs(k - wavelength_nm))
+
 
 # ==========================================
 # 1. PHYSICS CALCULATION (Task 4 with Wavelength Logic)
 # ==========================================
-def calculate_laser_params(size_mm, depth_mm, wavelength_nm):
+def calculate_laser_params(size_mm, tip_offset_mm, wavelength_nm):
     """
     Calculates laser parameters using wavelength-specific absorption coefficients.
     
     Args:
         size_mm (float): Tumor diameter in millimeters.
-        depth_mm (float): Depth from surface in millimeters.
+        tip_offset_mm (float): Distance of the fiber tip from the tumor center in
+            millimeters (0 = centered). Must lie inside the tumor (<= size_mm / 2).
         wavelength_nm (int): Laser wavelength in nanometers (e.g., 980, 1064).
+    Light transport uses the diffusion approximation (see section 8).
+    Raises ValueError when the tip is outside the tumor.
     """
+    radius = size_mm / 2
+    if not 0 <= tip_offset_mm <= radius:
+        raise ValueError(f"Fiber tip {tip_offset_mm} mm from the center is outside the tumor "
+                         f"(radius {radius:.1f} mm).")
+
     # --- 1. WAVELENGTH-SPECIFIC ABSORPTION (µa) in BRAIN TISSUE ---
-    # This data is from biomedical optics literature. It's a simplified
-    # lookup table for common medical laser wavelengths.
+    # Find the closest matching coefficient from our known data (BRAIN_OPTICS)
+    wavelength_key = closest_wavelength(wavelength_nm)
+    mu_a = BRAIN_OPTICS[wavelength_key][0]
     
-    # Key: Wavelength (nm), Value: Absorption Coefficient (1/mm)
-    brain_absorption = {
-        810:  0.08,  # Diode (Deep Penetration)
-        980:  0.15,  # Diode (Balanced)
-        1064: 0.12,  # Nd:YAG (Deep Penetration)
-        1320: 0.35,  # Nd:YAG (More superficial)
-        1470: 1.20,  # Diode (High water absorption, very superficial)
-        10600: 20.0  # CO2 (Extremely high water absorption, surface only)
-    }
-    
-    # Find the closest matching coefficient from our known data
-    closest_wavelength = min(brain_absorption.keys(), key=lambda k: abs(k - wavelength_nm))
-    mu_a = brain_absorption[closest_wavelength]
-    
-    print(f"Physics: Using µa={mu_a} for wavelength ~{closest_wavelength}nm")
+    print(f"Physics: Using µa={mu_a} for wavelength ~{wavelength_key}nm")
 
-    # --- 2. TEMPERATURE & PENETRATION (Beer-Lambert Law) ---
+    # --- 2. TEMPERATURE & PENETRATION (Diffusion Approximation) ---
+    # Share of the light absorbed inside the tumor when the fiber sits tip_offset_mm
+    # from its center; scattering and tumor size count, not only mu_a.
     target_temp = 65.0
-    penetration_factor = math.exp(-mu_a * depth_mm)
+    penetration_factor = deposit_fraction(radius, tip_offset_mm, wavelength_key)
     required_intensity = 1.0 / max(penetration_factor, 1e-6) # Avoid division by zero
 
     # --- 3. ENERGY & POWER (Q = m*c*ΔT) ---
-    radius = size_mm / 2
     tumor_volume_mm3 = (4/3) * math.pi * (radius**3)
     tumor_volume_cm3 = tumor_volume_mm3 / 1000  
 
     temp_increase = target_temp - 37.0
     energy = tumor_volume_cm3 * 4.18 * temp_increase
-    energy *= required_intensity # Adjust for depth
+    energy *= required_intensity # Adjust for the light lost outside the tumor
 
     # Standard 30-second procedure target
     duration = 30.0
@@ -69,9 +90,37 @@ def calculate_laser_params(size_mm, depth_mm, wavelength_nm):
 # ==========================================
 # This part remains the same as it simulates the visual effect of the
 # calculated power, rather than re-calculating it.
-def calculate_pde_state(current_temp, target_temp, power, mask_area):
+# mask_area is in pixels of LUMPED_SPACING_MM (the constants below are
+# calibrated on 0.5 mm scans); convert counts with lumped_mask_area().
+LUMPED_SPACING_MM = 0.5
+
+
+def lumped_mask_area(pixel_count, pixel_spacing_mm):
+    """Tumor pixel count on a pixel_spacing_mm scan as LUMPED_SPACING_MM-equivalent pixels."""
+    return pixel_count * (pixel_spacing_mm / LUMPED_SPACING_MM) ** 2
+
+
+def lumped_margin_temp(core_temp, mask_area):
+    """Tumor-edge temperature for a given core (tip) temperature in the lumped model."""
+    # The edge is cooler because heat follows a Bell Curve (Gaussian).
+    # Typically, if Center is Peak, the edge is at ~1/e (~37%) or 1/e^2 (~13%) depending on radius.
+    # We simulate this spatial drop-off:
+
+    # As the tumor gets bigger (mask_area), the edge is further away, so it's cooler.
+    # Small tumor = Edge is close to center = Hotter edge.
+    # Large tumor = Edge is far from center = Cooler edge.
+    dist_factor = 1.0 / (1.0 + math.sqrt(mask_area) * 0.1)
+
+    core_rise = core_temp - 37.0
+    margin_rise = core_rise * 0.45 * dist_factor # 45% of core temp, reduced by distance
+
+    return 37.0 + margin_rise
+
+
+def calculate_pde_state(current_temp, target_temp, power, mask_area, k_cond=0.52):
     """
     Simulates heat diffusion focusing on the Centroid (Laser Tip).
+    k_cond can be taken from the tissue conductivity map at the tip.
     
     Returns:
     - next_temp: Temperature at the CENTROID (Hottest point).
@@ -81,7 +130,7 @@ def calculate_pde_state(current_temp, target_temp, power, mask_area):
     # --- 1. PHYSICAL CONSTANTS ---
     rho = 1050.0       # Density (kg/m^3)
     c_p = 3600.0       # Specific Heat (J/kg*K)
-    k_cond = 0.52      # Conductivity (W/m*K)
+    # k_cond            Conductivity (W/m*K), passed in so the tissue map can override it
     dt = 0.1           # Time step
 
     # --- 2. FOCUSING THE LASER ( The "Centroid" Logic ) ---
@@ -124,23 +173,726 @@ def calculate_pde_state(current_temp, target_temp, power, mask_area):
     next_temp = current_temp + temp_rise - cooling_perfusion - cooling_conduction
 
     # --- 6. CALCULATE MARGIN TEMP (Gaussian Decay) ---
-    # The edge is cooler because heat follows a Bell Curve (Gaussian).
-    # Typically, if Center is Peak, the edge is at ~1/e (~37%) or 1/e^2 (~13%) depending on radius.
-    # We simulate this spatial drop-off:
-    
-    # As the tumor gets bigger (mask_area), the edge is further away, so it's cooler.
-    # Small tumor = Edge is close to center = Hotter edge.
-    # Large tumor = Edge is far from center = Cooler edge.
-    dist_factor = 1.0 / (1.0 + math.sqrt(mask_area) * 0.1)
-
-    core_rise = next_temp - 37.0
-    margin_rise = core_rise * 0.45 * dist_factor # 45% of core temp, reduced by distance
-
-    margin_temp = 37.0 + margin_rise
+    margin_temp = lumped_margin_temp(next_temp, mask_area)
 
     # --- 7. CHECK STATUS ---
     # Destruction happens if the *Margin* reaches lethal temp (total ablation)
     # OR if we just want to track the core safety.
     is_destroyed = next_temp >= target_temp
 
-    return next_temp, margin_temp, is_destroyed
\ No newline at end of file
+    return next_temp, margin_temp, is_destroyed
+
+
+# ==========================================
+# 3. FULL-FIELD BIO-HEAT SOLVER (Heterogeneous Tissue)
+# ==========================================
+# Pennes equation on the image grid:
+#   rho*c * dT/dt = div(k(x) grad T) - w_b(T)*rho_b*c_b*(T - Ta) + Q
+# k(x) comes from tissue_maps.TissueMaps (per-pixel conductivity).
+TISSUE_RHO = 1050.0         # Density (kg/m^3)
+TISSUE_CP = 3600.0          # Specific Heat (J/kg*K)
+BLOOD_RHO_CP = 3800 * 1060  # Blood specific heat * density
+BASE_PERFUSION = 0.004      # 1/s
+ARTERIAL_TEMP = 37.0
+SLICE_THICKNESS_M = 0.005   # Same optical depth as the lumped tip model
+TIP_SIGMA_MM = 3.0          # Width of the Gaussian tip model (6 px on 0.5 mm pixels)
+
+
+def fiber_sources(shape, centers, power_W, sigma_px=6.0, pixel_spacing_m=5e-4,
+                  thickness_m=SLICE_THICKNESS_M):
+    """
+    Volumetric source Q (W/m^3) of each fiber tip, stacked as (K, H, W).
+    Every Gaussian integrates to power_W over the slice. The Gaussians are
+    separable, so all K are built from (K, H) and (K, W) profiles in one pass.
+    """
+    h, w = shape
+    centers = np.asarray(centers, dtype=np.float32).reshape(-1, 2)
+    xs = np.arange(w, dtype=np.float32)
+    ys = np.arange(h, dtype=np.float32)
+    gx = np.exp(-(xs[None, :] - centers[:, 0:1])**2 / (2 * sigma_px**2))
+    gy = np.exp(-(ys[None, :] - centers[:, 1:2])**2 / (2 * sigma_px**2))
+    norm = np.maximum(gx.sum(axis=1) * gy.sum(axis=1), 1e-12)
+    voxel_volume = pixel_spacing_m**2 * thickness_m
+    scale = (power_W / voxel_volume / norm).astype(np.float32)
+    return (gy * scale[:, None])[:, :, None] * gx[:, None, :]
+
+
+def gaussian_source_field(shape, center, power_W, sigma_px=6.0, pixel_spacing_m=5e-4,
+                          thickness_m=SLICE_THICKNESS_M):
+    """
+    Volumetric laser source Q (W/m^3): a 2D Gaussian centered on the laser tip.
+    The Gaussian integrates to power_W over the slice, so it is built once per run.
+    """
+    return fiber_sources(shape, [center], power_W, sigma_px, pixel_spacing_m, thickness_m)[0]
+
+
+def fiber_positions(center, axis, axis_length_px, n_fibers):
+    """
+    Tip positions (x, y) for n_fibers spread along the tumor's principal axis.
+    Each fiber sits in the middle of an equal share of the axis, so a single
+    fiber stays on the center.
+    """
+    cx, cy = center
+    ux, uy = axis
+    offsets = ((np.arange(n_fibers) + 0.5) / n_fibers - 0.5) * axis_length_px
+    return [(float(cx + o * ux), float(cy + o * uy)) for o in offsets]
+
+
+def perfusion_rate(T):
+    """Vectorized w_b(T): vasodilation above 37 C, vascular shutdown above 60 C."""
+    w_b = BASE_PERFUSION * (1 + 3.5 * (1 - np.exp(-0.5 * np.maximum(T - ARTERIAL_TEMP, 0))))
+    w_b[T > 60.0] = 0.0
+    return w_b
+
+
+def solve_bioheat_pde(T, source, conductivity_faces, dt=0.1, pixel_spacing_m=5e-4):
+    """
+    Advances the temperature field T (C, float32) by one explicit step in place.
+    conductivity_faces: cached face conductivities (W/m*K) from TissueMaps.
+    source: volumetric heat source Q (W/m^3), e.g. from gaussian_source_field.
+    """
+    conduction = tissue_maps.divergence(T, conductivity_faces)
+    conduction /= pixel_spacing_m**2
+
+    perfusion = perfusion_rate(T)
+    perfusion *= BLOOD_RHO_CP * (T - ARTERIAL_TEMP)
+
+    conduction -= perfusion
+    conduction += source
+    T += conduction * (dt / (TISSUE_RHO * TISSUE_CP))
+    return T
+
+
+# Grid selection: a run is solved on the coarsest integer downsampling of the
+# scan grid whose spacing still meets SIM_GRID_ACCURACY_MM, so fine scans
+# (e.g. 0.2 mm DICOM) are not over-resolved. When a grid is finer than the
+# explicit stability limit allows at the run's dt, each dt is split into substeps.
+SIM_GRID_ACCURACY_MM = 0.5
+
+
+def simulation_grid_factor(pixel_spacing_mm, target_accuracy_mm=SIM_GRID_ACCURACY_MM):
+    """Largest integer downsampling whose spacing is still <= target_accuracy_mm (at least 1)."""
+    return max(int(math.floor(target_accuracy_mm / pixel_spacing_mm + 1e-6)), 1)
+
+
+def stable_substeps(dt, conductivity_faces, pixel_spacing_m):
+    """Explicit substeps per dt: rho*c*dx^2 / (4*k_max) with a 2x safety factor."""
+    k_max = max((float(f.max()) for f in conductivity_faces if f.size), default=0.0)
+    if k_max <= 0:
+        return 1
+    dt_limit = 0.5 * TISSUE_RHO * TISSUE_CP * pixel_spacing_m**2 / (4 * k_max)
+    return max(int(math.ceil(dt / dt_limit - 1e-9)), 1)
+
+
+def to_grid(mask, grid_shape):
+    """Resamples a mask onto a simulation grid (area average, then > 0.5); returns bool."""
+    mask = np.asarray(mask) > 0
+    if mask.shape == tuple(grid_shape):
+        return mask
+    small = cv2.resize(mask.astype(np.float32), (grid_shape[1], grid_shape[0]), interpolation=cv2.INTER_AREA)
+    return small > 0.5
+
+
+# ==========================================
+# 4. ABLATION RUN STATE (Fixed Simulated Time Step)
+# ==========================================
+class AblationSimulation:
+    """
+    One ablation run advanced at a fixed simulated dt, independent of how
+    often (or how late) the GUI renders. Without a field, core/margin
+    temperatures come from the lumped tip model. With a field, core_temp is
+    the hottest fiber tip of the field and margin_temp the hottest healthy
+    pixel (beyond the 2 mm margin of healthy_tissue_mask), so the AI safety
+    rules and the success test see the same tissue.
+
+    fiber_tips: optional list of (x, y) tips (see fiber_positions); each fiber
+    is driven at `power`. Simultaneous fibers are superposed into one source
+    term; sequential fibers fire one at a time for dwell_s each, in turn.
+    With wavelength_nm, each fiber's source is its absorbed light (section 8)
+    instead of the Gaussian tip model.
+
+    With a field, CEM43/Arrhenius dose is accumulated every step. If the
+    tumor mask is given, success (is_destroyed) means a lethal Arrhenius dose
+    over ABLATION_COVERAGE of the tumor instead of the core temperature
+    reaching the target.
+
+    mask_area is in 0.5 mm-equivalent pixels (see lumped_mask_area).
+    pixel_spacing_mm is the scan's spacing (case_metadata.CaseMetadata). The
+    field is solved on the coarsest grid within grid_accuracy_mm (see
+    simulation_grid_factor); temperature_field and ablated_map() are always
+    returned at the scan resolution.
+    """
+    @instrumentation.instrumented("physics.ablation_setup")
+    def __init__(self, start_temp, target_temp, power, mask_area, tumor_centroid=None,
+                 field_shape=None, tissue=None, pulsed=False, dt=0.1,
+                 fiber_tips=None, sequential=False, dwell_s=30.0, tumor_mask=None, brain_mask=None,
+                 wavelength_nm=None, pixel_spacing_mm=0.5, grid_accuracy_mm=SIM_GRID_ACCURACY_MM):
+        self.dt = dt
+        self.sim_time = 0.0
+        self.steps = 0
+        self.start_temp = start_temp
+        self.target_temp = target_temp
+        self.power = power
+        self.mask_area = mask_area
+        self.pulsed = pulsed
+        self.sequential = sequential
+        self.dwell_s = dwell_s
+        self.wavelength_nm = wavelength_nm
+
+        self.core_temp = start_temp
+        self.margin_temp = start_temp
+        self.is_destroyed = False
+
+        # Local conductivity at the tip for the lumped model
+        self.k_cond = tissue.conductivity_at(tumor_centroid) if tissue is not None and tumor_centroid is not None else 0.52
+
+        # Full-field state (only when a tissue map is available)
+        self.tissue = tissue
+        self.pixel_spacing_mm = pixel_spacing_mm
+        self.field_shape = tuple(field_shape) if field_shape is not None else None
+        self.grid_field = None
+        self.grid_factor = 1
+        self.substeps = 1
+        self.unit_source = None
+        self.unit_sources = None
+        self.dose = None
+        self.dose_metrics = None
+        self.tip_index = None     # Grid (rows, cols) of the fiber tips
+        self.margin_region = None  # Grid pixels whose hottest value is margin_temp
+        self._upsampled = None  # (step, scan-resolution field) when grid_factor > 1
+        self.fiber_tips = list(fiber_tips) if fiber_tips else ([tumor_centroid] if tumor_centroid is not None else [])
+        if tissue is not None and field_shape is not None and self.fiber_tips:
+            f = self.grid_factor = simulation_grid_factor(pixel_spacing_mm, grid_accuracy_mm)
+            h, w = field_shape
+            grid_shape = (max(h // f, 1), max(w // f, 1))
+            self.grid_spacing_m = pixel_spacing_mm * f * 1e-3
+            self.faces = tissue.conductivity_faces_at(f)
+            self.substeps = stable_substeps(dt, self.faces, self.grid_spacing_m)
+            self.grid_field = np.full(grid_shape, start_temp, dtype=np.float32)
+            # 1 W source per tip, built once per run and scaled by the power
+            grid_tips = [(x / f, y / f) for x, y in self.fiber_tips]
+            self.unit_sources = laser_sources(grid_shape, grid_tips, 1.0, wavelength_nm, self.grid_spacing_m)
+            self.unit_source = self.unit_sources.sum(axis=0)
+            rows = np.clip(np.round([y / f for _, y in self.fiber_tips]).astype(int), 0, grid_shape[0] - 1)
+            cols = np.clip(np.round([x / f for x, _ in self.fiber_tips]).astype(int), 0, grid_shape[1] - 1)
+            self.tip_index = (rows, cols)
+
+            healthy = healthy_tissue_mask(tumor_mask, brain_mask, pixel_spacing_mm=pixel_spacing_mm) \
+                if tumor_mask is not None and brain_mask is not None else None
+            self.dose = ThermalDoseAccumulator(
+                grid_shape, dt, pixel_spacing_mm=pixel_spacing_mm * f,
+                tumor_mask=to_grid(tumor_mask, grid_shape) if tumor_mask is not None else None,
+                healthy_mask=to_grid(healthy, grid_shape) if healthy is not None else None)
+            if self.dose.healthy_mask is not None and self.dose.healthy_mask.any():
+                self.margin_region = self.dose.healthy_mask
+
+    @property
+    def temperature_field(self):
+        """Temperature field (C) at the scan resolution, or None without a field."""
+        if self.grid_field is None or self.grid_factor == 1:
+            return self.grid_field
+        if self._upsampled is None or self._upsampled[0] != self.steps:
+            h, w = self.field_shape
+            self._upsampled = (self.steps, cv2.resize(self.grid_field, (w, h), interpolation=cv2.INTER_LINEAR))
+        return self._upsampled[1]
+
+    def ablated_map(self):
+        """Lethal-dose pixels (bool) at the scan resolution, or None without a field."""
+        if self.dose is None:
+            return None
+        ablated = self.dose.ablated_map()
+        if self.grid_factor == 1:
+            return ablated
+        h, w = self.field_shape
+        return cv2.resize(ablated.view(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST).view(bool)
+
+    def laser_on(self, t=None):
+        """Pulse gating on simulated time (not wall clock), so it is exact at any speed."""
+        if not self.pulsed:
+            return True
+        # 1 s cycle: laser on for the first 60% (same duty cycle as before)
+        cycle = int((self.sim_time if t is None else t) * 10 + 1e-6) % 10
+        return cycle < 6
+
+    def tip_gain(self):
+        """
+        Heating of core_temp per step per watt (C/W), a prior for controllers:
+        the source at the hottest tip with a field, the lumped tip otherwise.
+        """
+        if self.grid_field is not None:
+            rows, cols = self.tip_index
+            q = float(self.unit_sources[np.arange(len(rows)), rows, cols].max())
+            return q * self.dt / (TISSUE_RHO * TISSUE_CP)
+        tip_volume_m3 = (15 + self.mask_area * 0.05) * 1e-6 * 0.005
+        return self.dt / (1050.0 * tip_volume_m3 * 3600.0)
+
+    def laser_schedule(self, n_steps):
+        """Laser on/off (1.0/0.0) for the next n_steps steps, for look-ahead controllers."""
+        if not self.pulsed:
+            return np.ones(n_steps)
+        times = self.sim_time + np.arange(n_steps) * self.dt
+        return ((times * 10 + 1e-6).astype(int) % 10 < 6).astype(np.float64)
+
+    def active_fiber(self):
+        """Index of the firing fiber in sequential mode (None when all fire together)."""
+        if not self.sequential or len(self.fiber_tips) < 2:
+            return None
+        return int(self.sim_time / self.dwell_s + 1e-6) % len(self.fiber_tips)
+
+    @instrumentation.instrumented("physics.ablation_step")
+    def step(self):
+        """Advances the run by one dt."""
+        laser_on = self.laser_on()
+
+        if self.grid_field is None:
+            next_temp, margin_temp, is_destroyed = calculate_pde_state(
+                self.core_temp, self.target_temp, self.power, self.mask_area, self.k_cond)
+            if not laser_on:
+                next_temp -= 0.3
+
+            self.core_temp = next_temp
+            self.margin_temp = margin_temp
+            self.is_destroyed = is_destroyed
+        else:
+            fiber = self.active_fiber()
+            unit = self.unit_source if fiber is None else self.unit_sources[fiber]
+            source = unit * (self.power if laser_on else 0.0)
+            for _ in range(self.substeps):
+                solve_bioheat_pde(self.grid_field, source, self.faces, dt=self.dt / self.substeps,
+                                  pixel_spacing_m=self.grid_spacing_m)
+            self.dose.update(self.grid_field)
+
+            # Area metrics need full-frame counts, so refresh them once per simulated second
+            if self.steps % 10 == 0:
+                self.dose_metrics = self.dose.metrics()
+
+            self.core_temp = float(self.grid_field[self.tip_index].max())
+            if self.margin_region is not None:
+                self.margin_temp = float(np.max(self.grid_field, where=self.margin_region, initial=-np.inf))
+            else:
+                self.margin_temp = lumped_margin_temp(self.core_temp, self.mask_area)
+            if self.dose_metrics['tumor_coverage'] is not None:
+                self.is_destroyed = self.dose_metrics['tumor_coverage'] >= ABLATION_COVERAGE
+            else:
+                self.is_destroyed = self.core_temp >= self.target_temp
+
+        self.steps += 1
+        self.sim_time = self.steps * self.dt
+        return self
+
+
+# ==========================================
+# 5. THERMAL DAMAGE (Arrhenius)
+# ==========================================
+# Omega = integral of A * exp(-Ea / (R*T)) dt; Omega >= 1 means ~63% of cells dead.
+# Coefficients for brain/soft tissue (Henriques-type fit).
+ARRHENIUS_A = 3.1e98        # Frequency factor (1/s)
+ARRHENIUS_EA = 6.28e5       # Activation energy (J/mol)
+GAS_CONSTANT = 8.314
+
+
+def arrhenius_rate(T):
+    """Damage rate dOmega/dt (1/s) for temperatures T in C (array or scalar)."""
+    T_kelvin = np.asarray(T, dtype=np.float64) + 273.15
+    return np.exp(math.log(ARRHENIUS_A) - ARRHENIUS_EA / (GAS_CONSTANT * T_kelvin))
+
+
+def arrhenius_lethal_temp(duration_s):
+    """Constant temperature (C) whose Arrhenius dose reaches Omega = 1 after duration_s."""
+    return ARRHENIUS_EA / (GAS_CONSTANT * (math.log(ARRHENIUS_A) + math.log(duration_s))) - 273.15
+
+
+# ==========================================
+# 6. CUMULATIVE THERMAL DOSE (CEM43 + Arrhenius)
+# ==========================================
+# Both doses are integrals of a function of T only, so the per-step increment
+# is a table lookup: T is quantized to DOSE_TABLE_STEP_C and indexes
+# precomputed increments (already multiplied by dt). Updated in place, and
+# only inside the warm region: below DOSE_FLOOR_C a 10-minute run adds
+# < 0.05 CEM43 minutes, so those pixels are skipped.
+CEM43_LETHAL_MIN = 240.0     # 240 equivalent minutes at 43 C = necrosis
+ABLATION_COVERAGE = 0.95     # Tumor fraction that must reach a lethal dose
+DOSE_TABLE_MIN_C = 30.0
+DOSE_TABLE_MAX_C = 130.0     # Above this everything is dead within one step anyway
+DOSE_TABLE_STEP_C = 0.01
+DOSE_FLOOR_C = 39.0
+
+
+def healthy_tissue_mask(tumor_mask, brain_mask, margin_mm=2.0, pixel_spacing_mm=0.5):
+    """Brain tissue further than margin_mm from the tumor (bool)."""
+    tumor = (np.asarray(tumor_mask) > 0).astype(np.uint8)
+    margin_px = max(int(round(margin_mm / pixel_spacing_mm)), 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * margin_px + 1, 2 * margin_px + 1))
+    return (np.asarray(brain_mask) > 0) & (cv2.dilate(tumor, kernel) == 0)
+
+
+class ThermalDoseAccumulator:
+    """
+    Per-pixel CEM43 (minutes) and Arrhenius damage (Omega) over a run.
+    tumor_mask / healthy_mask (optional) enable the coverage metrics.
+    """
+    def __init__(self, shape, dt, pixel_spacing_mm=0.5, tumor_mask=None, healthy_mask=None,
+                 roi_every=10, roi_pad=8):
+        temps = np.arange(DOSE_TABLE_MIN_C, DOSE_TABLE_MAX_C + DOSE_TABLE_STEP_C / 2, DOSE_TABLE_STEP_C)
+        r = np.where(temps >= 43.0, 0.5, 0.25)
+        self.cem43_table = (dt / 60.0 * r ** (43.0 - temps)).astype(np.float32)
+        self.omega_table = (arrhenius_rate(temps) * dt).astype(np.float32)
+        self.last_index = len(temps) - 1
+
+        self.cem43 = np.zeros(shape, dtype=np.float32)
+        self.omega = np.zeros(shape, dtype=np.float32)
+        self.pixel_area_mm2 = pixel_spacing_mm ** 2
+        self.tumor_mask = tumor_mask > 0 if tumor_mask is not None else None
+        self.healthy_mask = healthy_mask
+
+        # Warm region, refreshed every roi_every updates and padded by roi_pad
+        # pixels (heat spreads ~1.5 px per simulated second). It is also refreshed
+        # as soon as heat reaches its edge, so a fast spread never escapes it.
+        self.roi_every = roi_every
+        self.roi_pad = roi_pad
+        self.updates = 0
+        self.roi = None
+        self._warm = np.empty(shape, dtype=np.uint8)
+
+    def _refresh_roi(self, T):
+        cv2.compare(T, DOSE_FLOOR_C, cv2.CMP_GT, dst=self._warm)
+        x, y, w, h = cv2.boundingRect(self._warm)
+        if w == 0 or h == 0:
+            self.roi = None
+            return
+        H, W = T.shape
+        p = self.roi_pad
+        self.roi = (slice(max(y - p, 0), min(y + h + p, H)), slice(max(x - p, 0), min(x + w + p, W)))
+        roi_shape = (self.roi[0].stop - self.roi[0].start, self.roi[1].stop - self.roi[1].start)
+        self._scaled = np.empty(roi_shape, dtype=np.float32)
+        self._index = np.empty(roi_shape, dtype=np.int32)
+        self._increment = np.empty(roi_shape, dtype=np.float32)
+
+    def _roi_leaking(self, T):
+        """True if an ROI edge that is not the frame edge is above DOSE_FLOOR_C."""
+        rows, cols = self.roi
+        H, W = T.shape
+        return ((rows.start > 0 and T[rows.start, cols].max() > DOSE_FLOOR_C) or
+                (rows.stop < H and T[rows.stop - 1, cols].max() > DOSE_FLOOR_C) or
+                (cols.start > 0 and T[rows, cols.start].max() > DOSE_FLOOR_C) or
+                (cols.stop < W and T[rows, cols.stop - 1].max() > DOSE_FLOOR_C))
+
+    def update(self, T):
+        """Adds one dt of dose for the temperature field T (C)."""
+        if self.updates % self.roi_every == 0 or self.roi is None or self._roi_leaking(T):
+            self._refresh_roi(T)
+        self.updates += 1
+        if self.roi is None:
+            return
+
+        np.subtract(T[self.roi], DOSE_TABLE_MIN_C, out=self._scaled)
+        np.multiply(self._scaled, 1.0 / DOSE_TABLE_STEP_C, out=self._scaled)
+        np.clip(self._scaled, 0, self.last_index, out=self._scaled)
+        np.copyto(self._index, self._scaled, casting='unsafe')
+
+        np.take(self.cem43_table, self._index, out=self._increment)
+        self.cem43[self.roi] += self._increment
+        np.take(self.omega_table, self._index, out=self._increment)
+        self.omega[self.roi] += self._increment
+
+    def ablated_map(self):
+        """Pixels with a lethal Arrhenius dose (Omega >= 1)."""
+        return self.omega >= 1.0
+
+    def metrics(self):
+        ablated = self.ablated_map()
+        out = {
+            'ablated_area_mm2': round(float(np.count_nonzero(ablated)) * self.pixel_area_mm2, 2),
+            'cem43_lethal_area_mm2': round(float(np.count_nonzero(self.cem43 >= CEM43_LETHAL_MIN)) * self.pixel_area_mm2, 2),
+            'max_cem43_min': float(self.cem43.max()),
+            'tumor_coverage': None,
+            'healthy_ablated_mm2': None
+        }
+        if self.tumor_mask is not None and self.tumor_mask.any():
+            out['tumor_coverage'] = float(np.count_nonzero(ablated & self.tumor_mask) / np.count_nonzero(self.tumor_mask))
+        if self.healthy_mask is not None:
+            out['healthy_ablated_mm2'] = round(float(np.count_nonzero(ablated & self.healthy_mask)) * self.pixel_area_mm2, 2)
+        return out
+
+
+# ==========================================
+# 7. REDUCED-ORDER SURROGATE (POD of Step Responses)
+# ==========================================
+# Below COAGULATION_TEMP the model is linear once perfusion is frozen at a
+# reference rate, so the rise over 37 C is a superposition of per-fiber step
+# responses. Those are simulated once per case on a crop around the fibers,
+# compressed with POD (method of snapshots), and any piecewise-constant power
+# schedule is then a short FFT convolution in the reduced space. Predictions
+# that reach COAGULATION_TEMP fall back to the full nonlinear solver.
+COAGULATION_TEMP = 60.0     # Vascular shutdown in perfusion_rate: the model turns nonlinear
+
+
+class BioheatSurrogate:
+    """
+    Per-case reduced-order bio-heat model for a fixed set of fiber tips.
+    Use get_bioheat_surrogate() to share it through the case's TissueMaps.
+
+    pixel_spacing_m is the scan's spacing; like AblationSimulation, the model
+    is built on the simulation_grid_factor grid (roi_pad in grid pixels) and
+    its fields are returned at the scan resolution.
+    """
+    @instrumentation.instrumented("physics.surrogate_build")
+    def __init__(self, tissue, fiber_tips, field_shape, duration_s=600.0, sample_dt=1.0,
+                 n_modes=24, roi_pad=64, perfusion_ref_temp=41.0, dt=0.1, pixel_spacing_m=5e-4,
+                 wavelength_nm=None, grid_accuracy_mm=SIM_GRID_ACCURACY_MM, hot_pixels=64):
+        self.tissue = tissue
+        self.fiber_tips = [tuple(map(float, tip)) for tip in fiber_tips]
+        self.field_shape = tuple(field_shape)
+        self.sample_dt = sample_dt
+        self.grid_factor = f = simulation_grid_factor(pixel_spacing_m * 1e3, grid_accuracy_mm)
+        self.pixel_spacing_m = pixel_spacing_m * f  # Grid spacing the model is solved on
+        self.n_samples = int(round(duration_s / sample_dt))
+
+        # 1. Crop around the fibers (heat spreads < roi_pad px over the planning horizon)
+        conductivity = tissue.conductivity_at_factor(f)
+        h, w = conductivity.shape
+        self.grid_shape = (h, w)
+        grid_tips = [(x / f, y / f) for x, y in self.fiber_tips]
+        xs = [tip[0] for tip in grid_tips]
+        ys = [tip[1] for tip in grid_tips]
+        x0, x1 = max(int(min(xs)) - roi_pad, 0), min(int(max(xs)) + roi_pad + 1, w)
+        y0, y1 = max(int(min(ys)) - roi_pad, 0), min(int(max(ys)) + roi_pad + 1, h)
+        self.roi = (slice(y0, y1), slice(x0, x1))
+        self.roi_faces = tissue_maps.face_coefficients(conductivity[self.roi])
+        self.dt = dt / stable_substeps(dt, self.roi_faces, self.pixel_spacing_m)
+        roi_tips = [(x - x0, y - y0) for x, y in grid_tips]
+        self.wavelength_nm = wavelength_nm
+        self.roi_sources = laser_sources((y1 - y0, x1 - x0), roi_tips, 1.0, wavelength_nm, self.pixel_spacing_m)
+        self.tip_index = [(int(round(y)), int(round(x))) for x, y in roi_tips]
+
+        # 2. Unit-power step responses of all fibers at once (linear Pennes, frozen perfusion)
+        self.perfusion_ref = float(perfusion_rate(np.array([perfusion_ref_temp]))[0])
+        k = len(self.fiber_tips)
+        theta = np.zeros((k,) + self.roi_sources.shape[1:], dtype=np.float32)
+        snapshots = np.empty((k, self.n_samples, theta[0].size), dtype=np.float32)
+        steps_per_sample = int(round(sample_dt / self.dt))
+        sink = self.perfusion_ref * BLOOD_RHO_CP
+        scale = self.dt / (TISSUE_RHO * TISSUE_CP)
+        for n in range(self.n_samples):
+            for _ in range(steps_per_sample):
+                flux = tissue_maps.divergence(theta, self.roi_faces)
+                flux /= self.pixel_spacing_m**2
+                flux -= sink * theta
+                flux += self.roi_sources
+                theta += flux * scale
+            snapshots[:, n] = theta.reshape(k, -1)
+
+        # 3. POD basis shared by all fibers (eigenvectors of the small snapshot Gram matrix)
+        flat = snapshots.reshape(-1, theta[0].size)
+        gram = flat @ flat.T
+        eigvals, eigvecs = np.linalg.eigh(gram.astype(np.float64))
+        order = np.argsort(eigvals)[::-1][:n_modes]
+        keep = eigvals[order] > eigvals[order[0]] * 1e-12
+        order = order[keep]
+        modes = (eigvecs[:, order].T @ flat) / np.sqrt(eigvals[order])[:, None]
+        self.modes = modes.astype(np.float32)                  # (r, pixels)
+        step_coeffs = snapshots @ self.modes.T                 # (k, n, r)
+
+        # Impulse response of one sample interval at unit power: s[n] - s[n-1]
+        self.impulse = np.diff(step_coeffs, axis=1, prepend=0.0)
+        self.tip_modes = np.stack([self.modes.reshape(len(order), *theta[0].shape)[:, y, x]
+                                   for y, x in self.tip_index], axis=1)  # (r, k)
+        # Pixels that can be the hottest one: the hottest of every fiber's first and last
+        # step response (the peak stays next to a tip), tracked over time for peak_temp
+        early_late = snapshots[:, [0, -1]].reshape(-1, theta[0].size)
+        top = min(hot_pixels, theta[0].size)
+        self.hot_index = np.unique(np.argpartition(early_late, -top, axis=1)[:, -top:])
+        self.hot_modes = self.modes[:, self.hot_index]          # (r, h)
+
+    def _coefficients(self, powers):
+        """Reduced coefficients at the end of each sample interval. powers: (n,) or (n, k)."""
+        powers = np.asarray(powers, dtype=np.float64)
+        if powers.ndim == 1:
+            powers = np.repeat(powers[:, None], len(self.fiber_tips), axis=1)
+        n = powers.shape[0]
+        if n > self.n_samples:
+            raise ValueError(f"Schedule longer than the surrogate horizon ({self.n_samples} samples).")
+        nfft = 2 * n
+        P = np.fft.rfft(powers, nfft, axis=0)                          # (f, k)
+        H = np.fft.rfft(self.impulse[:, :n], nfft, axis=1)             # (k, f, r)
+        return np.fft.irfft(np.einsum('fk,kfr->fr', P, H), nfft, axis=0)[:n]   # (n, r)
+
+    def _baseline(self, start_temp, n):
+        """Uniform start offset decaying through perfusion (no gradients, so no conduction)."""
+        t = (np.arange(n) + 1) * self.sample_dt
+        rate = self.perfusion_ref * BLOOD_RHO_CP / (TISSUE_RHO * TISSUE_CP)
+        return ARTERIAL_TEMP + (start_temp - ARTERIAL_TEMP) * np.exp(-rate * t)
+
+    @instrumentation.instrumented("physics.surrogate_predict")
+    def predict(self, powers, start_temp=ARTERIAL_TEMP, fallback=True):
+        """
+        Temperatures for a power schedule (W per sample_dt interval, per fiber
+        or shared). Returns a dict with the tip temperatures over time, the
+        final field (full image), peak_temp (hottest temperature anywhere over
+        the whole run, as in solve_full) and which solver produced it.
+        With fallback=False, a schedule reaching COAGULATION_TEMP returns the
+        (no longer reliable) surrogate temperatures with solver='nonlinear'.
+        """
+        coeffs = self._coefficients(powers)
+        base = self._baseline(start_temp, len(coeffs))
+        tip_temps = coeffs @ self.tip_modes + base[:, None]
+        hot = (coeffs @ self.hot_modes).max(axis=1) + base  # Hottest candidate pixel per sample
+        peak = max(float(tip_temps.max()), float(hot.max()), start_temp)
+        if peak >= COAGULATION_TEMP:
+            if fallback:
+                return self.solve_full(powers, start_temp)
+            return {'tip_temps': tip_temps, 'field': None, 'peak_temp': peak, 'solver': 'nonlinear'}
+
+        field = np.full(self.grid_shape, start_temp, dtype=np.float32)
+        field[self.roi] = (coeffs[-1] @ self.modes).reshape(field[self.roi].shape) + base[-1]
+        return {'tip_temps': tip_temps, 'field': self._to_scan(field), 'peak_temp': max(peak, float(field.max())),
+                'solver': 'surrogate'}
+
+    @instrumentation.instrumented("physics.surrogate_solve_full")
+    def solve_full(self, powers, start_temp=ARTERIAL_TEMP):
+        """Nonlinear reference: solve_bioheat_pde on the same crop and schedule (same dict as predict)."""
+        powers = np.asarray(powers, dtype=np.float64)
+        if powers.ndim == 1:
+            powers = np.repeat(powers[:, None], len(self.fiber_tips), axis=1)
+        T = np.full(self.roi_sources.shape[1:], start_temp, dtype=np.float32)
+        steps_per_sample = int(round(self.sample_dt / self.dt))
+        tip_temps = np.empty(powers.shape)
+        peak = start_temp
+        for n, p in enumerate(powers):
+            source = np.tensordot(p.astype(np.float32), self.roi_sources, axes=1)
+            for _ in range(steps_per_sample):
+                solve_bioheat_pde(T, source, self.roi_faces, dt=self.dt, pixel_spacing_m=self.pixel_spacing_m)
+            tip_temps[n] = [T[y, x] for y, x in self.tip_index]
+            peak = max(peak, float(T.max()))
+
+        field = np.full(self.grid_shape, start_temp, dtype=np.float32)
+        field[self.roi] = T
+        return {'tip_temps': tip_temps, 'field': self._to_scan(field), 'peak_temp': peak, 'solver': 'full'}
+
+    def _to_scan(self, field):
+        """Grid field upsampled to the scan resolution (as AblationSimulation.temperature_field)."""
+        if self.grid_shape == self.field_shape:
+            return field
+        h, w = self.field_shape
+        return cv2.resize(field, (w, h), interpolation=cv2.INTER_LINEAR)
+
+
+def surrogate_key(fiber_tips, field_shape, wavelength_nm=None):
+    """Cache key of a surrogate in TissueMaps.surrogates."""
+    return (tuple((round(x, 1), round(y, 1)) for x, y in fiber_tips), tuple(field_shape),
+            closest_wavelength(wavelength_nm) if wavelength_nm is not None else None)
+
+
+def get_bioheat_surrogate(tissue, fiber_tips, field_shape, **kwargs):
+    """Builds the surrogate once per (fiber tips, shape, wavelength) and caches it on the case's TissueMaps."""
+    key = surrogate_key(fiber_tips, field_shape, kwargs.get('wavelength_nm'))
+    cache = tissue.surrogates
+    if key not in cache:
+        cache[key] = BioheatSurrogate(tissue, fiber_tips, field_shape, **kwargs)
+    return cache[key]
+
+
+# ==========================================
+# 8. LIGHT TRANSPORT (Diffusion Approximation)
+# ==========================================
+# Steady-state photon diffusion around each fiber tip on the image grid:
+#   -div(D grad phi) + mu_a * phi = S,   D = 1 / (3 * (mu_a + mu_s'))
+# S is the fiber emission (a small Gaussian diffuser). The absorbed power
+# mu_a * phi is the heat source of the Pennes solver. Light dies out within a
+# few penetration depths sqrt(D / mu_a), so each solve runs on a crop around
+# the tip (phi = 0 on its edge) and is cached per (wavelength, tip, shape):
+# comparing wavelengths or re-running a plan is a lookup, not a re-solve.
+FLUENCE_DEPTHS = 8.0        # Crop half-width in penetration depths
+FLUENCE_MIN_HALF_PX = 16
+FLUENCE_MAX_HALF_PX = 128
+EMITTER_SIGMA_MM = 1.0      # Radius of the diffusing fiber tip
+
+
+def optical_coefficients(wavelength_nm):
+    """(mu_a, mu_s', D, penetration depth) in mm units for the closest known wavelength."""
+    mu_a, mu_s = BRAIN_OPTICS[closest_wavelength(wavelength_nm)]
+    D = 1.0 / (3.0 * (mu_a + mu_s))
+    return mu_a, mu_s, D, math.sqrt(D / mu_a)
+
+
+def solve_fluence(shape, mu_a, D, source, pixel_spacing_mm=0.5):
+    """
+    Solves the diffusion equation on a (H, W) grid with phi = 0 outside it.
+    source: emitted power per pixel area (W/mm^2). Returns phi (W/mm^2, float32).
+    """
+    h, w = shape
+    n = h * w
+    coupling = D / pixel_spacing_mm**2
+    # Neighbours across the row edge do not exist (Dirichlet boundary)
+    east = np.full(n - 1, -coupling)
+    east[np.arange(1, h) * w - 1] = 0.0
+    south = np.full(n - w, -coupling)
+    diagonal = np.full(n, mu_a + 4 * coupling)
+    A = sp.diags([diagonal, east, east, south, south], [0, 1, -1, w, -w], format='csc')
+    phi = spla.spsolve(A, np.asarray(source, dtype=np.float64).ravel())
+    return phi.reshape(shape).astype(np.float32)
+
+
+@lru_cache(maxsize=64)
+@instrumentation.instrumented("physics.optical_fluence")  # Below the cache: only solves are timed
+def optical_fluence(shape, tip, wavelength_nm, pixel_spacing_mm=0.5):
+    """
+    Fluence of a 1 W fiber at tip (x, y) as (roi slices, phi crop), cached.
+    The cached array is read-only; it is shared by every caller.
+    """
+    mu_a, _, D, depth_mm = optical_coefficients(wavelength_nm)
+    half = int(np.clip(math.ceil(FLUENCE_DEPTHS * (depth_mm + EMITTER_SIGMA_MM) / pixel_spacing_mm),
+                       FLUENCE_MIN_HALF_PX, FLUENCE_MAX_HALF_PX))
+    h, w = shape
+    x, y = tip
+    x0, x1 = max(int(x) - half, 0), min(int(x) + half + 1, w)
+    y0, y1 = max(int(y) - half, 0), min(int(y) + half + 1, h)
+    crop = (y1 - y0, x1 - x0)
+
+    # Emission: 1 W spread over the diffuser, in W/mm^2
+    emission = fiber_sources(crop, [(x - x0, y - y0)], 1.0, sigma_px=EMITTER_SIGMA_MM / pixel_spacing_mm,
+                             pixel_spacing_m=1.0, thickness_m=1.0)[0] / pixel_spacing_mm**2
+    phi = solve_fluence(crop, mu_a, D, emission, pixel_spacing_mm)
+    phi.setflags(write=False)
+    return (slice(y0, y1), slice(x0, x1)), phi
+
+
+def fluence_sources(shape, centers, power_W, wavelength_nm, pixel_spacing_m=5e-4,
+                    thickness_m=SLICE_THICKNESS_M):
+    """
+    Volumetric source Q (W/m^3) absorbed from each fiber's light, stacked as (K, H, W).
+    Drop-in for fiber_sources: each map deposits power_W over the slice.
+    """
+    mu_a = optical_coefficients(wavelength_nm)[0]
+    wavelength_key = closest_wavelength(wavelength_nm)
+    pixel_spacing_mm = pixel_spacing_m * 1e3
+    voxel_volume = pixel_spacing_m**2 * thickness_m
+    out = np.zeros((len(centers),) + tuple(shape), dtype=np.float32)
+    for k, (x, y) in enumerate(centers):
+        tip = (round(float(x), 1), round(float(y), 1))
+        roi, phi = optical_fluence(tuple(shape), tip, wavelength_key, pixel_spacing_mm)
+        absorbed = mu_a * phi
+        out[k][roi] = absorbed * (power_W / (float(absorbed.sum()) * voxel_volume))
+    return out
+
+
+def laser_sources(shape, centers, power_W, wavelength_nm=None, pixel_spacing_m=5e-4):
+    """Fluence-based sources when a wavelength is given, otherwise the Gaussian tip model."""
+    if wavelength_nm is None:
+        return fiber_sources(shape, centers, power_W, sigma_px=TIP_SIGMA_MM / (pixel_spacing_m * 1e3),
+                             pixel_spacing_m=pixel_spacing_m)
+    return fluence_sources(shape, centers, power_W, wavelength_nm, pixel_spacing_m=pixel_spacing_m)
+
+
+def deposit_fraction(radius_mm, offset_mm, wavelength_nm, pixel_spacing_mm=0.5):
+    """
+    Fraction of the absorbed light that lands inside a disc of radius_mm whose
+    center is offset_mm from the fiber tip (diffusion approximation).
+    """
+    half = int(math.ceil((radius_mm + offset_mm) / pixel_spacing_mm)) + FLUENCE_MAX_HALF_PX
+    size = 2 * half + 1
+    roi, phi = optical_fluence((size, size), (float(half), float(half)),
+                               closest_wavelength(wavelength_nm), pixel_spacing_mm)
+    ys, xs = np.mgrid[roi[0], roi[1]]
+    inside = np.hypot(xs - half - offset_mm / pixel_spacing_mm, ys - half) <= radius_mm / pixel_spacing_mm
+    return float(phi[inside].sum() / phi.sum())
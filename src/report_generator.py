@@ -4,6 +4,7 @@ from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 import datetime
 import os
+import instrumentation
 
 # Helper shortcut
 def p(text):
@@ -68,6 +69,7 @@ def add_header_footer(canvas, doc):
     canvas.restoreState()
 
 
+@instrumentation.instrumented("report.generate_pdf_report")
 def generate_pdf_report(filepath, data):
     # MARGINS SAME AS YOUR ORIGINAL WORKING VERSION
     doc = SimpleDocTemplate(
@@ -130,13 +132,31 @@ def generate_pdf_report(filepath, data):
             [p("<b>Grade:</b>"), p(data.get('grade', '-')), p("<b>Depth:</b>"), p(data.get('depth', '-'))],
             [p("<b>Max Diameter:</b>"), p(str(data.get('size', '-')) + ' mm'), p("<b>Area:</b>"), p(data.get('area', '-'))],
             [p("<b>Dimensions:</b>"), p(data.get('dims', '-')), p("<b>Shape:</b>"), p(data.get('shape', '-'))],
-            [p("<b>Centroid (px):</b>"), p(data.get('location', '-'))]
+            [p("<b>Centroid (px):</b>"), p(data.get('location', '-')),
+             p("<b>Scan Geometry:</b>"), p(f"{data['scan_geometry']} ({data.get('scan_source', '-')})"
+                                           if 'scan_geometry' in data else '-')]
         ]
 
         tbl_diag = Table(diag_data, hAlign='LEFT')
         story.append(tbl_diag)
         story.append(Spacer(1, 15))
 
+        # Multi-lesion cases: one row per lesion (largest first)
+        lesions = data.get('lesions')
+        if lesions:
+            lesion_data = [[p("<b>#</b>"), p("<b>Area</b>"), p("<b>Diameter</b>"),
+                            p("<b>Centroid (px)</b>"), p("<b>Bounding Box</b>"), p("<b>Eccentricity</b>")]]
+            for i, lesion in enumerate(lesions, 1):
+                lesion_data.append([
+                    p(str(i)), p(f"{lesion['area_mm2']} mm²"), p(f"{lesion['equivalent_diameter_mm']} mm"),
+                    p(str(lesion['centroid'])), p(f"{lesion['width_mm']} x {lesion['height_mm']} mm"),
+                    p(str(lesion['eccentricity']))
+                ])
+            tbl_lesions = Table(lesion_data, hAlign='LEFT')
+            story.append(Paragraph(f"<b>Lesions:</b> {len(lesions)}", style_body))
+            story.append(tbl_lesions)
+            story.append(Spacer(1, 15))
+
         story.append(Paragraph(f"<b>Pathology Analysis:</b> {data.get('pathology','-')}", style_body))
         story.append(Spacer(1,10))
         story.append(Paragraph(
@@ -165,6 +185,19 @@ def generate_pdf_report(filepath, data):
             [p("<b>Duration:</b>"), p(f"{data.get('total_duration')} s"), "", ""],
         ]
 
+        # Cumulative thermal dose of the last simulated run
+        dose = data.get('thermal_dose')
+        if dose:
+            coverage = dose.get('tumor_coverage')
+            healthy = dose.get('healthy_ablated_mm2')
+            phys_data += [
+                [p("<b>Ablated Area (Ω≥1):</b>"), p(f"{dose.get('ablated_area_mm2')} mm²"),
+                 p("<b>Tumor Coverage:</b>"), p(f"{coverage:.0%}" if coverage is not None else '-')],
+
+                [p("<b>CEM43 ≥ 240 min:</b>"), p(f"{dose.get('cem43_lethal_area_mm2')} mm²"),
+                 p("<b>Healthy Ablated:</b>"), p(f"{healthy} mm²" if healthy is not None else '-')],
+            ]
+
         tbl_phys = Table(phys_data, hAlign='LEFT')
         story.append(tbl_phys)
         story.append(Spacer(1,25))
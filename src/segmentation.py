@@ -1,9 +1,25 @@
 import numpy as np
 from skimage import img_as_float
 from skimage.filters import threshold_multiotsu
-from scipy.ndimage import binary_fill_holes, binary_erosion, label
-from medpy.filter.smoothing import anisotropic_diffusion
+from scipy.ndimage import binary_fill_holes
 import cv2
+import instrumentation
+
+try:
+    from medpy.filter.smoothing import anisotropic_diffusion as medpy_anisotropic_diffusion
+    MEDPY_AVAILABLE = True
+except Exception:
+    medpy_anisotropic_diffusion = None
+    MEDPY_AVAILABLE = False
+
+# 'fast' = in-house Perona-Malik below, 'medpy' = the original medpy filter
+DIFFUSION_BACKEND = 'fast'
+DIFFUSION_TOL = 1e-3   # Early stop for the fast backend (relative update per iteration)
+DIFFUSION_NITER = 15
+REFINE_PAD_PX = 10     # Margin around the proposal where the level set may move
+MIN_LESION_PX = 100    # Multi-lesion mode: smaller components of the best class are dropped
+MIN_LESION_SPACING_MM = 0.5  # Pixel spacing MIN_LESION_PX was tuned on (25 mm^2)
+REFINE_COARSE_SIZE = 256  # Refinement boxes of 2x this or more use the coarse-to-fine level set
 
 # =============================================================================
 #  CORE LOGIC (Extracted from your provided code)
@@ -15,73 +31,219 @@ def calculate_shannon_entropy(image_region):
     hist = hist / hist.sum()
     return -np.sum(hist * np.log2(hist + 1e-9))
 
-def extract_brain_mask(image):
+def _erode_rect(mask, size):
+    """Erosion by a size x size square; pixels beyond the image count as background (like ndimage)."""
+    if size <= 1: return mask
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+    return cv2.erode(mask, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+
+def _fill_holes(mask):
+    """Hole filling by drawing the filled outer contours of every blob."""
+    filled = np.zeros_like(mask)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cv2.drawContours(filled, contours, -1, 1, thickness=cv2.FILLED)
+    return filled
+
+@instrumentation.instrumented("segmentation.extract_brain_mask")
+def extract_brain_mask(image, working_size=320):
+    """
+    Skull stripping: head threshold -> hole filling -> 2x 15x15 erosion ->
+    largest component -> 10x10 erosion (sizes in full-resolution pixels).
+    Scans larger than working_size are processed downsampled with scaled
+    kernels and the mask is upsampled with a smooth boundary.
+    """
     mean_val = image[image > 0].mean()
-    binary_head_mask = image > mean_val * 0.5 
-    filled_mask = binary_fill_holes(binary_head_mask)
-    struct_el = np.ones((15, 15))
-    brain_mask = binary_erosion(filled_mask, structure=struct_el, iterations=2)
-    labels, _ = label(brain_mask)
-    if labels.max() == 0: return brain_mask
-    largest_comp_label = np.argmax(np.bincount(labels.flat)[1:]) + 1
-    final_brain_mask = labels == largest_comp_label
-    shrink_struct = np.ones((10, 10))
-    return binary_erosion(final_brain_mask, structure=shrink_struct)
-
-def generate_tumor_proposal_with_hybrid_score(image, brain_mask):
+    head = (image > mean_val * 0.5).astype(np.uint8)
+
+    h, w = head.shape
+    factor = max(1, int(max(h, w) // working_size))
+    if factor > 1:
+        small = (max(w // factor, 1), max(h // factor, 1))
+        head = (cv2.resize(head.astype(np.float32), small, interpolation=cv2.INTER_AREA) >= 0.5).astype(np.uint8)
+
+    filled = _fill_holes(head)
+    # Two 15x15 erosions == one 29x29 (rectangles are separable, OpenCV erodes rows then columns)
+    brain = _erode_rect(filled, max(int(round(29 / factor)), 1))
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(brain, connectivity=4)
+    if num_labels < 2: return np.zeros((h, w), dtype=bool)
+    largest_comp_label = np.argmax(stats[1:, cv2.CC_STAT_AREA]) + 1
+    brain = (labels == largest_comp_label).astype(np.uint8)
+    brain = _erode_rect(brain, max(int(round(10 / factor)), 1))
+
+    if factor > 1:
+        brain = cv2.resize(brain.astype(np.float32), (w, h), interpolation=cv2.INTER_LINEAR) >= 0.5
+    return brain.astype(bool)
+
+@instrumentation.instrumented("segmentation.compute_intensity_classes")
+def compute_intensity_classes(image, brain_mask, classes=4):
+    """
+    Multi-Otsu intensity classes of the brain (0 = darkest ... classes-1 = brightest).
+    Pixels outside the brain are also 0, so pair the map with brain_mask.
+    Returns None if the brain is too small or Otsu fails.
+    """
     brain_pixels = image[brain_mask]
-    if brain_pixels.size < 100: return None, 0, 0
+    if brain_pixels.size < 100: return None
     try:
-        thresholds = threshold_multiotsu(brain_pixels, classes=4)
+        thresholds = threshold_multiotsu(brain_pixels, classes=classes)
         region_map = np.digitize(image, bins=thresholds)
     except:
-        return None, 0, 0 # Fallback if Otsu fails
-        
+        return None # Fallback if Otsu fails
+
     region_map[~brain_mask] = 0
+    return region_map
+
+def cluster_statistics(values, regions, n_classes, bins=256):
+    """
+    Pixel count, mean intensity and Shannon entropy of every class 0 .. n_classes-1
+    in one pass: values/regions are matching pixel arrays (intensity, class), and
+    the histograms of all classes come from a single bincount of region*bins + bin.
+    Entropy uses the same 256 bins over [0, 1] as calculate_shannon_entropy.
+    """
+    regions = regions.astype(np.int32)
+    counts = np.bincount(regions, minlength=n_classes)[:n_classes]
+    sums = np.bincount(regions, weights=values, minlength=n_classes)[:n_classes]
+    means = sums / np.maximum(counts, 1)
+
+    # Values outside [0, 1] are dropped from the histogram (like np.histogram's range)
+    in_range = (values >= 0) & (values <= 1)
+    keys = np.minimum(values * bins, bins - 1).astype(np.int32)
+    keys += regions * bins
+    hist = np.bincount(keys[in_range], minlength=n_classes * bins)[:n_classes * bins]
+    hist = hist.reshape(n_classes, bins).astype(np.float64)
+    p = hist / np.maximum(hist.sum(axis=1, keepdims=True), 1)
+    entropy = -np.sum(p * np.log2(p + 1e-9), axis=1)
+    entropy[counts == 0] = 0
+    return counts, means, entropy
+
+@instrumentation.instrumented("segmentation.generate_tumor_proposal")
+def generate_tumor_proposal_with_hybrid_score(image, brain_mask, region_map=None, min_lesion_px=None):
+    """
+    Picks the most suspicious intensity class and returns its largest component
+    as (proposal_mask, best score, mean of the other scores).
+    min_lesion_px: multi-lesion mode, keep every component at least this large
+    (the largest one is always kept).
+    """
+    brain_pixels = image[brain_mask]
+    if brain_pixels.size < 100: return None, 0, 0
+    if region_map is None:
+        region_map = compute_intensity_classes(image, brain_mask)
+    if region_map is None: return None, 0, 0
     mean_brain_intensity = brain_pixels.mean()
     std_brain_intensity = brain_pixels.std()
     if std_brain_intensity == 0: std_brain_intensity = 1e-9
 
-    cluster_data = []
-    for i in range(1, region_map.max() + 1):
-        cluster_mask = region_map == i
-        cluster_pixels = image[cluster_mask]
-        if cluster_pixels.size == 0: continue
-        entropy = calculate_shannon_entropy(cluster_pixels)
-        mean_intensity = cluster_pixels.mean()
-        cluster_data.append({'label': i, 'entropy': entropy, 'intensity': mean_intensity})
-
-    if not cluster_data: return None, 0, 0
-
-    max_entropy_found = max(d['entropy'] for d in cluster_data)
-    for data in cluster_data:
-        intensity_score = abs(data['intensity'] - mean_brain_intensity) / std_brain_intensity
-        entropy_score = data['entropy'] / max_entropy_found if max_entropy_found > 0 else 0
-        data['suspicion_score'] = (1.5 * intensity_score) + (0.5 * entropy_score)
-
-    best_candidate = max(cluster_data, key=lambda x: x['suspicion_score'])
-    
-    max_suspicion_score = best_candidate['suspicion_score']
-    other_scores = [d['suspicion_score'] for d in cluster_data if d['label'] != best_candidate['label']]
-    mean_other_scores = np.mean(other_scores) if other_scores else 0
-
-    initial_mask = (region_map == best_candidate['label'])
-    labels, num_features = label(initial_mask)
-    if num_features == 0: return None, max_suspicion_score, mean_other_scores
-    
-    largest_object_label = np.argmax(np.bincount(labels.flat)[1:]) + 1
-    proposal_mask = labels == largest_object_label
+    # Stats of every class at once; class 0 (darkest + outside brain) is never a candidate
+    inside = region_map > 0
+    counts, means, entropies = cluster_statistics(image[inside], region_map[inside], int(region_map.max()) + 1)
+    candidates = np.flatnonzero(counts[1:]) + 1
+    if candidates.size == 0: return None, 0, 0
+
+    max_entropy_found = entropies[candidates].max()
+    intensity_scores = np.abs(means[candidates] - mean_brain_intensity) / std_brain_intensity
+    entropy_scores = entropies[candidates] / max_entropy_found if max_entropy_found > 0 else 0
+    suspicion_scores = (1.5 * intensity_scores) + (0.5 * entropy_scores)
+
+    best = int(np.argmax(suspicion_scores))
+    max_suspicion_score = float(suspicion_scores[best])
+    other_scores = np.delete(suspicion_scores, best)
+    mean_other_scores = float(other_scores.mean()) if other_scores.size else 0
+
+    # Largest 4-connected component of the winning class (same connectivity as ndimage.label)
+    initial_mask = (region_map == candidates[best]).astype(np.uint8)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(initial_mask, connectivity=4)
+    if num_labels < 2: return None, max_suspicion_score, mean_other_scores
+
+    areas = stats[:, cv2.CC_STAT_AREA].copy()
+    areas[0] = 0
+    if min_lesion_px is None:
+        proposal_mask = labels == np.argmax(areas)
+    else:
+        keep = areas >= min(min_lesion_px, areas.max())
+        proposal_mask = keep[labels]
     return proposal_mask, max_suspicion_score, mean_other_scores
 
-def refine_with_multiphase_pde(image, proposal_phi, brain_phi, max_iter=50, dt=0.05, mu1=0.1, mu2=0.2):
-    phi1, phi2 = proposal_phi.copy(), brain_phi.copy()
-    epsilon = 1.0
-    for i in range(max_iter):
-        H_phi1=0.5*(1+(2/np.pi)*np.arctan(phi1/epsilon)); H_phi2=0.5*(1+(2/np.pi)*np.arctan(phi2/epsilon))
-        denom11=np.sum(H_phi1*H_phi2)+1e-8; denom10=np.sum(H_phi1*(1-H_phi2))+1e-8
-        denom01=np.sum((1-H_phi1)*H_phi2)+1e-8; denom00=np.sum((1-H_phi1)*(1-H_phi2))+1e-8
-        c11=np.sum(image*H_phi1*H_phi2)/denom11; c10=np.sum(image*H_phi1*(1-H_phi2))/denom10
-        c01=np.sum(image*(1-H_phi1)*H_phi2)/denom01; c00=np.sum(image*(1-H_phi1)*(1-H_phi2))/denom00
+def anisotropic_diffusion(image, brain_mask=None, niter=15, kappa=50, gamma=0.1, tol=1e-4):
+    """
+    Perona-Malik diffusion (exponential conduction, zero-flux border), same
+    update as medpy's anisotropic_diffusion(option=1).
+    Works in float32 on the brain bounding box grown by niter + 1 pixels:
+    the explicit stencil moves information one pixel per iteration, so the
+    zero background beyond it is untouched either way. Stops early once the
+    relative update (||du|| / ||u||) drops below tol (tol=0 runs all niter).
+    """
+    out = np.zeros(image.shape, dtype=np.float32)
+    if brain_mask is not None:
+        roi = mask_bbox(brain_mask, pad=niter + 1)
+        if roi is None: return out
+    else:
+        roi = (slice(None), slice(None))
+
+    u = np.ascontiguousarray(image[roi], dtype=np.float32)
+    h, w = u.shape
+    flux_x = np.zeros_like(u); flux_y = np.zeros_like(u)
+    cond = np.empty_like(u); update = np.empty_like(u)
+    neg_inv_kappa2 = np.float32(-1.0 / kappa**2)
+    # Flat views: horizontal neighbours are 1 apart, vertical ones w apart (contiguous, SIMD-friendly)
+    u_f, fx_f, fy_f, upd_f = u.ravel(), flux_x.ravel(), flux_y.ravel(), update.ravel()
+
+    for _ in range(niter):
+        # Forward differences; the last column/row has no outgoing flux
+        np.subtract(u_f[1:], u_f[:-1], out=fx_f[:-1])
+        flux_x[:, -1] = 0
+        np.subtract(u_f[w:], u_f[:-w], out=fy_f[:-w])
+        for flux in (flux_x, flux_y):
+            np.multiply(flux, flux, out=cond)
+            cond *= neg_inv_kappa2
+            cv2.exp(cond, cond)
+            flux *= cond
+
+        # Divergence: outgoing flux minus incoming flux
+        np.add(flux_x, flux_y, out=update)
+        upd_f[1:] -= fx_f[:-1]    # fx is 0 in the last column, so nothing wraps across rows
+        upd_f[w:] -= fy_f[:-w]
+        update *= gamma
+        u += update
+
+        if tol > 0 and np.vdot(update, update) <= tol**2 * np.vdot(u, u):
+            break
+
+    out[roi] = u
+    return out
+
+@instrumentation.instrumented("segmentation.anisotropic_diffusion")
+def smooth_brain(brain_only, brain_mask, backend=None):
+    """Edge-preserving smoothing stage of detect_tumor ('fast' or 'medpy' backend)."""
+    backend = backend or DIFFUSION_BACKEND
+    if backend == 'medpy':
+        if not MEDPY_AVAILABLE:
+            raise ImportError("medpy is not installed; use the 'fast' diffusion backend.")
+        return medpy_anisotropic_diffusion(brain_only, niter=DIFFUSION_NITER, kappa=50, gamma=0.1)
+    return anisotropic_diffusion(brain_only, brain_mask, niter=DIFFUSION_NITER, kappa=50, gamma=0.1, tol=DIFFUSION_TOL)
+
+def mask_bbox(mask, pad=0):
+    """Bounding box (row slice, col slice) of a mask grown by pad pixels, or None if empty."""
+    ys, xs = np.nonzero(mask)
+    if ys.size == 0: return None
+    h, w = mask.shape
+    return (slice(max(ys.min() - pad, 0), min(ys.max() + pad + 1, h)),
+            slice(max(xs.min() - pad, 0), min(xs.max() + pad + 1, w)))
+
+def _heaviside(phi, epsilon):
+    return 0.5*(1+(2/np.pi)*np.arctan(phi/epsilon))
+
+def _chan_vese_iterations(image, phi1, H_phi2, exterior, n_iter, dt, mu1, epsilon=1.0, area_scale=1.0):
+    """
+    Evolves phi1 in place for n_iter steps. exterior: the 8 region sums of
+    pixels outside this grid (4 weights, then 4 intensity-weighted);
+    area_scale = full-resolution pixels per grid pixel (pyramid levels).
+    """
+    for i in range(n_iter):
+        H_phi1=_heaviside(phi1, epsilon)
+        w11=H_phi1*H_phi2; w10=H_phi1*(1-H_phi2); w01=(1-H_phi1)*H_phi2; w00=(1-H_phi1)*(1-H_phi2)
+        denom11=area_scale*np.sum(w11)+exterior[0]+1e-8; denom10=area_scale*np.sum(w10)+exterior[1]+1e-8
+        denom01=area_scale*np.sum(w01)+exterior[2]+1e-8; denom00=area_scale*np.sum(w00)+exterior[3]+1e-8
+        c11=(area_scale*np.sum(image*w11)+exterior[4])/denom11; c10=(area_scale*np.sum(image*w10)+exterior[5])/denom10
+        c01=(area_scale*np.sum(image*w01)+exterior[6])/denom01; c00=(area_scale*np.sum(image*w00)+exterior[7])/denom00
         force1 = (-(image-c11)**2 + (image-c01)**2)*H_phi2 + (-(image-c10)**2 + (image-c00)**2)*(1-H_phi2)
         dirac_phi1 = (epsilon/np.pi)/(epsilon**2+phi1**2)
         phi1_y, phi1_x = np.gradient(phi1); grad_phi1_norm = np.sqrt(phi1_x**2+phi1_y**2+1e-8)
@@ -91,14 +253,76 @@ def refine_with_multiphase_pde(image, proposal_phi, brain_phi, max_iter=50, dt=0
         phi1 += dt*dphi1_dt
     return phi1
 
+def _coarse_to_fine(image, phi1, phi2, exterior, levels, max_iter, fine_iter, dt, mu1, epsilon, area_scale=1.0):
+    """Converges on a 2x-downsampled copy first (recursively), then polishes phi1 with fine_iter steps here."""
+    n_iter = max_iter
+    if levels > 1 and min(image.shape) >= 32:
+        h, w = image.shape
+        coarse_phi1 = _coarse_to_fine(cv2.pyrDown(image), cv2.pyrDown(phi1), cv2.pyrDown(phi2), exterior,
+                                      levels - 1, max_iter, fine_iter, dt, mu1, epsilon, area_scale * 4)
+        phi1[:] = cv2.resize(coarse_phi1, (w, h), interpolation=cv2.INTER_LINEAR)
+        n_iter = fine_iter
+    return _chan_vese_iterations(image, phi1, _heaviside(phi2, epsilon), exterior, n_iter, dt, mu1, epsilon, area_scale)
+
+@instrumentation.instrumented("segmentation.refine_with_multiphase_pde")
+def refine_with_multiphase_pde(image, proposal_phi, brain_phi, max_iter=50, dt=0.05, mu1=0.1, mu2=0.2, roi=None,
+                               levels=1, fine_iter=5):
+    """
+    Two-phase Chan-Vese refinement of the proposal (phi1); the brain (phi2) is fixed.
+    roi: optional (row slice, col slice) where phi1 evolves. Outside it phi1
+    stays as given, and those pixels enter the region means as constant sums
+    computed once, so only the ROI is touched per iteration.
+    levels > 1: coarse-to-fine. max_iter steps on the coarsest of `levels`
+    pyramid levels, then fine_iter steps on each finer one.
+    """
+    epsilon = 1.0
+    image = np.asarray(image, dtype=np.float64)
+    phi1_full = np.array(proposal_phi, dtype=np.float64)
+    exterior = np.zeros(8)
+    if roi is not None:
+        outside = np.ones(image.shape, dtype=bool); outside[roi] = False
+        H1o = _heaviside(phi1_full[outside], epsilon); H2o = _heaviside(brain_phi[outside], epsilon)
+        weights = [H1o*H2o, H1o*(1-H2o), (1-H1o)*H2o, (1-H1o)*(1-H2o)]
+        Io = image[outside]
+        exterior = np.array([np.sum(w) for w in weights] + [np.sum(Io*w) for w in weights])
+        image, phi2 = image[roi], brain_phi[roi]
+        phi1 = phi1_full[roi]  # View: updates land in phi1_full
+    else:
+        phi1, phi2 = phi1_full, brain_phi
+
+    phi2 = np.asarray(phi2, dtype=np.float64)
+    _coarse_to_fine(image, phi1, phi2, exterior, levels, max_iter, fine_iter, dt, mu1, epsilon)
+    return phi1_full
+
+def refine_levels(shape, coarse_size=REFINE_COARSE_SIZE):
+    """Pyramid levels for a refinement box: halve while the coarsest side stays >= coarse_size."""
+    levels = 1
+    side = max(shape)
+    while side >= 2 * coarse_size:
+        side /= 2
+        levels += 1
+    return levels
+
+
+def min_lesion_pixels(pixel_spacing_mm=None):
+    """Multi-lesion size floor in pixels for a scan spacing (MIN_LESION_PX when unknown)."""
+    if pixel_spacing_mm is None:
+        return MIN_LESION_PX
+    return max(int(round(MIN_LESION_PX * (MIN_LESION_SPACING_MM / pixel_spacing_mm) ** 2)), 1)
+
+
 # =============================================================================
 #  INTERFACE FUNCTION (Called by GUI)
 # =============================================================================
 
-def detect_tumor(image_bgr):
+@instrumentation.instrumented("segmentation.detect_tumor")
+def detect_tumor(image_bgr, diffusion_backend=None, multi_lesion=False, pixel_spacing_mm=None):
     """
     Input: OpenCV Image (BGR, 0-255)
     Output: Dictionary with mask and confidence, plus brain_mask (as uint8)
+    diffusion_backend: 'fast' or 'medpy' (default DIFFUSION_BACKEND)
+    multi_lesion: keep every lesion of the suspicious class (>= MIN_LESION_PX), not only the largest
+    pixel_spacing_mm: scan spacing; the multi-lesion floor keeps the same area in mm^2
     """
     try:
         # 1. Preprocess: Convert to Float Grayscale (0.0 - 1.0)
@@ -112,12 +336,20 @@ def detect_tumor(image_bgr):
         if not np.any(brain_mask): 
             return {"found": False, "brain_mask": None}
 
+        # Everything below runs on the brain bounding box. The margin covers how
+        # far diffusion spreads into the background, so the crop is exact.
+        brain_roi = mask_bbox(brain_mask, pad=DIFFUSION_NITER + 1)
+        brain_crop = brain_mask[brain_roi]
+
         # 3. Smoothing
-        brain_only = img_float * brain_mask
-        processed = anisotropic_diffusion(brain_only, niter=15, kappa=50, gamma=0.1)
+        brain_only = img_float[brain_roi] * brain_crop
+        processed = smooth_brain(brain_only, brain_crop, diffusion_backend)
         
-        # 4. Generate Proposal
-        proposal_mask, max_score, mean_score = generate_tumor_proposal_with_hybrid_score(processed, brain_mask)
+        # 4. Generate Proposal (the Otsu classes double as the tissue map for the physics)
+        class_crop = compute_intensity_classes(processed, brain_crop)
+        proposal_mask, max_score, mean_score = generate_tumor_proposal_with_hybrid_score(
+            processed, brain_crop, class_crop,
+            min_lesion_px=min_lesion_pixels(pixel_spacing_mm) if multi_lesion else None)
         
         # 5. Check Confidence
         if mean_score == 0: 
@@ -140,22 +372,33 @@ def detect_tumor(image_bgr):
                 "scores": (max_score, mean_score)
             }
             
-        # 7. Refine with PDE
-        proposal_phi = np.where(proposal_mask, -2.0, 2.0)
+        # 7. Refine with PDE (full frame for the region means, level set only around the proposal)
+        processed_full = np.zeros(img_float.shape, dtype=processed.dtype)
+        processed_full[brain_roi] = processed
+        proposal_full = np.zeros(img_float.shape, dtype=bool)
+        proposal_full[brain_roi] = proposal_mask
+        proposal_phi = np.where(proposal_full, -2.0, 2.0)
         brain_phi = np.where(brain_mask, -2.0, 2.0)
-        final_phi = refine_with_multiphase_pde(processed, proposal_phi, brain_phi)
+        refine_roi = mask_bbox(proposal_full, pad=REFINE_PAD_PX)
+        box_shape = (refine_roi[0].stop - refine_roi[0].start, refine_roi[1].stop - refine_roi[1].start)
+        final_phi = refine_with_multiphase_pde(processed_full, proposal_phi, brain_phi, roi=refine_roi,
+                                               levels=refine_levels(box_shape))
         
-        refined_mask = binary_fill_holes(final_phi < 0)
+        refined_mask = np.zeros(img_float.shape, dtype=bool)
+        refined_mask[refine_roi] = binary_fill_holes(final_phi[refine_roi] < 0)
         
         # Convert boolean mask back to uint8 (0, 255) for OpenCV
         final_mask_uint8 = (refined_mask * 255).astype(np.uint8)
+        tissue_classes = np.zeros(gray.shape, dtype=np.uint8)
+        tissue_classes[brain_roi] = class_crop
         
         return {
             "found": True,
             "mask": final_mask_uint8,
             "confidence": confidence,
             "scores": (max_score, mean_score),
-            "brain_mask": brain_mask_uint8
+            "brain_mask": brain_mask_uint8,
+            "tissue_classes": tissue_classes
         }
 
     except Exception as e:
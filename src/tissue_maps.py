@@ -0,0 +1,123 @@
+import numpy as np
+import cv2
+
+# =============================================================================
+#  TISSUE PROPERTIES PER INTENSITY CLASS
+# =============================================================================
+# The multi-Otsu classes from segmentation.compute_intensity_classes are
+# ordered dark -> bright. On the T1/T1-contrast scans OncoSim is used with,
+# that maps roughly to CSF -> gray matter -> white matter (the brightest class
+# also holds enhancing lesion, which we treat like white matter).
+#
+# Value: (name, relative tumor-cell motility, thermal conductivity W/(m*K))
+# Motility follows the Swanson glioma model (white matter ~5x gray matter).
+TISSUE_PROPERTIES = {
+    0: ("CSF",          0.1, 0.57),
+    1: ("Gray Matter",  1.0, 0.55),
+    2: ("White Matter", 5.0, 0.48),
+    3: ("White Matter", 5.0, 0.48),
+}
+OUTSIDE_BRAIN = ("Background", 0.0, 0.52)  # Skull/scalp: keep the old scalar conductivity
+
+
+def face_coefficients(field):
+    """
+    Coefficients on the cell faces between neighbouring pixels (harmonic mean).
+    Returns (fx, fy) with shapes (H, W-1) and (H-1, W).
+    The harmonic mean makes a zero-coefficient pixel block the flux completely.
+    """
+    field = field.astype(np.float32)
+    a, b = field[:, :-1], field[:, 1:]
+    fx = np.where(a + b > 0, 2 * a * b / np.maximum(a + b, 1e-12), 0).astype(np.float32)
+    a, b = field[:-1, :], field[1:, :]
+    fy = np.where(a + b > 0, 2 * a * b / np.maximum(a + b, 1e-12), 0).astype(np.float32)
+    return fx, fy
+
+
+def divergence(u, faces, out=None):
+    """
+    Variable-coefficient diffusion term div(k * grad(u)) on a unit grid.
+    - u may be (H, W) or a stacked (N, H, W) array; faces come from face_coefficients.
+    - Zero-flux (Neumann) boundary: no flux leaves the image.
+    Divide by the pixel spacing squared to get physical units.
+    """
+    fx, fy = faces
+    if out is None:
+        out = np.zeros_like(u)
+    else:
+        out[...] = 0
+
+    flux = fx * (u[..., :, 1:] - u[..., :, :-1])
+    out[..., :, :-1] += flux
+    out[..., :, 1:] -= flux
+
+    flux = fy * (u[..., 1:, :] - u[..., :-1, :])
+    out[..., :-1, :] += flux
+    out[..., 1:, :] -= flux
+    return out
+
+
+class TissueMaps:
+    """
+    Per-case coefficient fields built once from the segmentation tissue classes.
+    Face coefficients are cached, so the solvers never rebuild them per step.
+    """
+    def __init__(self, tissue_classes, brain_mask):
+        classes = np.asarray(tissue_classes)
+        inside = np.asarray(brain_mask) > 0
+
+        motility = np.full(classes.shape, OUTSIDE_BRAIN[1], dtype=np.float32)
+        conductivity = np.full(classes.shape, OUTSIDE_BRAIN[2], dtype=np.float32)
+        for label, (_, rel_motility, k_cond) in TISSUE_PROPERTIES.items():
+            region = inside & (classes == label)
+            motility[region] = rel_motility
+            conductivity[region] = k_cond
+
+        # Normalize motility to a brain mean of 1, so the user's D keeps its global meaning
+        if np.any(inside):
+            mean_motility = motility[inside].mean()
+            if mean_motility > 0:
+                motility /= mean_motility
+
+        self.tissue_classes = classes
+        self.relative_diffusivity = motility
+        self.conductivity = conductivity
+        self._faces = {}
+        self.surrogates = {}  # laser_physics.get_bioheat_surrogate cache (per fiber layout)
+
+    @property
+    def diffusivity_faces(self):
+        if 'diffusivity' not in self._faces:
+            self._faces['diffusivity'] = face_coefficients(self.relative_diffusivity)
+        return self._faces['diffusivity']
+
+    @property
+    def conductivity_faces(self):
+        if 'conductivity' not in self._faces:
+            self._faces['conductivity'] = face_coefficients(self.conductivity)
+        return self._faces['conductivity']
+
+    def conductivity_at_factor(self, factor):
+        """Conductivity on a grid downsampled by an integer factor (area average)."""
+        if factor == 1:
+            return self.conductivity
+        h, w = self.conductivity.shape
+        size = (max(w // factor, 1), max(h // factor, 1))
+        return cv2.resize(self.conductivity, size, interpolation=cv2.INTER_AREA)
+
+    def conductivity_faces_at(self, factor):
+        """Conductivity faces on a grid downsampled by an integer factor (area average), cached."""
+        if factor == 1:
+            return self.conductivity_faces
+        key = ('conductivity', factor)
+        if key not in self._faces:
+            self._faces[key] = face_coefficients(self.conductivity_at_factor(factor))
+        return self._faces[key]
+
+    def conductivity_at(self, center, radius=3):
+        """Mean conductivity in a small window (e.g. around the laser tip)."""
+        x, y = int(center[0]), int(center[1])
+        h, w = self.conductivity.shape
+        window = self.conductivity[max(0, y - radius):min(h, y + radius + 1),
+                                   max(0, x - radius):min(w, x + radius + 1)]
+        return float(window.mean()) if window.size else OUTSIDE_BRAIN[2]
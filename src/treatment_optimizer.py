@@ -0,0 +1,219 @@
+import os
+import time
+import multiprocessing
+import numpy as np
+import cv2
+import laser_physics
+import tissue_maps
+import instrumentation
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# =============================================================================
+#  AUTOMATIC FIBER PLACEMENT & DOSE OPTIMIZER
+# =============================================================================
+# 1. Coarse search: every (fiber count, spread, power) candidate runs the
+#    Pennes solver on a downsampled crop around the tumor with a large dt.
+#    One run covers all candidate durations (checkpoints along the way).
+# 2. Full-fidelity check: the best plans are re-run on the simulation grid
+#    (laser_physics.simulation_grid_factor of the scan spacing) and the real
+#    dt (0.1 s) before one is returned.
+# A plan is feasible when it runs like the live ablation would: the tumor
+# reaches laser_physics.ABLATION_COVERAGE before any SurgicalAI STOP (hottest
+# tip at target + STOP_MARGIN_C, or a lethal dose in healthy brain beyond the
+# safety margin). Feasible plans are preferred with healthy brain below
+# HEALTHY_LIMIT_C (the AI warns above it), then by the least delivered energy.
+
+HEALTHY_LIMIT_C = 45.0
+STOP_MARGIN_C = 8.0     # SurgicalAI.analyze_telemetry stops at target + 8 C
+PIXEL_SPACING_MM = 0.5  # Default scan spacing (case_metadata.DEFAULT_SPACING_MM)
+
+
+def _build_case(tumor_mask, brain_mask, conductivity, factor, pixel_spacing_mm=PIXEL_SPACING_MM,
+                max_dt=0.1, pad_px=30, margin_mm=2.0):
+    """
+    Crops the tumor neighbourhood and resamples it by 1/factor.
+    Healthy tissue = brain further than margin_mm from the tumor.
+    """
+    tumor = (tumor_mask > 0).astype(np.uint8)
+    ys, xs = np.nonzero(tumor)
+    h, w = tumor.shape
+    x0, x1 = max(xs.min() - pad_px, 0), min(xs.max() + pad_px + 1, w)
+    y0, y1 = max(ys.min() - pad_px, 0), min(ys.max() + pad_px + 1, h)
+
+    healthy = laser_physics.healthy_tissue_mask(tumor, brain_mask, margin_mm,
+                                                pixel_spacing_mm).astype(np.float32)
+
+    crops = [tumor[y0:y1, x0:x1].astype(np.float32), healthy[y0:y1, x0:x1],
+             conductivity[y0:y1, x0:x1].astype(np.float32)]
+    if factor > 1:
+        size = (max((x1 - x0) // factor, 1), max((y1 - y0) // factor, 1))
+        crops = [cv2.resize(c, size, interpolation=cv2.INTER_AREA) for c in crops]
+    tumor_c, healthy_c, k_c = crops
+
+    spacing = pixel_spacing_mm * 1e-3 * factor
+    # Explicit stability: dt < rho*c*dx^2 / (4*k_max); keep a 2x safety factor, at most max_dt
+    dt_limit = laser_physics.TISSUE_RHO * laser_physics.TISSUE_CP * spacing**2 / (4 * float(k_c.max()))
+    return {
+        'origin': (x0, y0),
+        'factor': factor,
+        'tumor': tumor_c > 0.5,
+        'healthy': healthy_c > 0.5,
+        'faces': tissue_maps.face_coefficients(k_c),
+        'pixel_spacing_m': spacing,
+        'dt': min(0.5 * dt_limit, max_dt)
+    }
+
+
+def simulate_plan(case, fiber_tips, power_W, durations, start_temp=37.0, target_temp=60.0,
+                  wavelength_nm=None):
+    """
+    Runs one plan on a case grid and reports every checkpoint duration.
+    The source model is the live run's (laser_physics.laser_sources at wavelength_nm).
+    Returns [{duration_s, coverage, tip_peak_C, healthy_peak_C, stopped}]; stopped
+    means a SurgicalAI STOP was due by then. Ends at the first stopped checkpoint
+    or the first one reaching ABLATION_COVERAGE (the live run ends there too).
+    """
+    factor = case['factor']
+    x0, y0 = case['origin']
+    shape = case['tumor'].shape
+    tips = [((x - x0) / factor, (y - y0) / factor) for x, y in fiber_tips]
+    source = laser_physics.laser_sources(shape, tips, power_W, wavelength_nm,
+                                         pixel_spacing_m=case['pixel_spacing_m']).sum(axis=0)
+    tip_rows = np.clip(np.round([y for _, y in tips]).astype(int), 0, shape[0] - 1)
+    tip_cols = np.clip(np.round([x for x, _ in tips]).astype(int), 0, shape[1] - 1)
+
+    T = np.full(shape, start_temp, dtype=np.float32)
+    omega = np.zeros(shape, dtype=np.float64)
+    dt = case['dt']
+    tumor, healthy = case['tumor'], case['healthy']
+    tip_peak = healthy_peak = start_temp
+
+    results = []
+    step = 0
+    for duration in sorted(durations):
+        target_steps = int(round(duration / dt))
+        while step < target_steps:
+            laser_physics.solve_bioheat_pde(T, source, case['faces'], dt=dt,
+                                            pixel_spacing_m=case['pixel_spacing_m'])
+            omega += laser_physics.arrhenius_rate(T) * dt
+            tip_peak = max(tip_peak, float(T[tip_rows, tip_cols].max()))
+            if healthy.any():
+                healthy_peak = max(healthy_peak, float(T[healthy].max()))
+            step += 1
+
+        coverage = float((omega[tumor] >= 1.0).mean()) if tumor.any() else 0.0
+        stopped = tip_peak >= target_temp + STOP_MARGIN_C or bool(np.any(omega[healthy] >= 1.0))
+        results.append({
+            'duration_s': float(duration),
+            'coverage': coverage,
+            'tip_peak_C': tip_peak,
+            'healthy_peak_C': healthy_peak,
+            'stopped': stopped
+        })
+        if stopped or coverage >= laser_physics.ABLATION_COVERAGE:
+            break
+    return results
+
+
+def is_feasible(plan):
+    """True when the plan reaches ABLATION_COVERAGE without a SurgicalAI STOP."""
+    return not plan['stopped'] and plan['coverage'] >= laser_physics.ABLATION_COVERAGE
+
+
+# --- Worker process side (case is sent once per worker) ---
+_OPT_CASE = None
+
+
+def _attach_case(case):
+    global _OPT_CASE
+    _OPT_CASE = case
+
+
+def _evaluate_candidate(n_fibers, spread, power_W, center, axis, axis_length_px, durations, run):
+    tips = laser_physics.fiber_positions(center, axis, axis_length_px * spread, n_fibers)
+    out = []
+    for result in simulate_plan(_OPT_CASE, tips, power_W, durations, **run):
+        result.update({'n_fibers': n_fibers, 'spread': spread, 'power_W': power_W, 'fiber_tips': tips})
+        out.append(result)
+    return out
+
+
+def _rank_key(plan):
+    """
+    Feasible first (unstopped before stopped otherwise), then coverage (to 1%),
+    then healthy peak below HEALTHY_LIMIT_C, then least delivered energy.
+    """
+    energy = plan['n_fibers'] * plan['power_W'] * plan['duration_s']
+    return (not is_feasible(plan), plan['stopped'], -round(plan['coverage'], 2),
+            plan['healthy_peak_C'] >= HEALTHY_LIMIT_C, energy)
+
+
+@instrumentation.instrumented("planning.optimize_treatment")
+def optimize_treatment(tumor_mask, brain_mask, tumor_stats, tissue=None,
+                       max_fibers=3, spreads=(0.5, 0.75, 1.0),
+                       powers=np.arange(0.25, 3.01, 0.25), durations=range(60, 601, 60),
+                       coarse_factor=4, n_verify=3, max_workers=None, pixel_spacing_mm=PIXEL_SPACING_MM,
+                       grid_accuracy_mm=laser_physics.SIM_GRID_ACCURACY_MM,
+                       start_temp=37.0, target_temp=60.0, wavelength_nm=None):
+    """
+    Searches fiber count, spread along the principal axis, power and duration.
+    tumor_stats: output of tumor_measurement.measure_tumor_advanced.
+    coarse_factor is relative to the full-fidelity grid chosen for grid_accuracy_mm.
+    start_temp / target_temp / wavelength_nm: those of the live run (continuous,
+    simultaneous fibers), so feasibility matches its STOP rules.
+    Returns the best plan (dict) after the full-fidelity check, or None.
+    Workers are spawned, so it is safe to call from a GUI thread.
+    """
+    t_start = time.perf_counter()
+    if tumor_stats is None or not np.any(tumor_mask > 0):
+        return None
+
+    conductivity = tissue.conductivity if tissue is not None else \
+        np.full(tumor_mask.shape, tissue_maps.OUTSIDE_BRAIN[2], dtype=np.float32)
+    grid_factor = laser_physics.simulation_grid_factor(pixel_spacing_mm, grid_accuracy_mm)
+    coarse = _build_case(tumor_mask, brain_mask, conductivity, grid_factor * coarse_factor,
+                         pixel_spacing_mm, max_dt=1.0)
+
+    center = tumor_stats['center']
+    axis = tumor_stats.get('principal_axis', (1.0, 0.0))
+    axis_length = tumor_stats.get('axis_length_px', 0.0)
+    durations = list(durations)
+    run = {'start_temp': start_temp, 'target_temp': target_temp, 'wavelength_nm': wavelength_nm}
+
+    candidates = [(1, 1.0, float(p)) for p in powers]
+    for n in range(2, max_fibers + 1):
+        candidates += [(n, s, float(p)) for s in spreads for p in powers]
+
+    # --- 1. Coarse surrogate search (parallel) ---
+    plans = []
+    workers = max_workers or os.cpu_count() or 1
+    with instrumentation.span("planning.coarse_search"), \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=_attach_case, initargs=(coarse,)) as pool:
+        futures = [pool.submit(_evaluate_candidate, n, s, p, center, axis, axis_length, durations, run)
+                   for n, s, p in candidates]
+        for future in as_completed(futures):
+            plans.extend(future.result())
+
+    if not plans:
+        return None
+    plans.sort(key=_rank_key)
+
+    # --- 2. Full-fidelity check of the best few (over all durations: the fine
+    # grid may need longer, or less, than the coarse one) ---
+    full = _build_case(tumor_mask, brain_mask, conductivity, grid_factor, pixel_spacing_mm)
+    best = None
+    with instrumentation.span("planning.full_check"):
+        for plan in plans[:n_verify]:
+            check = simulate_plan(full, plan['fiber_tips'], plan['power_W'], durations, **run)[-1]
+            verified = dict(plan, surrogate_coverage=plan['coverage'], **check)
+            if best is None or _rank_key(verified) < _rank_key(best):
+                best = verified
+            if is_feasible(verified):
+                break  # Plans are ranked; the first one that holds up at full fidelity wins
+
+    best['feasible'] = is_feasible(best)
+    best['energy_J'] = round(best['n_fibers'] * best['power_W'] * best['duration_s'], 1)
+    best['candidates_evaluated'] = len(candidates)
+    best['elapsed_s'] = round(time.perf_counter() - t_start, 2)
+    return best
@@ -1,37 +1,88 @@
 import numpy as np
 import cv2
 import time
+import os
+import multiprocessing
+import tissue_maps
+import instrumentation
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
 
-def simulate_tumor_growth_fast(initial_mask: np.ndarray, brain_mask: np.ndarray, params: dict, end_time: int, save_every: int = 5):
+def _time_stepping(time_scale, end_time):
+    """Returns (dt, steps) so that the run reaches end_time in the given scale."""
+    if time_scale == 'days':
+        # If one step is 2.4 hours, how many steps to reach end_time days?
+        dt = 2.4
+        steps = int((end_time * 24) / dt)
+    else:  # hours
+        # If one step is 0.1 hours, how many steps to reach end_time hours?
+        dt = 0.1
+        steps = int(end_time / dt)
+    return dt, steps
+
+# D is calibrated on 0.5 mm pixels (the stencils are in pixel units); on other
+# grids it is rescaled by (D_REFERENCE_SPACING_MM / spacing)^2 so the spread
+# in mm does not depend on the scan resolution. Finer grids split every dt
+# into as many substeps, so D*dt per explicit update stays at its 0.5 mm value
+# (the 5-point stencil turns into a checkerboard beyond D*dt = 0.25).
+D_REFERENCE_SPACING_MM = 0.5
+
+def _grid_diffusivity(D, pixel_scale_mm):
+    return D * (D_REFERENCE_SPACING_MM / pixel_scale_mm) ** 2
+
+def _grid_substeps(pixel_scale_mm):
+    """Explicit substeps per dt on a pixel_scale_mm grid (1 at and above the reference spacing)."""
+    return max(int(np.ceil((D_REFERENCE_SPACING_MM / pixel_scale_mm) ** 2 - 1e-9)), 1)
+
+def _equivalent_radius_mm(pixel_count, pixel_scale_mm):
+    return np.sqrt(pixel_count * (pixel_scale_mm**2) / np.pi) if pixel_count > 0 else 0
+
+def _fisher_kpp_step(u, D, rho, beta, dt, brain_mask_float, diffusivity_faces=None):
+    """
+    Advances the density field u by one explicit step (in place).
+    With diffusivity_faces (see tissue_maps) the diffusion term is div(D(x) grad u)
+    instead of a constant-coefficient Laplacian.
+    """
+    if diffusivity_faces is None:
+        laplacian = cv2.Laplacian(u, cv2.CV_32F)
+    else:
+        laplacian = tissue_maps.divergence(u, diffusivity_faces)
+    reaction = rho * u * (1 - u) - beta * u
+    change_in_u = dt * (D * laplacian + reaction)
+
+    # Apply brain mask to stop growth
+    u += (change_in_u * brain_mask_float)
+
+    np.clip(u, 0.0, 1.0, out=u)
+    return u
+
+@instrumentation.instrumented("growth.simulate_tumor_growth_fast")
+def simulate_tumor_growth_fast(initial_mask: np.ndarray, brain_mask: np.ndarray, params: dict, end_time: int, save_every: int = 5,
+                               tissue=None, pixel_scale_mm: float = 0.5):
     """
     Fast, vectorized Fisher-KPP simulation.
     - Constrained by the brain mask.
     - Correctly calculates steps based on the desired end_time.
+    - Optional `tissue` (tissue_maps.TissueMaps) makes D heterogeneous (gray/white matter).
+    - pixel_scale_mm: scan pixel spacing (case_metadata.CaseMetadata.spacing_mm).
     """
     # 1. Extract parameters
     D = params.get('D', 0.8)
     rho = params.get('rho', 0.5)
     beta = params.get('beta', 0.1)
     time_scale = params.get('time_scale', 'hours')
-    pixel_scale_mm = 0.5
+    D = _grid_diffusivity(D, pixel_scale_mm)
+    diffusivity_faces = tissue.diffusivity_faces if tissue is not None else None
 
-    # --- FIX: Calculate number of steps based on end_time ---
-    if time_scale == 'days':
-        # If one step is 2.4 hours, how many steps to reach end_time days?
-        dt = 2.4
-        steps = int((end_time * 24) / dt)
-    else:  # hours
-        # If one step is 0.1 hours, how many steps to reach end_time hours?
-        dt = 0.1
-        steps = int(end_time / dt)
-    # --------------------------------------------------------
+    dt, steps = _time_stepping(time_scale, end_time)
+    substeps = _grid_substeps(pixel_scale_mm)
 
     # 2. Initialize
     u = (initial_mask.astype(np.float32) / 255.0).clip(0, 1)
     brain_mask_float = (brain_mask.astype(np.float32) / 255.0).clip(0, 1)
 
     initial_pixels = np.sum(u > 0.5)
-    initial_radius_mm = np.sqrt(initial_pixels * (pixel_scale_mm**2) / np.pi) if initial_pixels > 0 else 0
+    initial_radius_mm = _equivalent_radius_mm(initial_pixels, pixel_scale_mm)
 
     frames = []
     metrics = []
@@ -41,19 +92,13 @@ def simulate_tumor_growth_fast(initial_mask: np.ndarray, brain_mask: np.ndarray,
         if step % 20 == 0:
             time.sleep(0.01)
 
-        laplacian = cv2.Laplacian(u, cv2.CV_32F)
-        reaction = rho * u * (1 - u) - beta * u
-        change_in_u = dt * (D * laplacian + reaction)
-
-        # Apply brain mask to stop growth
-        u += (change_in_u * brain_mask_float)
-
-        u = np.clip(u, 0.0, 1.0)
+        for _ in range(substeps):
+            _fisher_kpp_step(u, D, rho, beta, dt / substeps, brain_mask_float, diffusivity_faces)
 
         if step % save_every == 0 or step == steps:
             # Calculate metrics for this frame
             current_pixels = np.sum(u > 0.5)
-            current_radius_mm = np.sqrt(current_pixels * (pixel_scale_mm**2) / np.pi) if current_pixels > 0 else 0
+            current_radius_mm = _equivalent_radius_mm(current_pixels, pixel_scale_mm)
             growth_delta_mm = current_radius_mm - initial_radius_mm
 
             core_density = np.mean(u[u > 0.8]) if np.any(u > 0.8) else 0
@@ -76,4 +121,231 @@ def simulate_tumor_growth_fast(initial_mask: np.ndarray, brain_mask: np.ndarray,
             frame_img = (u * 255).astype(np.uint8)
             frames.append(cv2.cvtColor(frame_img, cv2.COLOR_GRAY2BGR))
 
-    return frames, metrics
\ No newline at end of file
+    return frames, metrics
+
+# =============================================================================
+#  BATCHED KERNEL (Many parameter sets in one stacked array)
+# =============================================================================
+
+def _laplacian_stack(u, out):
+    """
+    5-point Laplacian over the last two axes of an (N, H, W) stack.
+    Matches cv2.Laplacian(ksize=1) with its default reflect-101 border.
+    """
+    np.multiply(u, -4.0, out=out)
+    out[:, 1:, :] += u[:, :-1, :]
+    out[:, :-1, :] += u[:, 1:, :]
+    out[:, :, 1:] += u[:, :, :-1]
+    out[:, :, :-1] += u[:, :, 1:]
+    # Reflect-101 border: the missing neighbour mirrors the first interior row/column
+    out[:, 0, :] += u[:, 1, :]
+    out[:, -1, :] += u[:, -2, :]
+    out[:, :, 0] += u[:, :, 1]
+    out[:, :, -1] += u[:, :, -2]
+    return out
+
+@instrumentation.instrumented("growth.simulate_tumor_growth_batch")
+def simulate_tumor_growth_batch(initial_mask: np.ndarray, brain_mask: np.ndarray, D, rho, beta, end_time: int,
+                                time_scale: str = 'hours', save_every: int = 5, diffusivity_faces=None,
+                                pixel_scale_mm: float = 0.5):
+    """
+    Vectorized Fisher-KPP for N parameter sets at once.
+    - `u` is an (N, H, W) float32 stack advanced by one stencil per step.
+    - D, rho, beta are scalars or length-N arrays (broadcast per member).
+    - initial_mask may be a single (H, W) mask shared by all members or an (N, H, W) stack.
+    - diffusivity_faces (from tissue_maps) switches to the variable-coefficient stencil.
+    - pixel_scale_mm: scan pixel spacing; D is rescaled to it (see D_REFERENCE_SPACING_MM).
+    Returns (times, growth_delta_mm of shape (N, T), final u stack).
+    """
+    D = _grid_diffusivity(np.asarray(D, dtype=np.float32), pixel_scale_mm)
+    D, rho, beta = (np.atleast_1d(np.asarray(p, dtype=np.float32)) for p in (D, rho, beta))
+    n_members = max(D.size, rho.size, beta.size, initial_mask.shape[0] if initial_mask.ndim == 3 else 1)
+    D, rho, beta = (np.broadcast_to(p, (n_members,)).reshape(-1, 1, 1) for p in (D, rho, beta))
+
+    dt, steps = _time_stepping(time_scale, end_time)
+    substeps = _grid_substeps(pixel_scale_mm)
+    sub_dt = dt / substeps
+
+    # 1. Initialize the stack and work buffers once
+    u0 = (initial_mask.astype(np.float32) / 255.0).clip(0, 1)
+    u = np.empty((n_members,) + u0.shape[-2:], dtype=np.float32)
+    u[:] = u0
+    brain_mask_float = (brain_mask.astype(np.float32) / 255.0).clip(0, 1)
+
+    laplacian = np.empty_like(u)
+    reaction = np.empty_like(u)
+    D_dt = D * sub_dt
+    rho_dt = rho * sub_dt
+    beta_dt = beta * sub_dt
+
+    initial_pixels = np.count_nonzero(u > 0.5, axis=(1, 2))
+    initial_radius_mm = np.sqrt(initial_pixels * (pixel_scale_mm**2) / np.pi)
+
+    times = []
+    growth = []
+
+    # 2. Simulation Loop (one stencil advances every member)
+    for step in range(1, steps + 1):
+        for _ in range(substeps):
+            if diffusivity_faces is None:
+                _laplacian_stack(u, laplacian)
+            else:
+                tissue_maps.divergence(u, diffusivity_faces, out=laplacian)
+            laplacian *= D_dt
+
+            # reaction = sub_dt * (rho * u * (1 - u) - beta * u)
+            np.subtract(1.0, u, out=reaction)
+            reaction *= rho_dt
+            reaction -= beta_dt
+            reaction *= u
+
+            laplacian += reaction
+            laplacian *= brain_mask_float
+            u += laplacian
+            np.clip(u, 0.0, 1.0, out=u)
+
+        if step % save_every == 0 or step == steps:
+            current_pixels = np.count_nonzero(u > 0.5, axis=(1, 2))
+            current_radius_mm = np.sqrt(current_pixels * (pixel_scale_mm**2) / np.pi)
+            growth.append(current_radius_mm - initial_radius_mm)
+            times.append(step * dt / 24 if time_scale == 'days' else step * dt)
+
+    times = np.asarray(times, dtype=np.float32)
+    growth_delta_mm = np.stack(growth, axis=1) if growth else np.zeros((n_members, 0), dtype=np.float32)
+    return times, growth_delta_mm, u
+
+# =============================================================================
+#  UNCERTAINTY ENSEMBLE (Parameter sweep over D, rho, beta)
+# =============================================================================
+
+def sample_growth_parameters(distributions: dict, n_members: int, seed=None):
+    """
+    Draws n_members parameter sets from per-parameter distributions.
+
+    Each entry of `distributions` is either a fixed number or a tuple:
+      ('normal', mean, std), ('lognormal', median, sigma), ('uniform', low, high)
+    Samples are kept strictly positive, since D, rho and beta are rates.
+    Returns a list of dicts usable as `params` for the growth model.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, spec in distributions.items():
+        if np.isscalar(spec):
+            columns[name] = np.full(n_members, float(spec))
+            continue
+        kind, a, b = spec
+        if kind == 'normal':
+            values = rng.normal(a, b, n_members)
+        elif kind == 'lognormal':
+            values = a * np.exp(rng.normal(0.0, b, n_members))
+        elif kind == 'uniform':
+            values = rng.uniform(a, b, n_members)
+        else:
+            raise ValueError(f"Unknown distribution '{kind}' for parameter '{name}'")
+        columns[name] = np.clip(values, 1e-6, None)
+
+    return [{name: float(col[i]) for name, col in columns.items()} for i in range(n_members)]
+
+# Shared-memory views attached once per worker process
+_ENSEMBLE_INPUTS = {}
+
+def _attach_ensemble_inputs(initial_name, brain_name, shape, diffusivity_faces=None, pixel_scale_mm=0.5):
+    # Attached by name: works under spawn. Spawned workers share the parent's resource
+    # tracker, so their registration is the parent's and the parent's unlink clears it.
+    initial_shm = shared_memory.SharedMemory(name=initial_name)
+    brain_shm = shared_memory.SharedMemory(name=brain_name)
+    _ENSEMBLE_INPUTS['shm'] = (initial_shm, brain_shm)  # Keep handles alive
+    _ENSEMBLE_INPUTS['initial_mask'] = np.ndarray(shape, dtype=np.uint8, buffer=initial_shm.buf)
+    _ENSEMBLE_INPUTS['brain_mask'] = np.ndarray(shape, dtype=np.uint8, buffer=brain_shm.buf)
+    _ENSEMBLE_INPUTS['diffusivity_faces'] = diffusivity_faces
+    _ENSEMBLE_INPUTS['pixel_scale_mm'] = pixel_scale_mm
+
+def _run_ensemble_chunk(chunk_params, time_scale, end_time, save_every):
+    """Runs a chunk of members as one batched stack; returns their growth curves and invaded areas."""
+    initial_mask = _ENSEMBLE_INPUTS['initial_mask']
+    brain_mask = _ENSEMBLE_INPUTS['brain_mask']
+
+    D = [p.get('D', 0.8) for p in chunk_params]
+    rho = [p.get('rho', 0.5) for p in chunk_params]
+    beta = [p.get('beta', 0.1) for p in chunk_params]
+    _, growth_delta_mm, u = simulate_tumor_growth_batch(
+        initial_mask, brain_mask, D, rho, beta, end_time, time_scale=time_scale, save_every=save_every,
+        diffusivity_faces=_ENSEMBLE_INPUTS['diffusivity_faces'], pixel_scale_mm=_ENSEMBLE_INPUTS['pixel_scale_mm'])
+
+    # Pack the final invasion masks to keep the result transfer small
+    return growth_delta_mm.astype(np.float32), np.packbits(u > 0.5, axis=-1)
+
+@instrumentation.instrumented("growth.run_growth_ensemble")
+def run_growth_ensemble(initial_mask: np.ndarray, brain_mask: np.ndarray, distributions: dict, end_time: int,
+                        n_members: int = 100, time_scale: str = 'hours', save_every: int = 5,
+                        percentiles=(5, 50, 95), max_workers=None, chunk_size=8, seed=None, tissue=None,
+                        pixel_scale_mm=0.5):
+    """
+    Runs an ensemble of Fisher-KPP members on a process pool and streams results.
+
+    The masks are placed in shared memory once, so workers do not receive a copy
+    per member. Members are grouped into chunks of `chunk_size` that each run as
+    one batched stack (see simulate_tumor_growth_batch), so the stencil setup
+    and Python loop overhead are paid per chunk rather than per member.
+    This is a generator: after every finished chunk it yields
+        {
+          "completed": int, "n_members": int,
+          "times": (T,) array,
+          "growth_delta_percentiles": {p: (T,) array},
+          "invasion_probability": (H, W) float32 in [0, 1]
+        }
+    so the caller can refresh the forecast bands while the ensemble is running.
+    Optional `tissue` (tissue_maps.TissueMaps) is shipped to each worker once.
+    pixel_scale_mm is the scan pixel spacing (case_metadata.CaseMetadata.spacing_mm).
+    Workers are spawned, not forked: the caller may be a multithreaded (Qt) process.
+    """
+    members = sample_growth_parameters(distributions, n_members, seed=seed)
+    dt, steps = _time_stepping(time_scale, end_time)
+    saved_steps = [s for s in range(1, steps + 1) if s % save_every == 0 or s == steps]
+    times = np.asarray(saved_steps, dtype=np.float32) * dt
+    if time_scale == 'days':
+        times /= 24
+
+    initial_mask = np.ascontiguousarray(initial_mask, dtype=np.uint8)
+    brain_mask = np.ascontiguousarray(brain_mask, dtype=np.uint8)
+    shape = initial_mask.shape
+
+    initial_shm = shared_memory.SharedMemory(create=True, size=initial_mask.nbytes)
+    brain_shm = shared_memory.SharedMemory(create=True, size=brain_mask.nbytes)
+    try:
+        np.ndarray(shape, dtype=np.uint8, buffer=initial_shm.buf)[:] = initial_mask
+        np.ndarray(shape, dtype=np.uint8, buffer=brain_shm.buf)[:] = brain_mask
+
+        curves = np.zeros((n_members, len(saved_steps)), dtype=np.float32)
+        invasion_counts = np.zeros(shape, dtype=np.uint16)
+        completed = 0
+
+        workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_attach_ensemble_inputs,
+                                 initargs=(initial_shm.name, brain_shm.name, shape,
+                                           tissue.diffusivity_faces if tissue is not None else None,
+                                           pixel_scale_mm)) as pool:
+            futures = [
+                pool.submit(_run_ensemble_chunk, members[i:i + chunk_size], time_scale, end_time, save_every)
+                for i in range(0, n_members, chunk_size)
+            ]
+            for future in as_completed(futures):
+                chunk_curves, packed_masks = future.result()
+                n_chunk = chunk_curves.shape[0]
+                curves[completed:completed + n_chunk] = chunk_curves
+                invaded = np.unpackbits(packed_masks, axis=-1, count=shape[1])
+                invasion_counts += invaded.sum(axis=0, dtype=np.uint16)
+                completed += n_chunk
+
+                bands = np.percentile(curves[:completed], percentiles, axis=0)
+                yield {
+                    "completed": completed,
+                    "n_members": n_members,
+                    "times": times,
+                    "growth_delta_percentiles": {p: band for p, band in zip(percentiles, bands)},
+                    "invasion_probability": invasion_counts.astype(np.float32) / completed
+                }
+    finally:
+        initial_shm.close(); initial_shm.unlink()
+        brain_shm.close(); brain_shm.unlink()
@@ -1,28 +1,34 @@
 import numpy as np
+import cv2
+from scipy import ndimage
+
+MIN_LESION_AREA_MM2 = 25.0  # Smaller components are treated as segmentation noise
+MIN_LESION_FRACTION = 0.1   # ... as are components under 10% of the largest lesion
 
 def measure_tumor_advanced(tumor_mask, pixel_spacing=(0.5, 0.5)):
     """
     Task 3: Advanced Tumor Measurement using PCA.
     Input: Binary Mask (0/255 or 0/1)
     Output: Dictionary of geometric properties
+    Area, centroid and covariance come from image moments (one pass, no
+    pixel coordinate list), so memory does not grow with the tumor size.
     """
-    # Normalize mask to 0 and 1
-    binary_mask = (tumor_mask > 127).astype(int)
-    
-    coords = np.column_stack(np.where(binary_mask == 1))
-    
-    if coords.shape[0] == 0:
+    # Normalize mask to 0 and 1 (a uint8 view of the bool mask, no extra copy)
+    binary_mask = (np.asarray(tumor_mask) > 127).view(np.uint8)
+
+    moments = cv2.moments(binary_mask, binaryImage=True)
+    area_pixels = moments['m00']
+    if area_pixels == 0:
         return None
 
     sx, sy = pixel_spacing
 
     # 1. Area
-    area_pixels = coords.shape[0]
     area_mm2 = area_pixels * sx * sy
 
-    # 2. Bounding box (Note: numpy returns y,x)
-    y_min, x_min = coords.min(axis=0)
-    y_max, x_max = coords.max(axis=0)
+    # 2. Bounding box
+    x_min, y_min, w, h = cv2.boundingRect(binary_mask)
+    x_max, y_max = x_min + w - 1, y_min + h - 1
 
     center_y = (y_min + y_max) / 2
     center_x = (x_min + x_max) / 2
@@ -34,28 +40,35 @@ def measure_tumor_advanced(tumor_mask, pixel_spacing=(0.5, 0.5)):
     # 4. Equivalent Diameter
     ECD = 2 * np.sqrt(area_mm2 / np.pi)
 
-    # 5. Shape descriptors using PCA
-    try:
-        coords_centered = coords - np.array([[y_min, x_min]]) # Align to 0,0 for stability
-        cov = np.cov(coords_centered, rowvar=False)
-        eigenvalues, eigenvectors = np.linalg.eig(cov)
-        
-        # Sort eigenvalues
-        eigenvalues = np.sort(eigenvalues)[::-1]
-        
-        major = 2 * np.sqrt(abs(eigenvalues[0])) # Scale factor approx
-        minor = 2 * np.sqrt(abs(eigenvalues[1]))
-        
+    # 5. Shape descriptors using PCA of the 2x2 covariance (central moments, sample covariance)
+    if area_pixels > 1:
+        cov = np.array([[moments['mu20'], moments['mu11']],
+                        [moments['mu11'], moments['mu02']]]) / (area_pixels - 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(cov)  # Ascending
+        major = 2 * np.sqrt(abs(eigenvalues[1])) # Scale factor approx
+        minor = 2 * np.sqrt(abs(eigenvalues[0]))
+        axis_x, axis_y = eigenvectors[:, 1]
+        if axis_x < 0 or (axis_x == 0 and axis_y < 0):
+            axis_x, axis_y = -axis_x, -axis_y
+
+        # Extent along the principal axis (for multi-fiber placement): the
+        # extreme pixels lie on the outer contours, so only those are projected
+        contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        points = np.concatenate(contours).reshape(-1, 2)
+        projections = points @ np.array([axis_x, axis_y])
+        axis_length_px = float(projections.max() - projections.min())
+
         if major == 0: major = 1 # Avoid div by zero
         if minor == 0: minor = 1
 
         eccentricity = np.sqrt(1 - (minor**2 / major**2)) if major > minor else 0
         elongation = major / minor
-        
-    except:
-        # Fallback if PCA fails (e.g. single pixel tumor)
+    else:
+        # Single pixel tumor: no shape to speak of
         eccentricity = 0.0
         elongation = 1.0
+        axis_x, axis_y = 1.0, 0.0
+        axis_length_px = 0.0
 
     return {
         "area_mm2": round(area_mm2, 2),
@@ -65,5 +78,73 @@ def measure_tumor_advanced(tumor_mask, pixel_spacing=(0.5, 0.5)):
         "equivalent_diameter_mm": round(ECD, 2),
         "eccentricity": round(eccentricity, 3),
         "elongation": round(elongation, 2),
-        "bbox": (int(x_min), int(x_max), int(y_min), int(y_max))
-    }
\ No newline at end of file
+        "bbox": (int(x_min), int(x_max), int(y_min), int(y_max)),
+        "principal_axis": (round(float(axis_x), 4), round(float(axis_y), 4)), # Unit vector (x, y)
+        "axis_length_px": round(axis_length_px, 1)
+    }
+
+
+def measure_lesions(tumor_mask, pixel_spacing=(0.5, 0.5), min_area_mm2=MIN_LESION_AREA_MM2,
+                    min_fraction=MIN_LESION_FRACTION):
+    """
+    Multi-lesion measurement: every connected component of the mask at least
+    min_area_mm2 and min_fraction of the largest one, largest first.
+    All components are measured together with label-indexed reductions
+    (areas, centroids, second moments, bounding boxes), so the cost does not
+    grow with the number of lesions.
+    Returns (lesions, labels): a list of dicts and the label image (0 = background).
+    """
+    binary_mask = tumor_mask > 127
+    labels, n = ndimage.label(binary_mask)
+    if n == 0:
+        return [], labels
+
+    sx, sy = pixel_spacing
+    index = np.arange(1, n + 1)
+    ys, xs = np.indices(labels.shape, dtype=np.float64)
+
+    # --- 1. Zeroth, first and second moments of all lesions ---
+    count = ndimage.sum_labels(binary_mask, labels, index)
+    mean_x = ndimage.sum_labels(xs, labels, index) / count
+    mean_y = ndimage.sum_labels(ys, labels, index) / count
+    sxx = ndimage.sum_labels(xs * xs, labels, index) / count - mean_x**2
+    syy = ndimage.sum_labels(ys * ys, labels, index) / count - mean_y**2
+    sxy = ndimage.sum_labels(xs * ys, labels, index) / count - mean_x * mean_y
+
+    # --- 2. PCA of the 2x2 covariance (sample covariance, as np.cov) in closed form ---
+    ddof = np.where(count > 1, count / np.maximum(count - 1, 1), 0.0)
+    cxx, cyy, cxy = sxx * ddof, syy * ddof, sxy * ddof
+    half_trace = (cxx + cyy) / 2
+    root = np.sqrt(((cxx - cyy) / 2)**2 + cxy**2)
+    major = 2 * np.sqrt(np.abs(half_trace + root))
+    minor = 2 * np.sqrt(np.abs(half_trace - root))
+    major[major == 0] = 1
+    minor[minor == 0] = 1
+    eccentricity = np.where(major > minor, np.sqrt(np.clip(1 - minor**2 / major**2, 0, 1)), 0.0)
+    elongation = major / minor
+
+    # --- 3. Areas and bounding boxes ---
+    area_mm2 = count * sx * sy
+    ecd = 2 * np.sqrt(area_mm2 / np.pi)
+    boxes = ndimage.find_objects(labels)
+
+    keep = (area_mm2 >= min_area_mm2) & (area_mm2 >= min_fraction * area_mm2.max())
+    lesions = []
+    for i in np.argsort(-count):
+        if not keep[i]:
+            continue
+        rows, cols = boxes[i]
+        x_min, x_max, y_min, y_max = cols.start, cols.stop - 1, rows.start, rows.stop - 1
+        lesions.append({
+            "label": int(index[i]),
+            "area_mm2": round(float(area_mm2[i]), 2),
+            "center": (int((x_min + x_max) / 2), int((y_min + y_max) / 2)),  # Bbox center, as measure_tumor_advanced
+            "centroid": (int(round(mean_x[i])), int(round(mean_y[i]))),
+            "width_mm": round((x_max - x_min) * sx, 2),
+            "height_mm": round((y_max - y_min) * sy, 2),
+            "equivalent_diameter_mm": round(float(ecd[i]), 2),
+            "eccentricity": round(float(eccentricity[i]), 3),
+            "elongation": round(float(elongation[i]), 2),
+            "bbox": (int(x_min), int(x_max), int(y_min), int(y_max))
+        })
+    return lesions, labels
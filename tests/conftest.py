@@ -0,0 +1,19 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def phantom():
+    """128 x 128 case at 0.5 mm: round brain, elliptical tumor (uint8 masks, 255 inside)."""
+    n = 128
+    brain = np.zeros((n, n), dtype=np.uint8)
+    cv2.circle(brain, (n // 2, n // 2), 56, 255, -1)
+    tumor = np.zeros((n, n), dtype=np.uint8)
+    cv2.ellipse(tumor, (n // 2, n // 2), (7, 5), 30, 0, 360, 255, -1)
+    return {'brain_mask': brain, 'tumor_mask': tumor, 'center': (n // 2, n // 2)}
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import ai_core
+import laser_physics
+import tissue_maps
+
+
+def _run(phantom, power, controller=False, target_temp=60.0, max_time_s=1200.0):
+    """Phantom run with the AI safety engine, stepped like the GUI worker. Returns (sim, action, message)."""
+    brain, tumor = phantom['brain_mask'], phantom['tumor_mask']
+    tissue = tissue_maps.TissueMaps(np.where(brain > 0, 1, 0), brain)
+    sim = laser_physics.AblationSimulation(
+        37.0, target_temp, power, laser_physics.lumped_mask_area(np.count_nonzero(tumor), 0.5),
+        tumor_centroid=phantom['center'], field_shape=tumor.shape, tissue=tissue,
+        tumor_mask=tumor, brain_mask=brain, pixel_spacing_mm=0.5)
+    ai = ai_core.SurgicalAI()
+    ai.set_margin_ring(tumor, brain, pixel_spacing_mm=0.5)
+    mpc = ai_core.mpc_for_simulation(sim) if controller else None
+
+    act, msg = None, ""
+    while sim.sim_time < max_time_s:
+        act, _, msg = ai_core.ablation_step(sim, ai, mpc)
+        if act == "STOP" or sim.is_destroyed:
+            break
+    return sim, act, msg
+
+
+@pytest.mark.parametrize("controller, power", [(True, 1.0), (False, 1.0)], ids=["closed-loop", "open-loop"])
+def test_phantom_ablation_reaches_destroyed(phantom, controller, power):
+    sim, act, msg = _run(phantom, power, controller)
+
+    assert act != "STOP", msg
+    assert sim.is_destroyed
+    assert sim.dose_metrics['tumor_coverage'] >= laser_physics.ABLATION_COVERAGE
+    assert sim.dose_metrics['healthy_ablated_mm2'] == 0.0
+
+
+def test_closed_loop_tracks_the_field_tip(phantom):
+    sim, act, msg = _run(phantom, 1.0, controller=True, max_time_s=60.0)
+
+    assert act != "STOP", msg
+    assert abs(sim.core_temp - sim.target_temp) < 1.0
+    assert sim.core_temp == pytest.approx(float(sim.grid_field[sim.tip_index].max()))
+
+
+def test_overpowered_phantom_run_stops_on_the_tip_limit(phantom):
+    sim, act, msg = _run(phantom, 5.0)
+
+    assert act == "STOP" and not sim.is_destroyed
+    assert sim.core_temp >= sim.target_temp + 8.0
@@ -0,0 +1,72 @@
+import numpy as np
+
+import ablation_timeline
+
+
+def _fields(n, shape=(24, 32), seed=0):
+    rng = np.random.default_rng(seed)
+    field = np.full(shape, 37.0, dtype=np.float32)
+    for _ in range(n):
+        field = field + rng.normal(0.0, 0.3, shape).astype(np.float32)
+        field[10:14, 12:18] += 1.5  # Hot spot that keeps heating
+        yield field
+
+
+def _quantized(field):
+    return np.round(field / ablation_timeline.QUANTUM_C) * ablation_timeline.QUANTUM_C
+
+
+def test_round_trip_is_exact_to_the_quantum():
+    timeline = ablation_timeline.AblationTimeline(record_interval_s=0.0, keyframe_interval=5, max_frames=0)
+    fields = list(_fields(23))
+    for i, field in enumerate(fields):
+        timeline.record(i * 0.1, float(field.max()), 37.0, field)
+
+    for i in (22, 0, 7, 8, 9, 3, 15, 22):  # Random access, forward and backward, across chunks
+        np.testing.assert_allclose(timeline.field_at_index(i), _quantized(fields[i]), atol=1e-4)
+
+
+def test_frames_without_field_keep_later_indices():
+    timeline = ablation_timeline.AblationTimeline(record_interval_s=0.0, keyframe_interval=4, max_frames=0)
+    fields = list(_fields(12))
+    expected = []
+    timeline.record(0.0, 37.0, 37.0, None)  # Before the first field: no field to show
+    expected.append(None)
+    last = None
+    for i, field in enumerate(fields):
+        if i % 3 == 2:
+            timeline.record(i + 1.0, 40.0, 37.0, None)
+            expected.append(last)
+        else:
+            timeline.record(i + 1.0, 40.0, 37.0, field)
+            last = _quantized(field)
+            expected.append(last)
+
+    assert len(timeline) == len(expected)
+    for i, want in enumerate(expected):
+        got = timeline.field_at_index(i)
+        if want is None:
+            assert got is None
+        else:
+            np.testing.assert_allclose(got, want, atol=1e-4)
+
+
+def test_trimmed_timeline_and_export(tmp_path):
+    timeline = ablation_timeline.AblationTimeline(record_interval_s=0.0, keyframe_interval=4, max_frames=10)
+    fields = list(_fields(30))
+    timeline.record(0.0, 37.0, 37.0, None)
+    for i, field in enumerate(fields, 1):
+        timeline.record(float(i), 40.0, 37.0, field if i % 5 else None)
+
+    assert len(timeline) <= 10
+    first = timeline.times[0]
+    for i, t in enumerate(timeline.times):
+        k = int(t)  # Frame recorded at time k holds fields[k - 1], or the one before it
+        source = k if k % 5 else k - 1
+        np.testing.assert_allclose(timeline.field_at_index(i), _quantized(fields[source - 1]), atol=1e-4)
+
+    path = timeline.export(tmp_path / "run.npz")
+    with np.load(path) as data:
+        frames = sorted(name for name in data.files if name.startswith("frame_"))
+        assert frames == [f"frame_{i:06d}" for i in range(len(timeline))]
+        assert data['times'][0] == first
@@ -0,0 +1,18 @@
+import numpy as np
+
+import ai_core
+import laser_physics
+
+
+def test_margin_ring_is_healthy_tissue_beyond_the_margin(phantom):
+    tumor, brain = phantom['tumor_mask'], phantom['brain_mask']
+    ring = np.zeros(tumor.shape, dtype=bool)
+    ring.flat[ai_core.boundary_ring(tumor, brain, width_mm=2.0, pixel_spacing_mm=0.5)] = True
+    healthy = laser_physics.healthy_tissue_mask(tumor, brain, margin_mm=2.0, pixel_spacing_mm=0.5)
+
+    assert ring.any()
+    assert not np.any(ring & ~healthy)
+    # Every healthy pixel bordering the 2 mm margin is monitored
+    margin = (brain > 0) & ~healthy
+    border = healthy & (np.roll(margin, 1, 0) | np.roll(margin, -1, 0) | np.roll(margin, 1, 1) | np.roll(margin, -1, 1))
+    assert not np.any(border & ~ring)
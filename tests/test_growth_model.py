@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+import pytest
+
+import tissue_maps
+import tumor_growth_model
+
+
+def _single_curve(phantom, params, end_time, tissue=None, pixel_scale_mm=0.5):
+    _, metrics = tumor_growth_model.simulate_tumor_growth_fast(
+        phantom['tumor_mask'], phantom['brain_mask'], dict(params, time_scale='hours'), end_time,
+        tissue=tissue, pixel_scale_mm=pixel_scale_mm)
+    return np.array([m['growth_delta_mm'] for m in metrics])
+
+
+@pytest.mark.parametrize("heterogeneous", [False, True])
+def test_batch_matches_single_kernel(phantom, heterogeneous):
+    tissue = None
+    if heterogeneous:
+        classes = np.where(np.arange(128)[None, :] < 64, 1, 2).repeat(128, axis=0)
+        tissue = tissue_maps.TissueMaps(classes, phantom['brain_mask'])
+    members = [{'D': 0.8, 'rho': 0.5, 'beta': 0.1}, {'D': 1.6, 'rho': 0.9, 'beta': 0.05}]
+
+    times, growth, _ = tumor_growth_model.simulate_tumor_growth_batch(
+        phantom['tumor_mask'], phantom['brain_mask'], [m['D'] for m in members], [m['rho'] for m in members],
+        [m['beta'] for m in members], 6, diffusivity_faces=tissue.diffusivity_faces if tissue else None)
+
+    assert times[-1] == pytest.approx(6.0)
+    for i, params in enumerate(members):
+        np.testing.assert_allclose(growth[i], _single_curve(phantom, params, 6, tissue), atol=1e-6)
+
+
+def test_batch_matches_single_kernel_with_substeps(phantom):
+    times, growth, u = tumor_growth_model.simulate_tumor_growth_batch(
+        phantom['tumor_mask'], phantom['brain_mask'], 0.8, 0.5, 0.1, 4, pixel_scale_mm=0.2)
+    np.testing.assert_allclose(growth[0], _single_curve(phantom, {'D': 0.8}, 4, pixel_scale_mm=0.2), atol=1e-6)
+    # Substepped field stays smooth (no checkerboard from an unstable explicit step)
+    assert np.abs(np.diff(u[0], axis=1)).max() < 0.2
+
+
+def test_ensemble_runs_from_a_thread_on_spawned_workers(phantom):
+    # The GUI runs the ensemble from a QThread; workers attach the shared masks by name
+    distributions = {'D': ('normal', 0.8, 0.1), 'rho': ('normal', 0.5, 0.05), 'beta': 0.1}
+    updates = []
+    worker = threading.Thread(target=lambda: updates.extend(tumor_growth_model.run_growth_ensemble(
+        phantom['tumor_mask'], phantom['brain_mask'], distributions, 4, n_members=6,
+        max_workers=2, chunk_size=3, seed=1)))
+    worker.start()
+    worker.join()
+
+    assert [u['completed'] for u in updates] == [3, 6]
+    final = updates[-1]
+    assert final['invasion_probability'].shape == phantom['tumor_mask'].shape
+    for band in final['growth_delta_percentiles'].values():
+        assert band.shape == final['times'].shape
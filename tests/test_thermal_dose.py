@@ -0,0 +1,35 @@
+import numpy as np
+
+import laser_physics
+
+
+def _reference(fields, dt):
+    """Dose summed over the whole frame with the accumulator's own tables, and the pixels ever warm."""
+    acc = laser_physics.ThermalDoseAccumulator(fields[0].shape, dt)
+    cem43 = np.zeros(fields[0].shape, dtype=np.float32)
+    omega = np.zeros(fields[0].shape, dtype=np.float32)
+    warm = np.zeros(fields[0].shape, dtype=bool)
+    for T in fields:
+        warm |= T > laser_physics.DOSE_FLOOR_C
+        index = np.clip((T - laser_physics.DOSE_TABLE_MIN_C) * (1.0 / laser_physics.DOSE_TABLE_STEP_C),
+                        0, acc.last_index).astype(np.int32)
+        cem43 += acc.cem43_table[index]
+        omega += acc.omega_table[index]
+    return cem43, omega, warm
+
+
+def test_fast_moving_heat_is_not_lost_outside_the_roi():
+    # A 60 C spot that crosses the frame at 3 px per step: far faster than the
+    # roi_pad reach between two scheduled ROI refreshes
+    yy, xx = np.mgrid[0:64, 0:160]
+    fields = [np.where((yy - 32) ** 2 + (xx - 10 - 3 * k) ** 2 <= 16, 60.0, 37.0).astype(np.float32)
+              for k in range(45)]
+
+    acc = laser_physics.ThermalDoseAccumulator(fields[0].shape, 0.1)
+    for T in fields:
+        acc.update(T)
+    cem43, omega, warm = _reference(fields, 0.1)
+
+    # Pixels that never pass DOSE_FLOOR_C are skipped by design
+    np.testing.assert_allclose(acc.cem43[warm], cem43[warm], rtol=1e-5)
+    np.testing.assert_allclose(acc.omega[warm], omega[warm], rtol=1e-5)
@@ -0,0 +1,49 @@
+import threading
+
+import numpy as np
+import pytest
+
+import ai_core
+import laser_physics
+import tissue_maps
+import treatment_optimizer
+import tumor_measurement
+
+
+@pytest.mark.parametrize("wavelength_nm", [None, 1064], ids=["gaussian", "1064nm"])
+def test_optimized_plan_runs_to_destroyed(phantom, wavelength_nm):
+    brain, tumor = phantom['brain_mask'], phantom['tumor_mask']
+    tissue = tissue_maps.TissueMaps(np.where(brain > 0, 1, 0), brain)
+    stats = tumor_measurement.measure_tumor_advanced(tumor)
+
+    # From a thread, as the GUI's QThread worker calls it (the pool is spawned)
+    out = {}
+    worker = threading.Thread(target=lambda: out.update(plan=treatment_optimizer.optimize_treatment(
+        tumor, brain, stats, tissue, max_workers=2, target_temp=60.0, wavelength_nm=wavelength_nm)))
+    worker.start()
+    worker.join()
+    plan = out['plan']
+    assert plan['feasible'] and plan['coverage'] >= laser_physics.ABLATION_COVERAGE
+
+    # The live run with the plan's settings ablates the tumor without a STOP
+    sim = laser_physics.AblationSimulation(
+        37.0, 60.0, plan['power_W'], laser_physics.lumped_mask_area(np.count_nonzero(tumor), 0.5),
+        tumor_centroid=phantom['center'], field_shape=tumor.shape, tissue=tissue,
+        fiber_tips=plan['fiber_tips'], tumor_mask=tumor, brain_mask=brain, wavelength_nm=wavelength_nm)
+    ai = ai_core.SurgicalAI()
+    ai.set_margin_ring(tumor, brain)
+    act, msg = None, ""
+    while sim.sim_time < plan['duration_s'] + 60.0:
+        act, _, msg = ai_core.ablation_step(sim, ai)
+        if act == "STOP" or sim.is_destroyed:
+            break
+    assert act != "STOP", msg
+    assert sim.is_destroyed
+
+
+def test_low_coverage_plans_are_infeasible():
+    plan = {'n_fibers': 1, 'power_W': 1.0, 'duration_s': 600.0, 'coverage': 0.37,
+            'healthy_peak_C': 40.0, 'stopped': False}
+    assert not treatment_optimizer.is_feasible(plan)
+    assert not treatment_optimizer.is_feasible(dict(plan, coverage=1.0, stopped=True))
+    assert treatment_optimizer.is_feasible(dict(plan, coverage=1.0))